@@ -0,0 +1,13 @@
+-- Metadata for the paginated version history (GET /drafts/{id}/versions).
+-- Run before save_draft_version.sql, which fills these columns on every save.
+
+ALTER TABLE draft_versions ADD COLUMN IF NOT EXISTS content_size integer;
+ALTER TABLE draft_versions ADD COLUMN IF NOT EXISTS author_id text;
+ALTER TABLE draft_versions ADD COLUMN IF NOT EXISTS author_name text;
+
+UPDATE draft_versions SET content_size = length(content)
+WHERE content_size IS NULL AND content IS NOT NULL;
+
+-- keyset pagination: ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS draft_versions_history_idx
+    ON draft_versions (draft_id, created_at DESC, id DESC);
@@ -0,0 +1,15 @@
+-- Delta-encoded draft versions (see src/draft_delta.py).
+-- Snapshot rows keep full `content`; other rows store a token diff in `delta`
+-- against `base_version`. Existing rows are untouched and read as snapshots.
+
+ALTER TABLE draft_versions ALTER COLUMN content DROP NOT NULL;
+ALTER TABLE draft_versions ADD COLUMN IF NOT EXISTS delta jsonb;
+ALTER TABLE draft_versions ADD COLUMN IF NOT EXISTS base_version integer;
+
+ALTER TABLE draft_versions DROP CONSTRAINT IF EXISTS draft_versions_content_or_delta;
+ALTER TABLE draft_versions ADD CONSTRAINT draft_versions_content_or_delta
+    CHECK (content IS NOT NULL OR (delta IS NOT NULL AND base_version IS NOT NULL));
+
+-- chain lookups: latest N versions of a draft
+CREATE INDEX IF NOT EXISTS draft_versions_draft_version_idx
+    ON draft_versions (draft_id, version_number DESC);
@@ -0,0 +1,10 @@
+-- Per-user template search (src/supabase_vector.py) filters on user_templates_vector.user_id.
+-- Tables created before the column existed need this once; the API also applies it
+-- idempotently at startup (migrate_user_templates_table).
+
+-- STORED generated column over metadata->>'user_id', so writers that only fill metadata keep working
+ALTER TABLE user_templates_vector
+    ADD COLUMN IF NOT EXISTS user_id text GENERATED ALWAYS AS (metadata->>'user_id') STORED;
+
+CREATE INDEX IF NOT EXISTS user_templates_vector_user_id_idx
+    ON user_templates_vector (user_id);
@@ -0,0 +1,78 @@
+-- Atomic, single round-trip draft save (called from routes/drafts.py via RPC).
+-- Requires migrate_draft_versions_delta.sql and draft_versions_history.sql.
+
+ALTER TABLE draft_versions ADD COLUMN IF NOT EXISTS content_hash text;
+
+-- two concurrent saves can no longer get the same version number
+-- (rows duplicated by that race before this migration must be renumbered first:
+--  SELECT draft_id, version_number FROM draft_versions GROUP BY 1, 2 HAVING count(*) > 1)
+CREATE UNIQUE INDEX IF NOT EXISTS draft_versions_draft_version_key
+    ON draft_versions (draft_id, version_number);
+
+-- Returns {"status": "saved" | "unchanged" | "conflict", "version": int, "id": uuid}.
+--  * unchanged: p_content_hash equals the latest version's hash; nothing written.
+--  * conflict:  p_delta was computed against a base that is no longer the latest
+--               version; the caller re-plans against the current head and retries.
+DROP FUNCTION IF EXISTS save_draft_version(uuid, text, text, jsonb, integer, text);
+
+CREATE OR REPLACE FUNCTION save_draft_version(
+    p_draft_id uuid,
+    p_content text,
+    p_content_hash text,
+    p_delta jsonb DEFAULT NULL,
+    p_base_version integer DEFAULT NULL,
+    p_base_hash text DEFAULT NULL,
+    p_author_id text DEFAULT NULL,
+    p_author_name text DEFAULT NULL
+) RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_latest integer;
+    v_latest_hash text;
+    v_next integer;
+    v_id uuid;
+BEGIN
+    -- serialize saves of the same draft
+    PERFORM 1 FROM drafts WHERE id = p_draft_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'draft % not found', p_draft_id USING ERRCODE = 'no_data_found';
+    END IF;
+
+    SELECT version_number, content_hash INTO v_latest, v_latest_hash
+    FROM draft_versions
+    WHERE draft_id = p_draft_id
+    ORDER BY version_number DESC
+    LIMIT 1;
+
+    IF v_latest IS NOT NULL AND v_latest_hash = p_content_hash THEN
+        RETURN jsonb_build_object('status', 'unchanged', 'version', v_latest);
+    END IF;
+
+    IF p_delta IS NOT NULL AND (v_latest IS DISTINCT FROM p_base_version
+                                OR v_latest_hash IS DISTINCT FROM p_base_hash) THEN
+        RETURN jsonb_build_object('status', 'conflict', 'version', v_latest);
+    END IF;
+
+    v_next := COALESCE(v_latest, 0) + 1;
+
+    INSERT INTO draft_versions (draft_id, version_number, content, delta, base_version, content_hash,
+                                content_size, author_id, author_name)
+    VALUES (
+        p_draft_id,
+        v_next,
+        CASE WHEN p_delta IS NULL THEN p_content END,
+        p_delta,
+        CASE WHEN p_delta IS NOT NULL THEN p_base_version END,
+        p_content_hash,
+        length(p_content),
+        p_author_id,
+        p_author_name
+    )
+    RETURNING id INTO v_id;
+
+    UPDATE drafts SET content = p_content WHERE id = p_draft_id;
+
+    RETURN jsonb_build_object('status', 'saved', 'version', v_next, 'id', v_id);
+END;
+$$;
@@ -1,5 +1,6 @@
 # backend/scripts/ingest_templates.py
 import sys
+import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -14,34 +15,73 @@ load_dotenv()
 # === Imports ===
 from src.templates_data import TEMPLATES
 from src.llm import embed_texts
-from src.supabase_vector import upsert_text_chunks, create_tables_if_not_exists
+from src.embeddings import EMBED_MODEL
+from src.supabase_vector import upsert_text_chunks, create_tables_if_not_exists, create_vector_index, delete_chunks
+from src.ingest_manifest import INGEST_STATE_DIR, IngestManifest, EmbeddingCache, record_hash
+
+MANIFEST_SOURCE = "templates_data"
 
 
 # ------------------ INGEST ------------------
 
-def ingest_templates():
-    """Embed and store all templates into the 'templates' table."""
+def ingest_templates(full: bool = False, use_cache: bool = True, state_dir: Path = INGEST_STATE_DIR):
+    """
+    Embed and store all templates into the 'templates' table.
+    Only templates whose content/metadata changed since the last run are
+    re-embedded and upserted; templates removed from TEMPLATES are deleted.
+    """
     create_tables_if_not_exists(768)
 
-    records = []
+    manifest = IngestManifest(state_dir / "manifest.json")
+    manifest.start("templates", MANIFEST_SOURCE, None)
+
+    pending = []
     for tmpl in TEMPLATES:
-        emb = embed_texts([tmpl["content"]])[0]
-        rec = {
+        metadata = {
+            "title": tmpl["title"],
+            "subject": tmpl.get("subject", "general"),
+            "type": "template"
+        }
+        h = record_hash(tmpl["content"], metadata)
+        if not full and manifest.has_chunk("templates", MANIFEST_SOURCE, tmpl["id"], h):
+            continue
+        pending.append({
             "id": tmpl["id"],
             "document": tmpl["content"],
-            "metadata": {
-                "title": tmpl["title"],
-                "subject": tmpl.get("subject", "general"),
-                "type": "template"
-            },
-            "embedding": emb
-        }
-        records.append(rec)
+            "metadata": metadata,
+            "source": MANIFEST_SOURCE,
+            "hash": h,
+        })
 
-    upsert_text_chunks("templates", records)
-    print(f"✅ Ingested {len(records)} templates into Supabase Postgres.")
+    if pending:
+        texts = [r["document"] for r in pending]
+        if use_cache:
+            cache = EmbeddingCache(EMBED_MODEL, state_dir / "embeddings.sqlite")
+            embeddings = cache.embed(texts, embed_texts)
+            cache.close()
+        else:
+            embeddings = embed_texts(texts)
+        for rec, emb in zip(pending, embeddings):
+            rec["embedding"] = emb
+
+        upsert_text_chunks(
+            "templates", pending,
+            on_batch_committed=lambda batch: manifest.checkpoint("templates", batch),
+        )
+
+    removed = manifest.complete("templates", MANIFEST_SOURCE, [t["id"] for t in TEMPLATES], delete_chunks)
+    # No-op while the table is below VECTOR_INDEX_MIN_ROWS (exact search is faster there)
+    create_vector_index("templates")
+
+    print(f"✅ Ingested {len(pending)} changed templates into Supabase Postgres "
+          f"({len(TEMPLATES) - len(pending)} unchanged, {removed} removed).")
 
 
 if __name__ == "__main__":
-    ingest_templates()
+    parser = argparse.ArgumentParser(description="Ingest templates_data.TEMPLATES into the 'templates' table.")
+    parser.add_argument("--full", action="store_true", help="re-upsert every template, ignoring the manifest")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the on-disk embedding cache")
+    args = parser.parse_args()
+
+    ingest_templates(full=args.full, use_cache=not args.no_cache)
     print("🎉 All templates ingested successfully!")
@@ -1,7 +1,13 @@
 # backend/scripts/ingest_textbooks.py
 import os
 import sys
+import time
+import queue
+import argparse
+import threading
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 import pdfplumber
 from dotenv import load_dotenv
 
@@ -14,30 +20,50 @@ sys.path.insert(0, str(SRC_DIR))
 load_dotenv()
 
 # === Imports ===
-from src.llm import embed_texts
-from src.supabase_vector import upsert_text_chunks, create_tables_if_not_exists
+from src.llm import embed_texts, get_embedding_stats
+from src.embeddings import EMBED_BATCH_SIZE, EMBED_MODEL
+from src.supabase_vector import (
+    upsert_text_chunks, create_tables_if_not_exists, create_vector_index, delete_chunks,
+    UPSERT_BATCH_SIZE, VECTOR_INDEX_METHOD,
+)
+from src.chunking import CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, chunk_pages
+from src.ingest_manifest import (
+    INGEST_STATE_DIR, IngestManifest, EmbeddingCache, file_sha256, record_hash,
+)
 
 # === Directory for PDFs ===
 PDF_DIR = Path(__file__).parent / "pdfs"
 
 # ------------------ HELPERS ------------------
 
-def extract_text_from_pdf(pdf_path: Path) -> str:
-    """Extract plain text from PDF file."""
-    text = ""
-    with pdfplumber.open(str(pdf_path)) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract text for pages [start, end) — runs inside a worker process."""
+    pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for i in range(start, end):
+            page_text = pdf.pages[i].extract_text()
             if page_text:
-                text += page_text + "\n"
-    return text.strip()
+                pages.append((i + 1, page_text))
+    return pages
+
 
+def extract_pages(pdf_path: Path, pool: ProcessPoolExecutor, pages_per_task: int = 8,
+                  window: int = 4) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) in page order, extracting page ranges across the
+    process pool. At most `window` ranges are in flight, so memory stays flat.
+    """
+    with pdfplumber.open(str(pdf_path)) as pdf:
+        page_count = len(pdf.pages)
 
-def chunk_text(text: str, size: int = 250):
-    """Split text into chunks of `size` words."""
-    words = text.split()
-    for i in range(0, len(words), size):
-        yield " ".join(words[i:i + size])
+    ranges = [(s, min(s + pages_per_task, page_count)) for s in range(0, page_count, pages_per_task)]
+    pending = []
+    for start, end in ranges:
+        pending.append(pool.submit(_extract_page_range, str(pdf_path), start, end))
+        if len(pending) >= window:
+            yield from pending.pop(0).result()
+    for fut in pending:
+        yield from fut.result()
 
 
 def detect_subject_and_grade(filename: str):
@@ -62,55 +88,336 @@ def detect_subject_and_grade(filename: str):
     return subject, grade or "unknown"
 
 
-def ingest_pdf(pdf_path: Path):
-    """Ingest a single PDF file into the textbooks table."""
-    subject, grade = detect_subject_and_grade(pdf_path.name)
-    print(f"📥 Ingesting {pdf_path.name} (Subject={subject}, Grade={grade})")
+# ------------------ PIPELINE ------------------
 
-    raw_text = extract_text_from_pdf(pdf_path)
-    chunks = list(chunk_text(raw_text, size=250))
+_DONE = object()  # end-of-stream sentinel passed between stages
 
-    if not chunks:
-        print(f"⚠️ No text found in {pdf_path.name}")
-        return
 
-    embeddings = embed_texts(chunks)
-
-    records = []
-    for i, chunk in enumerate(chunks):
-        _id = f"{pdf_path.stem}-{i}"
-        meta = {
-            "type": "pdf",
-            "subject": subject,
-            "grade": grade,
-            "source": pdf_path.name,
-            "chunk_index": i
-        }
-        records.append({
-            "id": _id,
-            "document": chunk,
-            "metadata": meta,
-            "embedding": embeddings[i]
-        })
-
-    upsert_text_chunks("textbooks", records)
-    print(f"✅ {pdf_path.name} ingested with {len(chunks)} chunks.")
+class StageStats:
+    """Items processed and busy time for one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def line(self, elapsed: float) -> str:
+        rate = self.items / elapsed if elapsed else 0.0
+        return f"{self.name:<8} {self.items:>7} items  {self.busy:>7.1f}s busy  {rate:>8.1f} items/s"
+
+
+class IngestPipeline:
+    """
+    extract (process pool) → chunk (generator) → embed (thread workers) → upsert (batched)
+
+    Stages are connected by bounded queues, so a slow stage applies back-pressure
+    upstream instead of letting chunks/vectors pile up in memory.
+
+    With a manifest, unchanged PDFs and chunks are skipped, committed batches are
+    checkpointed (so a crashed run resumes where it stopped) and chunks that no
+    longer exist are deleted. With an embedding cache, vectors are reused by text hash.
+    """
+
+    def __init__(self, extract_workers: int, embed_workers: int, embed_batch: int,
+                 upsert_batch: int, queue_size: int, chunk_size: int, chunk_overlap: int,
+                 pages_per_task: int, report_every: float = 10.0, manifest: Optional[IngestManifest] = None,
+                 cache: Optional[EmbeddingCache] = None, full: bool = False):
+        self.extract_workers = extract_workers
+        self.embed_workers = embed_workers
+        self.embed_batch = embed_batch
+        self.upsert_batch = upsert_batch
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.pages_per_task = pages_per_task
+        self.report_every = report_every
+        self.manifest = manifest
+        self.cache = cache
+        self.full = full  # re-upsert everything, but still record the manifest
+
+        self.chunk_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.record_q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stats = {name: StageStats(name) for name in ("extract", "chunk", "embed", "upsert")}
+        self.per_file = {}
+        self.live_ids: Dict[str, List[str]] = {}
+        self.skipped_files = 0
+        self.skipped_chunks = 0
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    # --- queue helpers (never block forever if another stage died) ---
+    def _put(self, q: queue.Queue, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("pipeline stopped")
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        raise RuntimeError("pipeline stopped")
+
+    def _guard(self, fn):
+        def run():
+            try:
+                fn()
+            except BaseException as e:
+                if not self._stop.is_set():
+                    self._errors.append(e)
+                self._stop.set()
+        return run
+
+    # --- stages ---
+    def _produce(self, pdf_files: List[Path]):
+        with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+            for pdf_path in pdf_files:
+                source = pdf_path.name
+                if self.manifest is not None:
+                    file_hash = file_sha256(pdf_path)
+                    if not self.full and self.manifest.is_unchanged("textbooks", source, file_hash):
+                        print(f"⏭️ {source} unchanged — skipping")
+                        self.skipped_files += 1
+                        continue
+                    self.manifest.start("textbooks", source, file_hash)
+
+                subject, grade = detect_subject_and_grade(source)
+                print(f"📥 Ingesting {source} (Subject={subject}, Grade={grade})")
+                pages = self._timed_pages(extract_pages(pdf_path, pool, self.pages_per_task,
+                                                        window=self.extract_workers * 2))
+                ids = []
+                for i, chunk in enumerate(chunk_pages(pages, self.chunk_size, self.chunk_overlap)):
+                    self.stats["chunk"].add(1, 0.0)
+                    _id = f"{pdf_path.stem}-{i}"
+                    meta = {
+                        "type": "pdf",
+                        "subject": subject,
+                        "grade": grade,
+                        "source": source,
+                        "chunk_index": i,
+                        **chunk.metadata(),
+                    }
+                    ids.append(_id)
+                    chunk_hash = record_hash(chunk.text, meta)
+                    if (self.manifest is not None and not self.full
+                            and self.manifest.has_chunk("textbooks", source, _id, chunk_hash)):
+                        self.skipped_chunks += 1
+                        continue
+                    self._put(self.chunk_q, {
+                        "id": _id,
+                        "document": chunk.text,
+                        "metadata": meta,
+                        "source": source,
+                        "hash": chunk_hash,
+                    })
+                if not ids:
+                    print(f"⚠️ No text found in {source}")
+                self.per_file[source] = len(ids)
+                self.live_ids[source] = ids
+        for _ in range(self.embed_workers):
+            self._put(self.chunk_q, _DONE)
+
+    def _timed_pages(self, pages: Iterator[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+        while True:
+            t = time.perf_counter()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            self.stats["extract"].add(1, time.perf_counter() - t)
+            yield page
+
+    def _embed(self):
+        batch = []
+        while True:
+            item = self._get(self.chunk_q)
+            if item is not _DONE:
+                batch.append(item)
+            if batch and (item is _DONE or len(batch) >= self.embed_batch):
+                t = time.perf_counter()
+                texts = [r["document"] for r in batch]
+                vectors = self.cache.embed(texts, embed_texts) if self.cache else embed_texts(texts)
+                self.stats["embed"].add(len(batch), time.perf_counter() - t)
+                for rec, vec in zip(batch, vectors):
+                    rec["embedding"] = vec
+                    self._put(self.record_q, rec)
+                batch = []
+            if item is _DONE:
+                self._put(self.record_q, _DONE)
+                return
+
+    def _records(self) -> Iterator[dict]:
+        remaining = self.embed_workers
+        while remaining:
+            item = self._get(self.record_q)
+            if item is _DONE:
+                remaining -= 1
+                continue
+            yield item
+
+    def _upsert(self):
+        t = time.perf_counter()
+        checkpoint = (lambda batch: self.manifest.checkpoint("textbooks", batch)) if self.manifest else None
+        result = upsert_text_chunks("textbooks", self._records(), batch_size=self.upsert_batch,
+                                    on_batch_committed=checkpoint)
+        self.stats["upsert"].add(result["rows"], time.perf_counter() - t)
+
+    # --- driver ---
+    def run(self, pdf_files: List[Path]):
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._guard(lambda: self._produce(pdf_files)), name="produce")]
+        threads += [threading.Thread(target=self._guard(self._embed), name=f"embed-{i}")
+                    for i in range(self.embed_workers)]
+        threads.append(threading.Thread(target=self._guard(self._upsert), name="upsert"))
+        for t in threads:
+            t.start()
+
+        last_report = time.perf_counter()
+        while any(t.is_alive() for t in threads):
+            threads[-1].join(timeout=1.0)
+            if time.perf_counter() - last_report >= self.report_every:
+                last_report = time.perf_counter()
+                self._report(last_report - start, progress=True)
+        for t in threads:
+            t.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        # every chunk is committed: drop chunks that disappeared and mark sources complete
+        if self.manifest is not None:
+            for source, ids in self.live_ids.items():
+                self.manifest.complete("textbooks", source, ids, delete_chunks)
+        self._report(time.perf_counter() - start, progress=False)
+
+    def _report(self, elapsed: float, progress: bool):
+        if progress:
+            print(f"⏳ {elapsed:.0f}s  chunks queued={self.chunk_q.qsize()}  "
+                  f"records queued={self.record_q.qsize()}  "
+                  f"embedded={self.stats['embed'].items}")
+            return
+        print(f"\n📊 Stage throughput over {elapsed:.1f}s:")
+        for s in self.stats.values():
+            print("   " + s.line(elapsed))
+        for name, count in self.per_file.items():
+            print(f"   ✅ {name}: {count} chunks")
+        if self.manifest is not None:
+            print(f"   ⏭️ skipped {self.skipped_files} unchanged files, {self.skipped_chunks} unchanged chunks")
+        if self.cache is not None:
+            print(f"   💾 embedding cache: {self.cache.hits} hits, {self.cache.misses} misses")
+
+
+def ingest_pdf(pdf_path: Path, **options):
+    """Ingest a single PDF file into the textbooks table."""
+    ingest_pdfs([pdf_path], **options)
+
+
+def ingest_pdfs(pdf_files: List[Path], extract_workers: int = None, embed_workers: int = 2,
+                embed_batch: int = EMBED_BATCH_SIZE, upsert_batch: int = UPSERT_BATCH_SIZE,
+                queue_size: int = 256, chunk_size: int = CHUNK_TOKENS,
+                chunk_overlap: int = CHUNK_OVERLAP_TOKENS, pages_per_task: int = 8,
+                report_every: float = 10.0, manifest: Optional[IngestManifest] = None,
+                cache: Optional[EmbeddingCache] = None, full: bool = False):
+    """Run the staged ingestion pipeline over `pdf_files`."""
+    IngestPipeline(
+        extract_workers=extract_workers or os.cpu_count() or 2,
+        embed_workers=embed_workers,
+        embed_batch=embed_batch,
+        upsert_batch=upsert_batch,
+        queue_size=queue_size,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        pages_per_task=pages_per_task,
+        report_every=report_every,
+        manifest=manifest,
+        cache=cache,
+        full=full,
+    ).run(pdf_files)
 
 
 # ------------------ MAIN ------------------
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest textbook PDFs into the pgvector 'textbooks' table.")
+    parser.add_argument("pdfs", nargs="*", type=Path, help="PDF files (default: every PDF in scripts/pdfs/)")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 2,
+                        help="processes used for page text extraction")
+    parser.add_argument("--embed-workers", type=int, default=2, help="concurrent embedding batches")
+    parser.add_argument("--embed-batch", type=int, default=EMBED_BATCH_SIZE, help="texts per embedding call")
+    parser.add_argument("--upsert-batch", type=int, default=UPSERT_BATCH_SIZE, help="rows per INSERT/commit")
+    parser.add_argument("--queue-size", type=int, default=256, help="max items buffered between stages")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_TOKENS, help="max tokens per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP_TOKENS,
+                        help="tokens of trailing sentences repeated at the start of the next chunk")
+    parser.add_argument("--pages-per-task", type=int, default=8, help="pages per extraction task")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the manifest and re-upsert every chunk (embedding cache still used)")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the on-disk embedding cache")
+    parser.add_argument("--index-method", choices=["hnsw", "ivfflat"], default=VECTOR_INDEX_METHOD,
+                        help="ANN index built after the load")
+    parser.add_argument("--no-index", action="store_true", help="skip (re)building the vector index")
+    parser.add_argument("--state-dir", type=Path, default=INGEST_STATE_DIR,
+                        help="where the manifest and embedding cache live")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+
     # Ensure tables exist (dimension 768 confirmed from detect_dim.py)
     create_tables_if_not_exists(768)
 
-    pdf_files = list(PDF_DIR.glob("*.pdf"))
+    pdf_files = args.pdfs or sorted(PDF_DIR.glob("*.pdf"))
     if not pdf_files:
         print("⚠️ No PDFs found in scripts/pdfs/")
         return
 
-    for pdf_file in pdf_files:
-        ingest_pdf(pdf_file)
+    manifest = IngestManifest(args.state_dir / "manifest.json")
+    cache = None if args.no_cache else EmbeddingCache(EMBED_MODEL, args.state_dir / "embeddings.sqlite")
+
+    # PDFs removed from scripts/pdfs/ take their chunks with them
+    if not args.pdfs:
+        present = {p.name for p in pdf_files}
+        for source in manifest.sources("textbooks"):
+            if source not in present:
+                removed = manifest.forget("textbooks", source, delete_chunks)
+                print(f"🗑️ {source} no longer present — removed {removed} chunks")
+
+    ingest_pdfs(
+        pdf_files,
+        extract_workers=args.extract_workers,
+        embed_workers=args.embed_workers,
+        embed_batch=args.embed_batch,
+        upsert_batch=args.upsert_batch,
+        queue_size=args.queue_size,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        pages_per_task=args.pages_per_task,
+        report_every=args.report_every,
+        manifest=manifest,
+        cache=cache,
+        full=args.full,
+    )
+
+    # Build the ANN index after the bulk load (HNSW updates in place; IVFFlat
+    # is rebuilt so `lists` tracks the row count).
+    if not args.no_index:
+        create_vector_index("textbooks", method=args.index_method, rebuild=args.index_method == "ivfflat")
 
+    totals = get_embedding_stats()["totals"]
+    print(f"📊 Embedded {totals['texts']} chunks in {totals['batches']} batches "
+          f"({totals['retries']} retries, {totals['seconds']:.1f}s batch time)")
     print("🎉 All textbooks ingested into Supabase Postgres!")
 
 
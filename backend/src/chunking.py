@@ -0,0 +1,188 @@
+# backend/src/chunking.py
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from src.context_assembler import estimate_tokens
+
+# ---------- ENV CONFIG ----------
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+# "Chapter 3", "UNIT 2 ...", "Lesson 4: ..."
+_PREFIXED_HEADING_RE = re.compile(r"^(?:chapter|unit|lesson|section|part)\s+[0-9ivxlc]+\b", re.IGNORECASE)
+# "2.1 Cell structure", "3 Motion and Rest" -- further checks in is_heading; a plain number
+# has at most two digits, so wrapped lines starting with a year ("1947 India ...") never match
+_NUMBERED_HEADING_RE = re.compile(r"^(?:(?P<dotted>\d+(?:\.\d+)+)|\d{1,2})\.?\s+[A-Z][^.!?]*$")
+# a title doesn't end mid-phrase: "1947 India became independent and the"
+_CONTINUATION_WORDS = {"a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "at", "for",
+                       "by", "with", "from", "as", "is", "are", "was", "were", "that", "which"}
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+_MAX_HEADING_WORDS = 12
+_MAX_NUMBERED_HEADING_WORDS = 8
+
+
+@dataclass
+class Chunk:
+    text: str
+    page_start: int
+    page_end: int
+    section: Optional[str]
+    tokens: int
+
+    def metadata(self) -> dict:
+        return {"page_start": self.page_start, "page_end": self.page_end, "section": self.section}
+
+
+def is_heading(line: str, next_line: str = "", prev_line: str = "") -> bool:
+    """
+    Short title-like line: "Chapter N"-style or ALL-CAPS headings anywhere.
+    A numbered title ("2.1 Cell structure") must also be short, not end
+    mid-phrase, follow a finished sentence (`prev_line` is empty or ends in
+    terminal punctuation) and not run on into a lowercase `next_line`; with a
+    plain number ("3 Motion and Rest") it must be in Title Case. That keeps
+    wrapped body lines and exercises ("3 Find the value of x") out, without
+    relying on blank lines, which pdfplumber rarely produces.
+    """
+    line = line.strip()
+    if not line or len(line.split()) > _MAX_HEADING_WORDS or line[-1] in ".,;:!?":
+        return False
+    if _PREFIXED_HEADING_RE.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 4 and all(c.isupper() for c in letters):
+        return True
+    match = _NUMBERED_HEADING_RE.match(line)
+    words = line.split()
+    if (
+        match is None
+        or len(words) > _MAX_NUMBERED_HEADING_WORDS
+        or words[-1].lower() in _CONTINUATION_WORDS
+        or next_line.strip()[:1].islower()
+        or (prev_line.strip() and prev_line.strip()[-1] not in ".!?:\"')]")
+    ):
+        return False
+    return bool(match.group("dotted")) or all(w[:1].isupper() for w in words[1:] if len(w) > 3)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_END_RE.split(text) if s.strip()]
+
+
+def _split_long(sentence: str, max_tokens: int) -> List[str]:
+    """Word-split a sentence that alone exceeds the chunk size."""
+    words, out, cur = sentence.split(), [], []
+    for w in words:
+        if cur and estimate_tokens(" ".join(cur + [w])) > max_tokens:
+            out.append(" ".join(cur))
+            cur = []
+        cur.append(w)
+    if cur:
+        out.append(" ".join(cur))
+    return out
+
+
+def _blocks(pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, object, int]]:
+    """
+    Yield ("heading", title, page) and ("sentence", text, page) in reading order.
+    A sentence running over a page break is attributed to the page it starts on.
+    """
+    carry, carry_page = "", None
+    for page_no, page_text in pages:
+        para: List[str] = []
+        lines = page_text.splitlines()
+        for index, raw in enumerate(lines):
+            line = raw.strip()
+            if not line:
+                continue
+            next_line = lines[index + 1] if index + 1 < len(lines) else ""
+            if is_heading(line, next_line, para[-1] if para else carry):
+                text = " ".join(para)
+                para = []
+                for i, s in enumerate(split_sentences((carry + " " + text).strip())):
+                    yield "sentence", s, (carry_page or page_no) if i == 0 else page_no
+                carry, carry_page = "", None
+                yield "heading", line, page_no
+                continue
+            if para and para[-1].endswith("-") and line[:1].islower():
+                para[-1] = para[-1][:-1] + line  # re-join hyphenated line breaks
+            else:
+                para.append(line)
+
+        sentences = split_sentences((carry + " " + " ".join(para)).strip())
+        start_page = carry_page or page_no
+        carry, carry_page = "", None
+        if sentences and sentences[-1][-1] not in ".!?\"')":
+            carry, carry_page = sentences.pop(), (start_page if len(sentences) == 0 else page_no)
+        for i, s in enumerate(sentences):
+            yield "sentence", s, start_page if i == 0 else page_no
+    if carry:
+        yield "sentence", carry, carry_page
+
+
+def chunk_pages(
+    pages: Iterable[Tuple[int, str]],
+    max_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[Chunk]:
+    """
+    Stream `Chunk`s of up to ~`max_tokens` from (page_number, text) pairs.
+
+    Chunks end on sentence boundaries and never span a heading; a section's
+    first chunk starts with the heading text itself. Consecutive chunks in the
+    same section share ~`overlap_tokens` of trailing sentences.
+    Each chunk records its page range and the nearest preceding heading.
+    Pages are consumed lazily, so memory is bounded by one chunk.
+    """
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    section: Optional[str] = None
+    buf: List[Tuple[str, int, int]] = []   # (sentence, page, tokens)
+    fresh = 0                               # tokens in buf not yet emitted in a chunk
+
+    def emit() -> Chunk:
+        return Chunk(
+            text=" ".join(s for s, _, _ in buf),
+            page_start=buf[0][1],
+            page_end=buf[-1][1],
+            section=section,
+            tokens=sum(t for _, _, t in buf),
+        )
+
+    def overlap_tail() -> List[Tuple[str, int, int]]:
+        tail, total = [], 0
+        for item in reversed(buf):
+            if total + item[2] > overlap_tokens:
+                break
+            tail.insert(0, item)
+            total += item[2]
+        return tail
+
+    prev_kind = None
+    for kind, value, page in _blocks(pages):
+        if kind == "heading":
+            if fresh:
+                yield emit()
+            if prev_kind != "heading":
+                buf, fresh = [], 0
+            # "CHAPTER 1" followed by "CELLS" -> "CHAPTER 1: CELLS"
+            section = f"{section}: {value}" if prev_kind == "heading" and section else value
+            # kept in the chunk text (a heading alone never makes a chunk: fresh stays 0)
+            buf.append((value, page, estimate_tokens(value) + 1))
+            prev_kind = kind
+            continue
+        prev_kind = kind
+
+        pieces = [value] if estimate_tokens(value) <= max_tokens else _split_long(value, max_tokens)
+        for piece in pieces:
+            cost = estimate_tokens(piece) + 1
+            if buf and sum(t for _, _, t in buf) + cost > max_tokens:
+                yield emit()
+                buf = overlap_tail()
+                while buf and sum(t for _, _, t in buf) + cost > max_tokens:
+                    buf.pop(0)
+                fresh = 0
+            buf.append((piece, page, cost))
+            fresh += cost
+    if fresh:
+        yield emit()
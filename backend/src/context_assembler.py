@@ -0,0 +1,145 @@
+# backend/src/context_assembler.py
+import os
+import re
+import math
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+# ---------- ENV CONFIG ----------
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1200"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))               # 1.0 = pure relevance
+RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.8"))     # shingle Jaccard treated as duplicate
+MIN_TRUNCATED_TOKENS = 64                                               # don't append tiny fragments
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose)."""
+    return math.ceil(len(text or "") / 4)
+
+
+def _shingles(text: str, n: int = 3) -> Set[int]:
+    words = re.findall(r"\w+", (text or "").lower())
+    if len(words) < n:
+        return {hash(" ".join(words))} if words else set()
+    return {hash(" ".join(words[i:i + n])) for i in range(len(words) - n + 1)}
+
+
+def _jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut to roughly `max_tokens`, preferring a sentence boundary."""
+    limit = max_tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "), cut.rfind("\n"))
+    if end > limit // 2:
+        return cut[:end + 1].rstrip()
+    return cut.rsplit(" ", 1)[0].rstrip() + " …"
+
+
+@dataclass
+class AssembledContext:
+    docs: List[dict]
+    tokens_in: int
+    tokens_used: int
+    duplicates_dropped: int = 0
+    over_budget_dropped: int = 0
+    truncated: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_used
+
+    def report(self) -> Dict[str, int]:
+        return {
+            "tokens_in": self.tokens_in,
+            "tokens_used": self.tokens_used,
+            "tokens_saved": self.tokens_saved,
+            "duplicates_dropped": self.duplicates_dropped,
+            "over_budget_dropped": self.over_budget_dropped,
+            "truncated": self.truncated,
+        }
+
+
+def assemble_context(
+    docs: List[dict],
+    token_budget: int = RAG_CONTEXT_TOKEN_BUDGET,
+    mmr_lambda: float = RAG_MMR_LAMBDA,
+    dedup_threshold: float = RAG_DEDUP_THRESHOLD,
+) -> AssembledContext:
+    """
+    Pick the retrieved docs ({"id", "document", "distance", ...}) to send to the model:
+
+    1. drop exact and near-duplicate chunks (word 3-gram Jaccard >= dedup_threshold),
+    2. order the rest by MMR: relevance (1 - distance) traded off against
+       similarity to what's already selected, so overlapping chunks sink,
+    3. add docs until `token_budget` is spent, truncating the last one at a
+       sentence boundary if a useful fragment still fits.
+
+    Works on the output of retrieve_top_k / retrieve_multi for any caller.
+    """
+    tokens_in = sum(estimate_tokens(d.get("document", "")) for d in docs)
+
+    # --- 1. dedup ---
+    unique: List[dict] = []
+    shingles: List[Set[int]] = []
+    seen_hashes: Set[str] = set()
+    duplicates = 0
+    for d in sorted(docs, key=lambda x: x.get("distance", 9999)):
+        text = d.get("document") or ""
+        h = hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+        sh = _shingles(text)
+        if h in seen_hashes or any(_jaccard(sh, other) >= dedup_threshold for other in shingles):
+            duplicates += 1
+            continue
+        seen_hashes.add(h)
+        unique.append(d)
+        shingles.append(sh)
+
+    # --- 2. MMR ordering ---
+    relevance = [1.0 - float(d.get("distance") if d.get("distance") is not None else 1.0) for d in unique]
+    remaining = list(range(len(unique)))
+    ordered: List[int] = []
+    while remaining:
+        def mmr(i: int) -> float:
+            redundancy = max((_jaccard(shingles[i], shingles[j]) for j in ordered), default=0.0)
+            return mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+        best = max(remaining, key=mmr)
+        ordered.append(best)
+        remaining.remove(best)
+
+    # --- 3. budget ---
+    selected: List[dict] = []
+    used = 0
+    truncated = 0
+    dropped = 0
+    for i in ordered:
+        doc = unique[i]
+        cost = estimate_tokens(doc.get("document", ""))
+        if used + cost <= token_budget:
+            selected.append(doc)
+            used += cost
+            continue
+        room = token_budget - used
+        if room >= MIN_TRUNCATED_TOKENS and not truncated:
+            cut = _truncate(doc["document"], room)
+            selected.append({**doc, "document": cut, "truncated": True})
+            used += estimate_tokens(cut)
+            truncated += 1
+        else:
+            dropped += 1
+
+    return AssembledContext(
+        docs=selected,
+        tokens_in=tokens_in,
+        tokens_used=used,
+        duplicates_dropped=duplicates,
+        over_budget_dropped=dropped,
+        truncated=truncated,
+    )
@@ -0,0 +1,257 @@
+# backend/src/draft_buffer.py
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from src.ingest_manifest import INGEST_STATE_DIR
+
+# ---------- ENV CONFIG ----------
+DRAFT_WRITE_BEHIND = os.getenv("DRAFT_WRITE_BEHIND", "1") == "1"
+DRAFT_FLUSH_IDLE = float(os.getenv("DRAFT_FLUSH_IDLE", "5"))           # seconds without a new save
+DRAFT_FLUSH_INTERVAL = float(os.getenv("DRAFT_FLUSH_INTERVAL", "30"))  # max seconds a save stays pending
+DRAFT_FLUSH_TICK = 1.0
+DRAFT_FLUSH_MAX_ATTEMPTS = int(os.getenv("DRAFT_FLUSH_MAX_ATTEMPTS", "5"))
+DRAFT_FLUSH_BACKOFF = float(os.getenv("DRAFT_FLUSH_BACKOFF", "2"))            # seconds, doubled per failure
+DRAFT_FLUSH_BACKOFF_MAX = float(os.getenv("DRAFT_FLUSH_BACKOFF_MAX", "60"))
+DRAFT_DEAD_LETTER_MAX = 100
+# saves that exhausted their retries survive restarts here until the draft is saved again
+DRAFT_DEAD_LETTER_PATH = Path(os.getenv("DRAFT_DEAD_LETTER_PATH", INGEST_STATE_DIR / "draft_dead_letters.json"))
+
+
+class _Pending:
+    __slots__ = ("content", "author_id", "author_name", "first_at", "last_at", "saves", "failures", "retry_at",
+                 "generation")
+
+    def __init__(self, content: str, author_id: Optional[str], author_name: Optional[str], now: float,
+                 generation: int):
+        self.generation = generation
+        self.content = content
+        self.author_id = author_id
+        self.author_name = author_name
+        self.first_at = now
+        self.last_at = now
+        self.saves = 1
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class DraftWriteBuffer:
+    """
+    Write-behind buffer for draft saves.
+
+    Only the latest content per draft is kept; a burst of saves becomes one
+    version, written when the draft has been idle for `idle_seconds`, has been
+    pending for `interval` seconds, on checkpoint() or on stop(). Writes of the
+    same draft are serialized, and every submit()/checkpoint() bumps the draft's
+    generation: a buffered flush whose content is older than the latest
+    generation is dropped (when it gets the lock, and instead of a retry), so it
+    can't land after a newer checkpoint. A failed flush is retried with
+    exponential backoff; after `max_attempts` failures the content is moved to a
+    dead-letter file (`dead_letter_path`), reported by dead_letter() and stats()
+    until the draft is saved again.
+
+    `flush_fn(draft_id, content, author_id, author_name)` is a coroutine function.
+    """
+
+    def __init__(self, flush_fn: Callable[..., Awaitable[Dict[str, Any]]], idle_seconds: float = DRAFT_FLUSH_IDLE,
+                 interval: float = DRAFT_FLUSH_INTERVAL, tick: float = DRAFT_FLUSH_TICK,
+                 max_attempts: int = DRAFT_FLUSH_MAX_ATTEMPTS, backoff: float = DRAFT_FLUSH_BACKOFF,
+                 backoff_max: float = DRAFT_FLUSH_BACKOFF_MAX,
+                 dead_letter_path: Optional[Path] = DRAFT_DEAD_LETTER_PATH):
+        self._flush_fn = flush_fn
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.tick = tick
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._pending: Dict[str, _Pending] = {}
+        self._generations: Dict[str, int] = {}
+        self.dead_letter_path = Path(dead_letter_path) if dead_letter_path else None
+        self._dead_letters: "OrderedDict[str, Dict[str, Any]]" = OrderedDict(self._load_dead_letters())
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._counters = {"saves": 0, "coalesced": 0, "checkpoints": 0, "writes": 0,
+                          "unchanged": 0, "stale": 0, "failures": 0, "dead_lettered": 0}
+
+    # --- API used by the router ---
+    def submit(self, draft_id: str, content: str, author_id: Optional[str] = None,
+               author_name: Optional[str] = None) -> int:
+        """Buffer `content` as the draft's latest state; returns saves coalesced so far."""
+        now = time.monotonic()
+        generation = self._next_generation(draft_id)
+        self._counters["saves"] += 1
+        entry = self._pending.get(draft_id)
+        if entry is None:
+            self._pending[draft_id] = _Pending(content, author_id, author_name, now, generation)
+            return 1
+        entry.content, entry.last_at, entry.generation = content, now, generation
+        entry.author_id = author_id or entry.author_id
+        entry.author_name = author_name or entry.author_name
+        entry.saves += 1
+        self._counters["coalesced"] += 1
+        return entry.saves
+
+    async def checkpoint(self, draft_id: str, content: str, author_id: Optional[str] = None,
+                         author_name: Optional[str] = None) -> Dict[str, Any]:
+        """Write `content` now; it supersedes anything buffered for the draft."""
+        self._counters["checkpoints"] += 1
+        self._next_generation(draft_id)
+        superseded = self._pending.pop(draft_id, None)
+        if superseded is not None:
+            self._counters["coalesced"] += superseded.saves
+        return await self._write(draft_id, content, author_id, author_name)
+
+    def discard(self, draft_id: str):
+        """Drop buffered content (e.g. the draft was restored to an older version)."""
+        self._next_generation(draft_id)
+        self._pending.pop(draft_id, None)
+        self._clear_dead_letter(draft_id)
+
+    def pending(self, draft_id: str) -> bool:
+        return draft_id in self._pending
+
+    def dead_letter(self, draft_id: str) -> Optional[Dict[str, Any]]:
+        """The draft's save that exhausted its retries (content included), if any."""
+        return self._dead_letters.get(draft_id)
+
+    # --- flushing ---
+    def _next_generation(self, draft_id: str) -> int:
+        generation = self._generations.get(draft_id, 0) + 1
+        self._generations[draft_id] = generation
+        return generation
+
+    def _is_stale(self, draft_id: str, entry: _Pending) -> bool:
+        return entry.generation < self._generations.get(draft_id, 0)
+
+    async def _write(self, draft_id: str, content: str, author_id, author_name,
+                     entry: Optional[_Pending] = None) -> Dict[str, Any]:
+        lock = self._locks.setdefault(draft_id, asyncio.Lock())
+        async with lock:
+            # a newer submit/checkpoint happened while this buffered flush waited
+            if entry is not None and self._is_stale(draft_id, entry):
+                self._counters["stale"] += 1
+                return {"status": "stale"}
+            result = await self._flush_fn(draft_id, content, author_id, author_name)
+        # newer content made it to the database: an older dead-lettered save is moot
+        self._clear_dead_letter(draft_id)
+        self._counters["writes" if result.get("status") == "saved" else "unchanged"] += 1
+        return result
+
+    async def _flush_entry(self, draft_id: str, entry: _Pending):
+        try:
+            await self._write(draft_id, entry.content, entry.author_id, entry.author_name, entry)
+        except Exception as e:
+            self._counters["failures"] += 1
+            entry.failures += 1
+            if self._is_stale(draft_id, entry):
+                # superseded while failing: the newer content is written on its own
+                self._counters["stale"] += 1
+                return
+            if entry.failures >= self.max_attempts:
+                self._dead_letter(draft_id, entry, e)
+                return
+            print(f"⚠️ Buffered save for draft {draft_id} failed (attempt {entry.failures}): {e}")
+            delay = min(self.backoff * 2 ** (entry.failures - 1), self.backoff_max)
+            entry.retry_at = time.monotonic() + delay
+            self._pending.setdefault(draft_id, entry)
+
+    def _dead_letter(self, draft_id: str, entry: _Pending, error: Exception):
+        self._counters["dead_lettered"] += 1
+        print(f"❌ Buffered save for draft {draft_id} dropped after {entry.failures} attempts "
+              f"({entry.saves} coalesced saves, {len(entry.content)} chars): {error}")
+        self._dead_letters.pop(draft_id, None)
+        self._dead_letters[draft_id] = {
+            "content": entry.content,
+            "author_id": entry.author_id,
+            "author_name": entry.author_name,
+            "saves": entry.saves,
+            "attempts": entry.failures,
+            "error": str(error),
+            "failed_at": time.time(),
+        }
+        while len(self._dead_letters) > DRAFT_DEAD_LETTER_MAX:
+            self._dead_letters.popitem(last=False)
+        self._save_dead_letters()
+
+    def _clear_dead_letter(self, draft_id: str):
+        if self._dead_letters.pop(draft_id, None) is not None:
+            self._save_dead_letters()
+
+    def _load_dead_letters(self) -> Dict[str, Dict[str, Any]]:
+        if self.dead_letter_path is None:
+            return {}
+        try:
+            return json.loads(self.dead_letter_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_dead_letters(self):
+        if self.dead_letter_path is None:
+            return
+        try:
+            self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.dead_letter_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._dead_letters))
+            tmp.replace(self.dead_letter_path)
+        except OSError as e:
+            print(f"⚠️ Could not persist draft dead letters to {self.dead_letter_path}: {e}")
+
+    def _due(self, now: float):
+        return [
+            draft_id for draft_id, e in self._pending.items()
+            if now >= e.retry_at and (now - e.last_at >= self.idle_seconds or now - e.first_at >= self.interval)
+        ]
+
+    async def flush_due(self):
+        due = self._due(time.monotonic())
+        entries = [(d, self._pending.pop(d)) for d in due]
+        if entries:
+            await asyncio.gather(*(self._flush_entry(d, e) for d, e in entries))
+
+    async def flush_all(self):
+        entries = list(self._pending.items())
+        self._pending.clear()
+        if entries:
+            await asyncio.gather(*(self._flush_entry(d, e) for d, e in entries))
+
+    # --- lifecycle ---
+    async def _run(self):
+        # not cancelled on shutdown: a flush in progress finishes before stop() drains the rest
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush_due()
+            except Exception as e:
+                print(f"⚠️ Draft write-behind tick failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write everything still buffered (graceful shutdown)."""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush_all()
+        if self._pending:
+            print(f"⚠️ {len(self._pending)} buffered draft saves could not be written on shutdown")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": DRAFT_WRITE_BEHIND,
+            "pending_drafts": len(self._pending),
+            "dead_letters": list(self._dead_letters),
+            **self._counters,
+        }
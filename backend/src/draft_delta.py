@@ -0,0 +1,159 @@
+# backend/src/draft_delta.py
+import os
+import re
+import json
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Union
+
+# ---------- ENV CONFIG ----------
+# Every Nth version stores full content, so rebuilding any version applies < N deltas.
+DRAFT_SNAPSHOT_EVERY = int(os.getenv("DRAFT_SNAPSHOT_EVERY", "20"))
+# Store a snapshot instead when the delta isn't clearly smaller than the content.
+DRAFT_MAX_DELTA_RATIO = float(os.getenv("DRAFT_MAX_DELTA_RATIO", "0.5"))
+
+# HTML tags, whitespace runs and words: diffs stay aligned with editor markup.
+_TOKEN_RE = re.compile(r"<[^<>]*>|\s+|[^<\s]+|<")
+
+Op = Union[int, str]  # n > 0: copy n tokens, n < 0: skip n tokens, str: insert text
+
+
+class DeltaError(ValueError):
+    """Version chain is broken (missing base or snapshot)."""
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text or "")
+
+
+def encode_delta(old: str, new: str) -> List[Op]:
+    """
+    Compact token-level diff turning `old` into `new`.
+    Common prefix/suffix are stripped first, so a typical autosave (one edit
+    somewhere in a long plan) only diffs the changed region.
+    """
+    a, b = _tokens(old), _tokens(new)
+    pre = 0
+    while pre < len(a) and pre < len(b) and a[pre] == b[pre]:
+        pre += 1
+    suf = 0
+    while suf < len(a) - pre and suf < len(b) - pre and a[-1 - suf] == b[-1 - suf]:
+        suf += 1
+
+    ops: List[Op] = []
+
+    def copy(n: int):
+        if n:
+            if ops and isinstance(ops[-1], int) and ops[-1] > 0:
+                ops[-1] += n
+            else:
+                ops.append(n)
+
+    def skip(n: int):
+        if n:
+            if ops and isinstance(ops[-1], int) and ops[-1] < 0:
+                ops[-1] -= n
+            else:
+                ops.append(-n)
+
+    def insert(text: str):
+        if text:
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += text
+            else:
+                ops.append(text)
+
+    copy(pre)
+    mid_a, mid_b = a[pre:len(a) - suf], b[pre:len(b) - suf]
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, mid_a, mid_b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            copy(i2 - i1)
+        else:
+            skip(i2 - i1)
+            insert("".join(mid_b[j1:j2]))
+    copy(suf)
+
+    # a trailing copy is implied by apply_delta
+    if ops and isinstance(ops[-1], int) and ops[-1] > 0:
+        ops.pop()
+    return ops
+
+
+def apply_delta(old: str, ops: Iterable[Op]) -> str:
+    a = _tokens(old)
+    out: List[str] = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(a[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    if pos > len(a):
+        raise DeltaError("delta does not match its base version")
+    out.extend(a[pos:])
+    return "".join(out)
+
+
+def delta_size(ops: List[Op]) -> int:
+    return len(json.dumps(ops, separators=(",", ":")))
+
+
+def plan_version(
+    new_content: str,
+    previous: Optional[Dict],
+    chain_length: int,
+    snapshot_every: int = DRAFT_SNAPSHOT_EVERY,
+) -> Dict:
+    """
+    Columns for the row storing `new_content` as the next version.
+
+    `previous` is {"version_number", "content"} of the latest version (content
+    reconstructed), `chain_length` the number of deltas since its snapshot.
+    Returns {"content": ...} for a snapshot or {"delta", "base_version"}.
+    """
+    if previous is None or chain_length + 1 >= snapshot_every:
+        return {"content": new_content, "delta": None, "base_version": None}
+    ops = encode_delta(previous["content"], new_content)
+    if delta_size(ops) > DRAFT_MAX_DELTA_RATIO * max(len(new_content), 1):
+        return {"content": new_content, "delta": None, "base_version": None}
+    return {"content": None, "delta": ops, "base_version": previous["version_number"]}
+
+
+def is_snapshot(row: Dict) -> bool:
+    # rows written before delta encoding (or directly by the frontend) carry full content
+    return row.get("delta") is None
+
+
+def chain_length(rows_desc: List[Dict]) -> int:
+    """Deltas between the latest version and its snapshot (rows newest first)."""
+    n = 0
+    for row in rows_desc:
+        if is_snapshot(row):
+            return n
+        n += 1
+    return n
+
+
+def reconstruct(rows: Iterable[Dict], version_number: int) -> str:
+    """
+    Content of `version_number` from rows holding at least its chain back to
+    the nearest snapshot ({"version_number", "content", "delta", "base_version"}).
+    """
+    by_version = {r["version_number"]: r for r in rows}
+    chain = []
+    v: Optional[int] = version_number
+    while True:
+        row = by_version.get(v)
+        if row is None:
+            raise DeltaError(f"version {v} missing from chain of version {version_number}")
+        if is_snapshot(row):
+            content = row.get("content") or ""
+            break
+        chain.append(row["delta"])
+        v = row["base_version"]
+    for ops in reversed(chain):
+        content = apply_delta(content, ops)
+    return content
+
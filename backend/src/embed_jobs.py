@@ -0,0 +1,422 @@
+# backend/src/embed_jobs.py
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.ingest_manifest import INGEST_STATE_DIR
+
+# ---------- ENV CONFIG ----------
+# "postgres" (embedding_jobs table, needs DATABASE_URL) or "sqlite" (local file, e.g. offline/dev)
+EMBED_JOB_STORE = os.getenv("EMBED_JOB_STORE", "postgres" if os.getenv("DATABASE_URL") else "sqlite")
+EMBED_JOB_SQLITE_PATH = Path(os.getenv("EMBED_JOB_SQLITE_PATH", INGEST_STATE_DIR / "embed_jobs.sqlite"))
+EMBED_JOB_BATCH = int(os.getenv("EMBED_JOB_BATCH", "50"))                # templates per embed call + upsert
+EMBED_JOB_POLL = float(os.getenv("EMBED_JOB_POLL", "2"))                 # seconds between idle polls
+EMBED_JOB_MAX_ATTEMPTS = int(os.getenv("EMBED_JOB_MAX_ATTEMPTS", "5"))
+EMBED_JOB_LEASE = float(os.getenv("EMBED_JOB_LEASE", "300"))             # running jobs older than this are reclaimed
+EMBED_JOB_RETRY_DELAY = float(os.getenv("EMBED_JOB_RETRY_DELAY", "30"))  # seconds before a failed job is retried
+
+JOB_COLUMNS = "id, template_id, status, attempts, error, created_at, updated_at"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ---------- Job Stores ----------
+class JobStore(ABC):
+    """
+    Persistent queue of embedding jobs, one row per template:
+
+        {"id", "template_id", "payload", "status", "attempts", "error", "created_at", "updated_at"}
+
+    status is queued -> running -> done, or back to queued on a failed attempt
+    until `max_attempts`, then failed (superseded if the template has been
+    queued again meanwhile; the newer job carries its content). Re-enqueueing a template whose job is
+    still queued replaces its payload instead of adding a second job, so a burst
+    of edits is embedded once. A running job whose lease expired (worker died
+    mid-batch) is claimed again.
+    """
+
+    @abstractmethod
+    def enqueue(self, template: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def claim(self, limit: int, lease_seconds: float = EMBED_JOB_LEASE,
+              retry_delay: float = EMBED_JOB_RETRY_DELAY) -> List[Dict[str, Any]]:
+        """
+        Mark up to `limit` jobs running and return them (with payload), oldest
+        first. A job that failed before waits `retry_delay` seconds.
+        """
+
+    @abstractmethod
+    def mark_done(self, job_ids: List[str]):
+        ...
+
+    @abstractmethod
+    def mark_failed(self, job_ids: List[str], error: str, max_attempts: int = EMBED_JOB_MAX_ATTEMPTS):
+        """Requeue the jobs, or fail them for good once they've used `max_attempts`."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job plus `queue_position` (queued jobs ahead of it) while it's waiting."""
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        ...
+
+
+class SQLiteJobStore(JobStore):
+    """Local stand-in with the same semantics: a single-process dev server or offline tests."""
+
+    def __init__(self, path: Path = EMBED_JOB_SQLITE_PATH):
+        self.path = Path(path)
+        if str(path) != ":memory:":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_jobs ("
+            "id TEXT PRIMARY KEY, template_id TEXT NOT NULL, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, error TEXT, "
+            "created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embedding_jobs_status_idx ON embedding_jobs (status, created_at)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def enqueue(self, template: Dict[str, Any]) -> Dict[str, Any]:
+        template_id, payload, now = str(template["id"]), json.dumps(template, default=str), _now().isoformat()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM embedding_jobs WHERE template_id = ? AND status = 'queued'", (template_id,)
+            ).fetchone()
+            if row is not None:
+                # new content gets a fresh set of attempts
+                self._conn.execute("UPDATE embedding_jobs SET payload = ?, attempts = 0, updated_at = ? WHERE id = ?",
+                                   (payload, now, row["id"]))
+                job_id = row["id"]
+            else:
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO embedding_jobs (id, template_id, payload, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (job_id, template_id, payload, now, now),
+                )
+        return {"id": job_id, "status": "queued", "coalesced": row is not None}
+
+    def claim(self, limit: int, lease_seconds: float = EMBED_JOB_LEASE,
+              retry_delay: float = EMBED_JOB_RETRY_DELAY) -> List[Dict[str, Any]]:
+        now = _now()
+        stale = (now - timedelta(seconds=lease_seconds)).isoformat()
+        retry = (now - timedelta(seconds=retry_delay)).isoformat()
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, template_id, payload, attempts FROM embedding_jobs "
+                "WHERE (status = 'queued' AND (attempts = 0 OR updated_at < ?)) "
+                "OR (status = 'running' AND updated_at < ?) "
+                "ORDER BY created_at LIMIT ?",
+                (retry, stale, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE embedding_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(now.isoformat(), r["id"]) for r in rows],
+            )
+        return [{"id": r["id"], "template_id": r["template_id"], "payload": json.loads(r["payload"]),
+                 "attempts": r["attempts"] + 1} for r in rows]
+
+    def mark_done(self, job_ids: List[str]):
+        now = _now().isoformat()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE embedding_jobs SET status = 'done', error = NULL, updated_at = ? WHERE id = ?",
+                [(now, j) for j in job_ids],
+            )
+
+    def mark_failed(self, job_ids: List[str], error: str, max_attempts: int = EMBED_JOB_MAX_ATTEMPTS):
+        now = _now().isoformat()
+        with self._lock, self._conn:
+            # a newer queued job for the same template supersedes the failed one
+            self._conn.executemany(
+                "UPDATE embedding_jobs SET status = CASE WHEN EXISTS ("
+                "SELECT 1 FROM embedding_jobs q WHERE q.template_id = embedding_jobs.template_id "
+                "AND q.status = 'queued') THEN 'superseded' WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "error = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                [(max_attempts, error, now, j) for j in job_ids],
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {JOB_COLUMNS} FROM embedding_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == "queued":
+                job["queue_position"] = self._conn.execute(
+                    "SELECT count(*) FROM embedding_jobs WHERE status = 'queued' AND created_at < ?",
+                    (job["created_at"],),
+                ).fetchone()[0]
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, count(*) FROM embedding_jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresJobStore(JobStore):
+    """
+    embedding_jobs in the pgvector database (same pool as the vector tables).
+    Claims use FOR UPDATE SKIP LOCKED, so several backend instances can share the queue.
+    """
+
+    def __init__(self):
+        from src.supabase_vector import connection
+
+        self._connection = connection
+        with connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_jobs (
+                id TEXT PRIMARY KEY,
+                template_id TEXT NOT NULL,
+                payload JSONB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """)
+            cur.execute("""
+            CREATE INDEX IF NOT EXISTS embedding_jobs_status_idx ON embedding_jobs (status, created_at);
+            """)
+            # at most one queued job per template: enqueue replaces its payload
+            cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS embedding_jobs_queued_template_key
+            ON embedding_jobs (template_id) WHERE status = 'queued';
+            """)
+
+    def enqueue(self, template: Dict[str, Any]) -> Dict[str, Any]:
+        from psycopg2.extras import Json
+
+        with self._connection() as conn, conn.cursor() as cur:
+            # serialises with mark_failed re-queueing a job for the same template
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (str(template["id"]),))
+            cur.execute("""
+            INSERT INTO embedding_jobs (id, template_id, payload) VALUES (%s, %s, %s)
+            ON CONFLICT (template_id) WHERE status = 'queued'
+            DO UPDATE SET payload = EXCLUDED.payload, attempts = 0, updated_at = now()
+            RETURNING id, xmax <> 0
+            """, (uuid.uuid4().hex, str(template["id"]), Json(template)))
+            job_id, coalesced = cur.fetchone()
+        return {"id": job_id, "status": "queued", "coalesced": coalesced}
+
+    def claim(self, limit: int, lease_seconds: float = EMBED_JOB_LEASE,
+              retry_delay: float = EMBED_JOB_RETRY_DELAY) -> List[Dict[str, Any]]:
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+            UPDATE embedding_jobs SET status = 'running', attempts = attempts + 1, updated_at = now()
+            WHERE id IN (
+                SELECT id FROM embedding_jobs
+                WHERE (status = 'queued' AND (attempts = 0 OR updated_at < now() - make_interval(secs => %s)))
+                   OR (status = 'running' AND updated_at < now() - make_interval(secs => %s))
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, template_id, payload, attempts
+            """, (retry_delay, lease_seconds, limit))
+            rows = cur.fetchall()
+        return [{"id": r[0], "template_id": r[1], "payload": r[2], "attempts": r[3]} for r in rows]
+
+    def mark_done(self, job_ids: List[str]):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "UPDATE embedding_jobs SET status = 'done', error = NULL, updated_at = now() WHERE id = ANY(%s)",
+                (list(job_ids),),
+            )
+
+    def mark_failed(self, job_ids: List[str], error: str, max_attempts: int = EMBED_JOB_MAX_ATTEMPTS):
+        with self._connection() as conn, conn.cursor() as cur:
+            # hold the templates' enqueue locks until commit, so the status check below sees
+            # every committed enqueue and none can slip in before the job is re-queued
+            cur.execute("""
+            SELECT pg_advisory_xact_lock(hashtext(template_id)) FROM (
+                SELECT DISTINCT template_id FROM embedding_jobs WHERE id = ANY(%s) ORDER BY template_id
+            ) t
+            """, (list(job_ids),))
+            # a newer queued job for the same template supersedes the failed one
+            cur.execute("""
+            UPDATE embedding_jobs j
+            SET status = CASE
+                    WHEN EXISTS (SELECT 1 FROM embedding_jobs q
+                                 WHERE q.template_id = j.template_id AND q.status = 'queued') THEN 'superseded'
+                    WHEN j.attempts >= %s THEN 'failed'
+                    ELSE 'queued' END,
+                error = %s, updated_at = now()
+            WHERE j.id = ANY(%s) AND j.status = 'running'
+            """, (max_attempts, error, list(job_ids)))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+            SELECT {JOB_COLUMNS},
+                   CASE WHEN status = 'queued' THEN (
+                       SELECT count(*) FROM embedding_jobs q
+                       WHERE q.status = 'queued' AND q.created_at < j.created_at) END
+            FROM embedding_jobs j WHERE id = %s
+            """, (job_id,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([c.strip() for c in JOB_COLUMNS.split(",")], row[:-1]))
+        if row[-1] is not None:
+            job["queue_position"] = row[-1]
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT status, count(*) FROM embedding_jobs GROUP BY status")
+            return {status: n for status, n in cur.fetchall()}
+
+
+_store: Optional[JobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """The process-wide job store (EMBED_JOB_STORE), created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PostgresJobStore() if EMBED_JOB_STORE == "postgres" else SQLiteJobStore()
+    return _store
+
+
+# ---------- Worker ----------
+class EmbedJobWorker:
+    """
+    Background worker draining the job store.
+
+    Claimed jobs are processed as one group: `process_fn(payloads)` (blocking,
+    run via `run_blocking`) embeds them in a single call and bulk-upserts the
+    rows. If a group fails, its jobs are retried one by one so a single bad
+    template doesn't hold back the rest. Jobs left when the process stops stay
+    in the store and are picked up on the next start.
+    """
+
+    def __init__(self, process_fn: Callable[[List[Dict[str, Any]]], Any],
+                 store_factory: Callable[[], JobStore] = get_job_store,
+                 run_blocking: Callable[..., Awaitable] = asyncio.to_thread,
+                 batch_size: int = EMBED_JOB_BATCH, poll_seconds: float = EMBED_JOB_POLL):
+        self._process_fn = process_fn
+        self._store_factory = store_factory
+        self._run_blocking = run_blocking
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._counters = {"enqueued": 0, "coalesced": 0, "batches": 0, "embedded": 0,
+                          "retries": 0, "failures": 0}
+        self._last_batch: Optional[dict] = None
+
+    @property
+    def store(self) -> JobStore:
+        return self._store_factory()
+
+    # --- API used by the endpoints ---
+    async def enqueue(self, template: Dict[str, Any]) -> Dict[str, Any]:
+        job = await self._run_blocking(self.store.enqueue, template)
+        self._counters["enqueued"] += 1
+        self._counters["coalesced"] += bool(job.get("coalesced"))
+        if self._wake is not None:
+            self._wake.set()
+        return job
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run_blocking(self.store.get, job_id)
+
+    # --- processing ---
+    async def _process(self, jobs: List[Dict[str, Any]]) -> bool:
+        ids = [j["id"] for j in jobs]
+        t = time.perf_counter()
+        try:
+            await self._run_blocking(self._process_fn, [j["payload"] for j in jobs])
+        except Exception as e:
+            self._counters["failures"] += 1
+            print(f"⚠️ Embedding batch of {len(jobs)} template(s) failed: {e}")
+            if len(jobs) > 1:
+                return False
+            await self._run_blocking(self.store.mark_failed, ids, str(e))
+            return True
+        await self._run_blocking(self.store.mark_done, ids)
+        self._counters["batches"] += 1
+        self._counters["embedded"] += len(jobs)
+        self._last_batch = {"size": len(jobs), "seconds": round(time.perf_counter() - t, 3)}
+        return True
+
+    async def run_once(self) -> int:
+        """Claim and process one batch; returns the number of jobs claimed."""
+        jobs = await self._run_blocking(self.store.claim, self.batch_size)
+        if jobs and not await self._process(jobs):
+            self._counters["retries"] += len(jobs)
+            for job in jobs:
+                await self._process([job])
+        return len(jobs)
+
+    async def drain(self):
+        while await self.run_once():
+            if self._stopping is not None and self._stopping.is_set():
+                break
+
+    # --- lifecycle ---
+    async def _run(self):
+        # not cancelled on shutdown: the batch in progress finishes and is marked done
+        while not self._stopping.is_set():
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"⚠️ Embedding job worker tick failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Finish the current batch and stop; queued jobs stay persisted for the next start."""
+        if self._task is not None:
+            self._stopping.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    async def stats(self) -> dict:
+        try:
+            jobs = await self._run_blocking(self.store.counts)
+        except Exception as e:
+            jobs = {"error": str(e)}
+        return {"store": EMBED_JOB_STORE, "jobs": jobs, **self._counters, "last_batch": self._last_batch}
@@ -1,31 +1,45 @@
-import os
 from dotenv import load_dotenv
 from .supabase_vector import upsert_text_chunks
-from .llm import embed_texts
-from typing import Dict, Any
+from .llm import embed_texts, run_blocking
+from .embed_jobs import EmbedJobWorker
+from .governor import BACKGROUND, priority
+from typing import Any, Dict, List
 
 load_dotenv()
 
+def _template_record(user_template: Dict[str, Any], embedding: List[float]) -> Dict[str, Any]:
+    return {
+        "id": f"user-{user_template['id']}",
+        "document": user_template["content"],
+        "metadata": {
+            "title": user_template["title"],
+            "user_id": user_template["user_id"],
+            "source_type": "user"
+        },
+        "embedding": embedding
+    }
+
+def embed_and_store_user_templates(user_templates: List[Dict[str, Any]]):
+    """
+    Embed several user templates (dicts with keys: id, user_id, title, content)
+    in one grouped call and store them in 'user_templates_vector' with one bulk upsert.
+    """
+    if not user_templates:
+        return
+    # queues behind interactive /generate traffic for embedding capacity
+    with priority(BACKGROUND):
+        embeddings = embed_texts([t["content"] for t in user_templates])
+    upsert_text_chunks("user_templates_vector", [
+        _template_record(t, e) for t, e in zip(user_templates, embeddings)
+    ])
+    print(f"✅ Embedded & stored {len(user_templates)} user template(s) for RAG.")
+
 def embed_and_store_user_template(user_template: Dict[str, Any]):
     """
     Takes a user template dict with keys: id, user_id, title, content
     and stores it in the 'user_templates_vector' pgvector table for RAG use.
     """
-    doc_id = f"user-{user_template['id']}"
-    content = user_template["content"]
-    metadata = {
-        "title": user_template["title"],
-        "user_id": user_template["user_id"],
-        "source_type": "user"
-    }
-
-    embedding = embed_texts([content])[0]
-
-    upsert_text_chunks("user_templates_vector", [{
-        "id": doc_id,
-        "document": content,
-        "metadata": metadata,
-        "embedding": embedding
-    }])
+    embed_and_store_user_templates([user_template])
 
-    print(f"✅ Embedded & stored user template '{user_template['title']}' for RAG.")
+# Endpoints enqueue templates here and return 202; started/stopped by main.lifespan
+embed_job_worker = EmbedJobWorker(embed_and_store_user_templates, run_blocking=run_blocking)
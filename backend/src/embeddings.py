@@ -0,0 +1,212 @@
+# backend/src/embeddings.py
+import os
+import time
+import random
+import functools
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple, Type
+
+# ---------- ENV CONFIG ----------
+EMBED_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))       # Gemini batch limit is 100
+EMBED_MAX_INFLIGHT = int(os.getenv("EMBED_MAX_INFLIGHT", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "0.5"))  # seconds
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "20"))     # seconds
+
+# A batch function takes a list of texts and returns one vector per text.
+BatchEmbedFn = Callable[[List[str]], List[List[float]]]
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when a batch could not be embedded (never replaced by dummy vectors)."""
+
+
+# ---------- Transient Error Detection ----------
+_TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+@functools.lru_cache(maxsize=None)
+def _transient_errors() -> tuple:
+    # resolved on first failure so importing this module doesn't load google.api_core
+    try:
+        from google.api_core import exceptions as _gexc
+        return (
+            _gexc.TooManyRequests,
+            _gexc.ResourceExhausted,
+            _gexc.ServiceUnavailable,
+            _gexc.DeadlineExceeded,
+            _gexc.InternalServerError,
+            _gexc.GatewayTimeout,
+            ConnectionError,
+            TimeoutError,
+        )
+    except ImportError:
+        return (ConnectionError, TimeoutError)
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """True if the error is worth retrying (rate limits, 5xx, timeouts, dropped connections)."""
+    if isinstance(exc, _transient_errors()):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return isinstance(code, int) and code in _TRANSIENT_STATUS_CODES
+
+
+# ---------- Engine ----------
+class EmbeddingEngine:
+    """
+    Splits texts into provider-sized batches, runs up to `max_inflight` batches
+    concurrently, retries transient failures with exponential backoff + jitter,
+    and records per-batch throughput stats. Exceptions in `passthrough` (e.g.
+    admission control rejections) are raised as-is, without retrying.
+    """
+
+    def __init__(
+        self,
+        batch_fn: BatchEmbedFn,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_inflight: int = EMBED_MAX_INFLIGHT,
+        max_retries: int = EMBED_MAX_RETRIES,
+        backoff_base: float = EMBED_BACKOFF_BASE,
+        backoff_max: float = EMBED_BACKOFF_MAX,
+        history: int = 200,
+        passthrough: Tuple[Type[BaseException], ...] = (),
+    ):
+        if batch_size < 1 or max_inflight < 1:
+            raise ValueError("batch_size and max_inflight must be >= 1")
+        self.batch_fn = batch_fn
+        self.batch_size = batch_size
+        self.max_inflight = max_inflight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.passthrough = passthrough
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._recent = deque(maxlen=history)
+        self._totals = {"batches": 0, "texts": 0, "retries": 0, "failures": 0, "seconds": 0.0}
+
+    # --- public API ---
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed `texts`, preserving order. Raises EmbeddingError on hard failure."""
+        texts = list(texts)
+        if not texts:
+            return []
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        # Small inputs (e.g. a single query) skip the thread hop entirely.
+        if len(batches) == 1:
+            return self._run_batch(batches[0])
+
+        # each batch runs in the caller's context (e.g. its request priority)
+        futures = [self._get_executor().submit(contextvars.copy_context().run, self._run_batch, b)
+                   for b in batches]
+        vectors: List[List[float]] = []
+        try:
+            for fut in futures:
+                vectors.extend(fut.result())
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            raise
+        return vectors
+
+    def stats(self) -> dict:
+        """Aggregate + recent per-batch throughput stats for tuning batch size / concurrency."""
+        with self._stats_lock:
+            totals = dict(self._totals)
+            recent = list(self._recent)
+
+        busy = totals["seconds"]
+        latencies = sorted(r["seconds"] for r in recent)
+        return {
+            "config": {
+                "model": EMBED_MODEL,
+                "batch_size": self.batch_size,
+                "max_inflight": self.max_inflight,
+                "max_retries": self.max_retries,
+            },
+            "totals": totals,
+            "texts_per_batch_second": round(totals["texts"] / busy, 2) if busy else 0.0,
+            "recent_batch_p50_seconds": _percentile(latencies, 0.50),
+            "recent_batch_p95_seconds": _percentile(latencies, 0.95),
+            "recent_batches": recent[-20:],
+        }
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    # --- internals ---
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_inflight, thread_name_prefix="embed"
+                )
+            return self._executor
+
+    def _run_batch(self, batch: List[str]) -> List[List[float]]:
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                vectors = self.batch_fn(batch)
+                _validate(batch, vectors)
+                self._record(len(batch), time.perf_counter() - start, attempt, ok=True)
+                return vectors
+            except Exception as e:
+                if isinstance(e, self.passthrough):
+                    self._record(len(batch), time.perf_counter() - start, attempt, ok=False)
+                    raise
+                if attempt < self.max_retries and is_transient_error(e):
+                    delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                    time.sleep(delay * random.uniform(0.5, 1.0))
+                    attempt += 1
+                    continue
+                self._record(len(batch), time.perf_counter() - start, attempt, ok=False)
+                if isinstance(e, EmbeddingError):
+                    raise
+                raise EmbeddingError(
+                    f"Embedding batch of {len(batch)} failed after {attempt + 1} attempt(s): {e}"
+                ) from e
+
+    def _record(self, size: int, seconds: float, retries: int, ok: bool):
+        with self._stats_lock:
+            self._totals["batches"] += 1
+            self._totals["texts"] += size if ok else 0
+            self._totals["retries"] += retries
+            self._totals["failures"] += 0 if ok else 1
+            self._totals["seconds"] += seconds
+            self._recent.append({
+                "size": size,
+                "seconds": round(seconds, 4),
+                "retries": retries,
+                "ok": ok,
+                "texts_per_second": round(size / seconds, 2) if ok and seconds else 0.0,
+            })
+
+
+def _validate(batch: List[str], vectors) -> None:
+    if vectors is None or len(vectors) != len(batch):
+        got = 0 if vectors is None else len(vectors)
+        raise EmbeddingError(f"Provider returned {got} vectors for {len(batch)} texts")
+    for v in vectors:
+        if not v:
+            raise EmbeddingError("Provider returned an empty embedding")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
@@ -0,0 +1,181 @@
+# backend/src/generation_cache.py
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# ---------- ENV CONFIG ----------
+GEN_CACHE_ENABLED = os.getenv("GEN_CACHE_ENABLED", "1") == "1"
+GEN_CACHE_TTL = float(os.getenv("GEN_CACHE_TTL", "86400"))                    # seconds
+GEN_CACHE_MAX_BYTES = int(os.getenv("GEN_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+GEN_CACHE_SEMANTIC = os.getenv("GEN_CACHE_SEMANTIC", "0") == "1"
+GEN_CACHE_SEMANTIC_MAX_DISTANCE = float(os.getenv("GEN_CACHE_SEMANTIC_MAX_DISTANCE", "0.05"))
+
+
+def _normalize(text: Optional[str]) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def generation_scope(
+    grade: Optional[str],
+    selected_template: Optional[str],
+    additional_ctx: Optional[str],
+    temperature: float,
+    model: str,
+    user_id: Optional[str] = None,
+    subject: Optional[str] = None,
+) -> str:
+    """
+    Everything except the prompt that changes the answer. Semantic hits are only
+    served within the same scope. grade/subject are the values detected from the
+    prompt. user_id matters only with a selected template (user templates are only
+    retrieved on that path).
+    """
+    parts = [
+        _normalize(grade),
+        _normalize(subject),
+        str(selected_template or ""),
+        hashlib.sha256((additional_ctx or "").encode("utf-8")).hexdigest(),
+        f"{float(temperature):.3f}",
+        model,
+        str(user_id or "") if selected_template else "",
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "scope", "embedding")
+
+    def __init__(self, value: str, expires_at: float, size: int, scope: str, embedding: Optional[np.ndarray]):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.scope = scope
+        self.embedding = embedding
+
+
+class GenerationCache:
+    """
+    Cache of generated content.
+
+    - exact mode: key = (normalized prompt, scope)
+    - semantic mode (optional): on an exact miss, serve the entry in the same scope
+      whose query embedding is within `max_distance` cosine distance.
+
+    LRU eviction bounded by total bytes of cached text, plus a per-entry TTL.
+    """
+
+    def __init__(self, max_bytes: int = GEN_CACHE_MAX_BYTES, ttl_seconds: float = GEN_CACHE_TTL,
+                 semantic: bool = GEN_CACHE_SEMANTIC, max_distance: float = GEN_CACHE_SEMANTIC_MAX_DISTANCE):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.max_distance = max_distance
+        self._data: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._by_scope: Dict[str, set] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0,
+                          "stores": 0, "evictions": 0, "expired": 0}
+
+    # --- lookup ---
+    def get(self, prompt: str, scope: str, embedding: Optional[Sequence[float]] = None) -> Tuple[Optional[str], str]:
+        """Returns (content, "exact" | "semantic" | "miss")."""
+        key = (_normalize(prompt), scope)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry.expires_at >= now:
+                self._data.move_to_end(key)
+                self._counters["exact_hits"] += 1
+                return entry.value, "exact"
+            if entry is not None:
+                self._remove(key)
+                self._counters["expired"] += 1
+
+            if self.semantic and embedding is not None:
+                hit = self._nearest(scope, embedding, now)
+                if hit is not None:
+                    self._data.move_to_end(hit)
+                    self._counters["semantic_hits"] += 1
+                    return self._data[hit].value, "semantic"
+
+            self._counters["misses"] += 1
+            return None, "miss"
+
+    def record_bypass(self):
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    # --- store ---
+    def set(self, prompt: str, scope: str, value: str, embedding: Optional[Sequence[float]] = None):
+        key = (_normalize(prompt), scope)
+        size = sys.getsizeof(value) + (len(embedding) * 4 if embedding is not None else 0)
+        if size > self.max_bytes:
+            return
+        vec = None
+        if embedding is not None:
+            vec = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vec)
+            vec = vec / norm if norm else vec
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = _Entry(value, time.monotonic() + self.ttl_seconds, size, scope, vec)
+            self._by_scope.setdefault(scope, set()).add(key)
+            self._bytes += size
+            self._counters["stores"] += 1
+            while self._bytes > self.max_bytes and self._data:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_scope.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self._counters)
+            entries, size = len(self._data), self._bytes
+        hits = c["exact_hits"] + c["semantic_hits"]
+        lookups = hits + c["misses"]
+        return {
+            "enabled": GEN_CACHE_ENABLED,
+            "semantic": self.semantic,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            **c,
+        }
+
+    # --- internals (call with lock held) ---
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+        keys = self._by_scope.get(entry.scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_scope[entry.scope]
+
+    def _nearest(self, scope: str, embedding: Sequence[float], now: float):
+        keys: List = [k for k in self._by_scope.get(scope, ())
+                      if self._data[k].embedding is not None and self._data[k].expires_at >= now]
+        if not keys:
+            return None
+        q = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm:
+            q = q / norm
+        sims = np.vstack([self._data[k].embedding for k in keys]) @ q
+        best = int(np.argmax(sims))
+        return keys[best] if 1.0 - float(sims[best]) <= self.max_distance else None
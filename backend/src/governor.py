@@ -0,0 +1,336 @@
+# backend/src/governor.py
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+# ---------- ENV CONFIG ----------
+# Rates are requests per minute (0 = no rate limit); burst is the bucket size.
+GEN_RPM = float(os.getenv("GOVERNOR_GEN_RPM", "300"))
+GEN_BURST = int(os.getenv("GOVERNOR_GEN_BURST", "10"))
+GEN_MAX_CONCURRENCY = int(os.getenv("GOVERNOR_GEN_MAX_CONCURRENCY", "16"))
+GEN_MAX_QUEUE = int(os.getenv("GOVERNOR_GEN_MAX_QUEUE", "64"))
+EMBED_RPM = float(os.getenv("GOVERNOR_EMBED_RPM", "1500"))
+EMBED_BURST = int(os.getenv("GOVERNOR_EMBED_BURST", "20"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("GOVERNOR_EMBED_MAX_CONCURRENCY", "8"))
+EMBED_MAX_QUEUE = int(os.getenv("GOVERNOR_EMBED_MAX_QUEUE", "128"))
+# Longest a caller waits for admission before it's shed (interactive stays well under the 40 s Gemini timeout)
+GOVERNOR_MAX_WAIT = float(os.getenv("GOVERNOR_MAX_WAIT", "10"))
+GOVERNOR_MAX_WAIT_BACKGROUND = float(os.getenv("GOVERNOR_MAX_WAIT_BACKGROUND", "120"))
+
+# ---------- Priorities ----------
+INTERACTIVE = 0  # teacher-facing requests (default)
+BACKGROUND = 1   # ingestion / embedding jobs
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of the calls made by the current request/task; copied into worker threads by run_blocking.
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Run the enclosed provider calls at `level` (e.g. BACKGROUND for ingestion)."""
+    token = request_priority.set(level)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class GovernorRejected(RuntimeError):
+    """Admission refused (queue full or waited too long); surfaced as 429 + Retry-After."""
+
+    def __init__(self, name: str, reason: str, retry_after: int):
+        super().__init__(f"{name} capacity exhausted ({reason}); retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# ---------- Token Bucket ----------
+class TokenBucket:
+    """`rate_per_minute` tokens refilled continuously up to `burst` (not thread-safe; callers lock)."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+
+# ---------- Governor ----------
+class _Waiter:
+    __slots__ = ("priority", "enqueued_at", "granted", "rejected", "event", "loop", "future")
+
+    def __init__(self, level: int, now: float, event: Optional[threading.Event] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = level
+        self.enqueued_at = now
+        self.granted = False
+        self.rejected = False
+        self.event = event
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ConcurrencyGovernor:
+    """
+    Admission control for one provider API (generation or embedding).
+
+    A call is admitted when a concurrency slot is free and the token bucket
+    has a token; otherwise it waits in a bounded priority queue (interactive
+    before background, FIFO within a priority). A full queue rejects at once;
+    an interactive caller arriving at a full queue takes the place of the
+    newest background waiter instead. Callers that wait longer than their
+    max wait are rejected too. Both threads (`slot`) and coroutines
+    (`slot_async`) share the same slots, bucket and queue.
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int, max_concurrency: int,
+                 max_queue: int, history: int = 500):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self._bucket = TokenBucket(rate_per_minute, burst)
+        self._rate_per_minute = rate_per_minute
+        self._lock = threading.Lock()
+        self._heap = []  # (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._queued = {level: 0 for level in _PRIORITY_NAMES}
+        self._in_flight = 0
+        self._timer: Optional[threading.Timer] = None
+        self._hold_seconds = 1.0  # EWMA of slot hold time, for Retry-After
+        self._waits = {level: deque(maxlen=history) for level in _PRIORITY_NAMES}
+        self._counters = {"admitted": 0, "queued": 0, "rejected_queue_full": 0,
+                          "rejected_timeout": 0, "preempted": 0}
+
+    @staticmethod
+    def _max_wait(level: int) -> float:
+        return GOVERNOR_MAX_WAIT if level == INTERACTIVE else GOVERNOR_MAX_WAIT_BACKGROUND
+
+    # --- internals (call with self._lock held) ---
+    def _depth(self) -> int:
+        return sum(self._queued.values())
+
+    def _retry_after(self, now: float) -> int:
+        backlog = self._depth() + 1
+        by_rate = self._bucket.wait_time(now) + backlog / self._bucket.rate if self._bucket.rate else 0.0
+        by_slots = self._hold_seconds * backlog / self.max_concurrency
+        return max(1, math.ceil(max(by_rate, by_slots)))
+
+    def _admit(self, level: int, waited: float):
+        self._bucket.take()
+        self._in_flight += 1
+        self._counters["admitted"] += 1
+        self._waits[level].append(waited)
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._heap and self._in_flight < self.max_concurrency:
+            level, _, waiter = self._heap[0]
+            if waiter.rejected:  # timed out, cancelled or preempted
+                heapq.heappop(self._heap)
+                continue
+            wait = self._bucket.wait_time(now)
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._heap)
+            self._queued[level] -= 1
+            self._admit(level, now - waiter.enqueued_at)
+            waiter.granted = True
+            waiter.wake()
+
+    def _schedule(self, delay: float):
+        # one timer re-runs dispatch when the bucket next has a token
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _try_now(self, level: int, now: float) -> bool:
+        if not self._depth() and self._in_flight < self.max_concurrency and self._bucket.wait_time(now) == 0:
+            self._admit(level, 0.0)
+            return True
+        return False
+
+    def _withdraw(self, waiter: _Waiter):
+        waiter.rejected = True
+        self._queued[waiter.priority] -= 1
+
+    def _enqueue(self, waiter: _Waiter, now: float) -> _Waiter:
+        if self._depth() >= self.max_queue:
+            victims = [w for _, _, w in self._heap if not w.rejected and w.priority > waiter.priority]
+            if not victims:
+                self._counters["rejected_queue_full"] += 1
+                raise GovernorRejected(self.name, "queue full", self._retry_after(now))
+            victim = max(victims, key=lambda w: (w.priority, w.enqueued_at))
+            self._withdraw(victim)
+            self._counters["preempted"] += 1
+            victim.wake()
+        heapq.heappush(self._heap, (waiter.priority, next(self._seq), waiter))
+        self._queued[waiter.priority] += 1
+        self._counters["queued"] += 1
+        self._dispatch()
+        return waiter
+
+    def _outcome(self, waiter: _Waiter):
+        """After waking or timing out: return if admitted, else raise GovernorRejected."""
+        if waiter.granted:
+            return
+        now = time.monotonic()
+        if waiter.rejected:
+            reason = "preempted by interactive traffic"
+        else:
+            self._withdraw(waiter)
+            self._counters["rejected_timeout"] += 1
+            reason = f"waited {round(now - waiter.enqueued_at, 1)}s"
+        raise GovernorRejected(self.name, reason, self._retry_after(now))
+
+    def _release(self, held: float):
+        self._in_flight -= 1
+        self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+        self._dispatch()
+
+    # --- public API ---
+    def check_admission(self, level: Optional[int] = None):
+        """Raise GovernorRejected now if a call at `level` would be shed (e.g. before starting a stream)."""
+        level = request_priority.get() if level is None else level
+        with self._lock:
+            if self._depth() >= self.max_queue and not any(
+                w.priority > level for _, _, w in self._heap if not w.rejected
+            ):
+                self._counters["rejected_queue_full"] += 1
+                raise GovernorRejected(self.name, "queue full", self._retry_after(time.monotonic()))
+
+    def acquire(self, level: Optional[int] = None):
+        """Block the calling thread until admitted; pair with release()."""
+        level = request_priority.get() if level is None else level
+        now = time.monotonic()
+        with self._lock:
+            if self._try_now(level, now):
+                return
+            waiter = self._enqueue(_Waiter(level, now, event=threading.Event()), now)
+        waiter.event.wait(self._max_wait(level))
+        with self._lock:
+            self._outcome(waiter)
+
+    async def acquire_async(self, level: Optional[int] = None):
+        """Wait (without blocking the event loop) until admitted; pair with release()."""
+        level = request_priority.get() if level is None else level
+        now = time.monotonic()
+        with self._lock:
+            if self._try_now(level, now):
+                return
+            waiter = self._enqueue(_Waiter(level, now, loop=asyncio.get_running_loop()), now)
+        try:
+            await asyncio.wait_for(waiter.future, self._max_wait(level))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._release(0.0)
+                elif not waiter.rejected:
+                    self._withdraw(waiter)
+            raise
+        with self._lock:
+            self._outcome(waiter)
+
+    def release(self, held: float = 0.0):
+        with self._lock:
+            self._release(held)
+
+    @contextmanager
+    def slot(self, level: Optional[int] = None):
+        self.acquire(level)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot_async(self, level: Optional[int] = None):
+        await self.acquire_async(level)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = {level: sorted(w) for level, w in self._waits.items()}
+            stats = {
+                "config": {
+                    "rate_per_minute": self._rate_per_minute,
+                    "burst": self._bucket.burst,
+                    "max_concurrency": self.max_concurrency,
+                    "max_queue": self.max_queue,
+                },
+                "in_flight": self._in_flight,
+                "queue_depth": {_PRIORITY_NAMES[level]: n for level, n in self._queued.items()},
+                "tokens": round(self._bucket.tokens, 2),
+                "hold_seconds_ewma": round(self._hold_seconds, 3),
+                **self._counters,
+            }
+        stats["wait_ms"] = {
+            _PRIORITY_NAMES[level]: {
+                "p50": _percentile_ms(w, 0.50),
+                "p95": _percentile_ms(w, 0.95),
+                "max": _percentile_ms(w, 1.0),
+            }
+            for level, w in waits.items()
+        }
+        return stats
+
+
+def _percentile_ms(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return round(sorted_values[idx] * 1000, 1)
+
+
+# Process-wide: every Gemini call in src/llm.py goes through one of these
+generation_governor = ConcurrencyGovernor("generation", GEN_RPM, GEN_BURST, GEN_MAX_CONCURRENCY, GEN_MAX_QUEUE)
+embedding_governor = ConcurrencyGovernor("embedding", EMBED_RPM, EMBED_BURST, EMBED_MAX_CONCURRENCY, EMBED_MAX_QUEUE)
+
+
+def governor_stats() -> Dict[str, dict]:
+    return {"generation": generation_governor.stats(), "embedding": embedding_governor.stats()}
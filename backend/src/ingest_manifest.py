@@ -0,0 +1,185 @@
+# backend/src/ingest_manifest.py
+import os
+import json
+import array
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+# ---------- ENV CONFIG ----------
+INGEST_STATE_DIR = Path(os.getenv("INGEST_STATE_DIR", Path(__file__).resolve().parent.parent / ".ingest"))
+
+
+# ---------- Hashing ----------
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    """Content hash of a file, read in blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def record_hash(document: str, metadata: dict) -> str:
+    """Hash of everything that ends up in a row except the embedding."""
+    return text_sha256(document + "\x00" + json.dumps(metadata, sort_keys=True, default=str))
+
+
+# ---------- Manifest ----------
+class IngestManifest:
+    """
+    JSON manifest of what has been ingested, per table and source:
+
+        {"tables": {"textbooks": {"grade6_science.pdf": {
+            "file_hash": "...", "complete": true, "chunks": {"<row id>": "<record hash>"}}}}}
+
+    Chunk hashes are checkpointed as each upsert batch commits, so a crashed run
+    resumes by skipping rows that are already in the database. A source is only
+    marked `complete` (and its stale rows deleted) once every chunk is written.
+    """
+
+    def __init__(self, path: Path = INGEST_STATE_DIR / "manifest.json"):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        try:
+            self._data = json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._data = {"version": 1, "tables": {}}
+
+    def source(self, table: str, source: str) -> dict:
+        with self._lock:
+            tables = self._data["tables"].setdefault(table, {})
+            return tables.setdefault(source, {"file_hash": None, "complete": False, "chunks": {}})
+
+    def sources(self, table: str) -> List[str]:
+        with self._lock:
+            return list(self._data["tables"].get(table, {}))
+
+    def is_unchanged(self, table: str, source: str, file_hash: str) -> bool:
+        entry = self.source(table, source)
+        return entry["complete"] and entry["file_hash"] == file_hash
+
+    def start(self, table: str, source: str, file_hash: Optional[str]):
+        """Mark a source as in progress (keeps its chunk checkpoints for resuming)."""
+        entry = self.source(table, source)
+        with self._lock:
+            if entry["file_hash"] != file_hash:
+                entry["complete"] = False
+            entry["file_hash"] = file_hash
+        self.save()
+
+    def has_chunk(self, table: str, source: str, chunk_id: str, chunk_hash: str) -> bool:
+        return self.source(table, source)["chunks"].get(chunk_id) == chunk_hash
+
+    def checkpoint(self, table: str, rows: Sequence[dict]):
+        """Record committed rows; each row needs "id", "source" and "hash"."""
+        with self._lock:
+            tables = self._data["tables"].setdefault(table, {})
+            for r in rows:
+                entry = tables.setdefault(r["source"], {"file_hash": None, "complete": False, "chunks": {}})
+                entry["chunks"][r["id"]] = r["hash"]
+        self.save()
+
+    def complete(self, table: str, source: str, live_ids: Sequence[str],
+                 delete_fn: Callable[[str, List[str]], int]) -> int:
+        """Delete rows of `source` that are no longer produced, then mark it complete."""
+        entry = self.source(table, source)
+        live = set(live_ids)
+        stale = [cid for cid in entry["chunks"] if cid not in live]
+        if stale:
+            delete_fn(table, stale)
+        with self._lock:
+            for cid in stale:
+                entry["chunks"].pop(cid, None)
+            entry["complete"] = True
+        self.save()
+        return len(stale)
+
+    def forget(self, table: str, source: str, delete_fn: Callable[[str, List[str]], int]) -> int:
+        """Remove a source that no longer exists, including its rows."""
+        entry = self.source(table, source)
+        ids = list(entry["chunks"])
+        if ids:
+            delete_fn(table, ids)
+        with self._lock:
+            self._data["tables"][table].pop(source, None)
+        self.save()
+        return len(ids)
+
+    def save(self):
+        with self._lock:
+            payload = json.dumps(self._data)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(payload)
+        os.replace(tmp, self.path)  # atomic: a crash never leaves a half-written manifest
+
+
+# ---------- Persistent Embedding Cache ----------
+class EmbeddingCache:
+    """
+    On-disk (SQLite) cache of embeddings keyed by (model, text hash), so
+    re-chunking experiments and resumed runs reuse vectors already paid for.
+    """
+
+    def __init__(self, model: str, path: Path = INGEST_STATE_DIR / "embeddings.sqlite"):
+        self.model = model
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(model TEXT, text_hash TEXT, vector BLOB, PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                part = list(hashes[i:i + 500])
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(part))})",
+                    [self.model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array.array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, Sequence[float]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model, h, array.array("f", v).tobytes()) for h, v in items.items()],
+            )
+            self._conn.commit()
+
+    def embed(self, texts: Sequence[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Embed `texts` (order preserved), calling `embed_fn` only for cache misses."""
+        hashes = [text_sha256(t) for t in texts]
+        found = self.get_many(sorted(set(hashes)))
+        missing = {h: t for h, t in zip(hashes, texts) if h not in found}
+        with self._lock:
+            self.hits += len(texts) - sum(1 for h in hashes if h in missing)
+            self.misses += sum(1 for h in hashes if h in missing)
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.put_many(fresh)
+            found.update(fresh)
+        return [found[h] for h in hashes]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,58 @@
+# backend/src/lexical.py
+import re
+import math
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+# Words that appear in almost every teacher prompt and carry no topic signal.
+PROMPT_BOILERPLATE = {
+    "generate", "create", "make", "write", "prepare", "give", "provide", "explain",
+    "lesson", "plan", "plans", "grade", "class", "students", "student", "teaching",
+    "content", "activity", "activities", "worksheet", "please", "about", "using",
+    "the", "and", "for", "with", "from", "into", "that", "this", "what", "how",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def keyword_terms(text: str) -> List[str]:
+    """Lowercased topic words of `text` (no boilerplate, numbers or very short words)."""
+    return [
+        w for w in _WORD_RE.findall((text or "").lower())
+        if len(w) > 2 and not w.isdigit() and w not in PROMPT_BOILERPLATE
+    ]
+
+
+def keyword_tsquery(text: str) -> Optional[str]:
+    """OR-query of the prompt's topic words in to_tsquery syntax (None if there are none)."""
+    terms = list(dict.fromkeys(keyword_terms(text)))
+    return " | ".join(terms) if terms else None
+
+
+class BM25:
+    """Tiny in-memory BM25 scorer for small collections (e.g. the system templates)."""
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._tfs: List[Counter] = [Counter(keyword_terms(d)) for d in documents]
+        self._lens = [sum(tf.values()) for tf in self._tfs]
+        self._avg_len = (sum(self._lens) / len(self._lens)) if self._lens else 0.0
+        df: Counter = Counter()
+        for tf in self._tfs:
+            df.update(tf.keys())
+        n = len(self._tfs)
+        self._idf: Dict[str, float] = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    def scores(self, query: str) -> List[float]:
+        terms = keyword_terms(query)
+        out = []
+        for tf, length in zip(self._tfs, self._lens):
+            s = 0.0
+            for t in terms:
+                f = tf.get(t)
+                if f:
+                    norm = self.k1 * (1 - self.b + self.b * length / (self._avg_len or 1.0))
+                    s += self._idf[t] * f * (self.k1 + 1) / (f + norm)
+            out.append(s)
+        return out
@@ -1,20 +1,18 @@
 import os 
 import re
+import time
+import asyncio
+import functools
 import threading
-from typing import List, Optional
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import numpy as np
 from dotenv import load_dotenv
-from markdownify import markdownify as md
-from supabase import create_client
 
 # === Load environment variables ===
 load_dotenv()
 
-# ---------- Supabase Client ----------
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-)
-
 # ---------- Text Cleaning ----------
 def clean_text_output(text: str) -> str:
     """Convert Gemini output into clean Markdown."""
@@ -27,6 +25,7 @@ def clean_text_output(text: str) -> str:
 
     # Convert HTML → Markdown if it looks like HTML
     if "<p>" in text or "<div>" in text or "<ul>" in text or "<h" in text:
+        from markdownify import markdownify as md  # imported on first use (slow import)
         text = md(text, heading_style="ATX")
 
     # Normalize spacing
@@ -34,90 +33,325 @@ def clean_text_output(text: str) -> str:
     return text.strip()
 
 
+_HTML_HINTS = ("<p>", "<div>", "<ul>", "<h")
+# elements that may span lines; converted once their closing tag has arrived
+_BLOCK_OPEN_RE = re.compile(r"<(ul|ol|table|p|div|blockquote|pre|dl)\b[^>]*>", re.IGNORECASE)
+_BLOCK_CLOSE_RE = re.compile(r"</(ul|ol|table|p|div|blockquote|pre|dl)\s*>", re.IGNORECASE)
+
+
+class StreamingMarkdownCleaner:
+    """
+    Incremental version of clean_text_output for streamed output.
+    Works line by line: strips code fences, converts HTML to Markdown (lines
+    inside a multi-line block element are held back until it closes),
+    collapses 3+ newlines to 2 and trims leading/trailing blank lines.
+    """
+
+    def __init__(self):
+        self._partial = ""
+        self._newlines = 0
+        self._started = False
+        self._block = []
+        self._depth = 0
+
+    def feed(self, chunk: str) -> str:
+        """Add a streamed chunk; returns the cleaned text that is safe to emit now."""
+        self._partial += chunk or ""
+        *lines, self._partial = self._partial.split("\n")
+        return "".join(self._clean_line(line, terminated=True) for line in lines)
+
+    def flush(self) -> str:
+        """Emit whatever is left at end of stream (trailing blank lines dropped)."""
+        tail, self._partial = self._partial, ""
+        out = self._clean_line(tail, terminated=False) if tail else ""
+        if self._block:  # unclosed block: convert what we have
+            out += self._emit_block(terminated=False)
+        return out
+
+    def _clean_line(self, line: str, terminated: bool) -> str:
+        line = re.sub(r"```[a-zA-Z]*", "", line).replace("```", "")
+        self._depth += len(_BLOCK_OPEN_RE.findall(line)) - len(_BLOCK_CLOSE_RE.findall(line))
+        if self._block or self._depth > 0:
+            self._block.append(line)
+            if self._depth > 0 and terminated:
+                return ""
+            return self._emit_block(terminated)
+        if any(h in line for h in _HTML_HINTS):
+            return self._emit_converted(line, terminated)
+        return self._emit(line, terminated)
+
+    def _emit_block(self, terminated: bool) -> str:
+        text, self._block, self._depth = "\n".join(self._block), [], 0
+        return self._emit_converted(text, terminated)
+
+    def _emit_converted(self, html: str, terminated: bool) -> str:
+        from markdownify import markdownify as md
+        text = md(html, heading_style="ATX")
+        body = text.strip("\n")
+        # markdownify sets blocks apart with blank lines; keep them as pending newlines
+        # (capped at 2 like the rest) so paragraphs stay separated as in clean_text_output
+        if self._started:
+            self._newlines += len(text) - len(text.lstrip("\n"))
+        lines = body.split("\n")
+        out = "".join(self._emit(l, terminated=terminated or i < len(lines) - 1) for i, l in enumerate(lines))
+        if self._started and body:
+            self._newlines += len(text) - len(text.rstrip("\n"))
+        return out
+
+    def _emit(self, line: str, terminated: bool) -> str:
+        out = ""
+        if line.strip():
+            if not self._started:
+                line = line.lstrip()
+                self._started = True
+            else:
+                out = "\n" * min(self._newlines, 2)
+            out += line
+            self._newlines = 0
+        elif self._started and line:
+            # whitespace-only line: clean_text_output keeps these, so do we
+            out = "\n" * min(self._newlines, 2) + line
+            self._newlines = 0
+        if terminated and self._started:
+            self._newlines += 1
+        return out
+
+
 # ---------- ENV CONFIG ----------
 GEMINI_KEY = os.getenv("GEMINI_API_KEY")
 GEN_MODEL = os.getenv("GEMINI_GENERATION_MODEL", "gemini-2.5-flash")
 RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "vector")          # vector | hybrid | auto
+LEXICAL_CONFIDENCE = float(os.getenv("LEXICAL_CONFIDENCE", "0.5"))      # auto mode: min normalized ts_rank_cd
 
 # ---------- Google GenAI Client ----------
-try:
-    import google.generativeai as genai
-    genai.configure(api_key=GEMINI_KEY)
-    gemini_model = genai.GenerativeModel(GEN_MODEL)
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
-    print("[WARNING] Google GenerativeAI not available - RAG features disabled")
+# google.generativeai is the slowest import in the app, so it's loaded and
+# configured on first use (or by the startup warm-up), not at import time.
+genai = None
+gemini_model = None
+GENAI_AVAILABLE: Optional[bool] = None  # None = not loaded yet
+_genai_lock = threading.Lock()
+
+
+def genai_available() -> bool:
+    """Import and configure Gemini once; False if the SDK isn't installed."""
+    global genai, gemini_model, GENAI_AVAILABLE
+    if GENAI_AVAILABLE is None:
+        with _genai_lock:
+            if GENAI_AVAILABLE is None:
+                try:
+                    import google.generativeai as _genai
+                    _genai.configure(api_key=GEMINI_KEY)
+                    genai, gemini_model = _genai, _genai.GenerativeModel(GEN_MODEL)
+                    GENAI_AVAILABLE = True
+                except ImportError:
+                    GENAI_AVAILABLE = False
+                    print("[WARNING] Google GenerativeAI not available - RAG features disabled")
+    return GENAI_AVAILABLE
+
+
+async def genai_available_async() -> bool:
+    """genai_available() without blocking the event loop on the first (importing) call."""
+    if GENAI_AVAILABLE is None:
+        return await run_blocking(genai_available)
+    return GENAI_AVAILABLE
 
 
 # ---------- Supabase Vector Helpers ----------
-from src.supabase_vector import retrieve_top_k_by_embedding
+from src.supabase_vector import (
+    retrieve_top_k_by_embedding, retrieve_multi_by_embedding, retrieve_lexical,
+    fetch_all_rows, add_write_listener,
+)
+from src.template_index import InMemoryVectorIndex
+
+# ~24 system templates: ranked in memory instead of a Postgres round trip per request.
+system_templates_index = InMemoryVectorIndex(lambda: fetch_all_rows("templates"))
+add_write_listener("templates", system_templates_index.invalidate)
+
+
+def _search_system_templates(embedding: List[float], k: int) -> List[dict]:
+    try:
+        return system_templates_index.search(embedding, k=k)
+    except Exception as e:
+        print(f"⚠️ In-memory template index unavailable ({e}) — querying Postgres.")
+        return retrieve_top_k_by_embedding("templates", embedding, k=k)
+
+
+# ---------- Admission Control ----------
+from src.governor import GovernorRejected, embedding_governor, generation_governor
 
 
 # ---------- Embeddings ----------
+from src.embeddings import EMBED_MODEL, EmbeddingEngine
+
+
+def _gemini_embed_batch(texts: List[str], task_type: str = "retrieval_document") -> List[List[float]]:
+    """One provider call for a whole batch (Gemini batches list content internally)."""
+    with embedding_governor.slot():
+        result = genai.embed_content(
+            model=EMBED_MODEL,
+            content=texts,
+            task_type=task_type,
+        )
+    return result["embedding"]
+
+
+# rejections are load shedding, not provider errors: raised at once, never retried
+embedding_engine = EmbeddingEngine(_gemini_embed_batch, passthrough=(GovernorRejected,))
+
+
 def embed_texts(texts: List[str]) -> List[List[float]]:
-    """Call Gemini embeddings (returns list of vectors)."""
-    if not GENAI_AVAILABLE:
+    """
+    Call Gemini embeddings (returns list of vectors, same order as `texts`).
+    Raises EmbeddingError instead of returning placeholder vectors.
+    """
+    if not genai_available():
         raise RuntimeError("Google GenerativeAI not available")
+    return embedding_engine.embed(texts)
+
+
+def get_embedding_stats() -> dict:
+    """Per-batch throughput stats for the shared embedding engine."""
+    return embedding_engine.stats()
+
+
+# ---------- Query Embedding Cache ----------
+from src.cache import TTLCache
+
+query_embedding_cache = TTLCache(
+    maxsize=int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048")),
+    ttl_seconds=float(os.getenv("QUERY_EMBED_CACHE_TTL", "3600")),
+)
 
-    vectors = []
-    for text in texts:
-        try:
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=text,
-                task_type="retrieval_document",
-            )
-            embedding = result["embedding"]
-            print(f"[DEBUG] Embedding dimension: {len(embedding)}")
-            vectors.append(embedding)
-        except Exception as e:
-            print(f"[ERROR] Embedding failed: {e}")
-            vectors.append([0.0] * 768)  # fallback dummy vector
-    return vectors
+
+def normalize_prompt(text: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt, used as a cache key."""
+    return " ".join((text or "").lower().split())
+
+
+def embed_query(prompt: str) -> List[float]:
+    """Embed a single query prompt, served from the process-wide LRU+TTL cache when possible."""
+    key = normalize_prompt(prompt)
+    cached = query_embedding_cache.get(key)
+    if cached is not None:
+        return cached
+    embedding = embed_texts([prompt])[0]
+    query_embedding_cache.set(key, embedding)
+    return embedding
 
 
 # ---------- Retriever ----------
-def retrieve_top_k(prompt: str, collection_name: str, user_id: Optional[str] = None, k: int = RAG_TOP_K) -> List[dict]:
-    """Retrieve documents from vector tables. Supports system + user templates."""
-    prompt_embedding = embed_texts([prompt])[0]
+from src.context_assembler import RAG_CONTEXT_TOKEN_BUDGET, assemble_context
+
+# textbook chunks fetched per request; the context assembler keeps what fits the budget
+RAG_TEXTBOOK_CANDIDATES = int(os.getenv("RAG_TEXTBOOK_CANDIDATES", "6"))
+
+
+def retrieve_top_k(
+    prompt: str,
+    collection_name: str,
+    user_id: Optional[str] = None,
+    k: int = RAG_TOP_K,
+    query_embedding: Optional[List[float]] = None,
+    token_budget: Optional[int] = None,
+) -> List[dict]:
+    """
+    Retrieve documents from vector tables. Supports system + user templates.
+    Pass `query_embedding` to reuse a request's embedding across several retrievals.
+    With `token_budget`, results are deduplicated, MMR-ordered and trimmed to fit.
+    """
+    prompt_embedding = query_embedding if query_embedding is not None else embed_query(prompt)
 
     results = []
     if collection_name == "templates":
         # system templates
-        results += retrieve_top_k_by_embedding("templates", prompt_embedding, k=k)
+        results += _search_system_templates(prompt_embedding, k)
 
         # user templates
         if user_id:
-            user_results = retrieve_top_k_by_embedding("user_templates_vector", prompt_embedding, k=k)
-            user_results = [r for r in user_results if str(r["metadata"].get("user_id")) == str(user_id)]
-            results += user_results
+            results += retrieve_top_k_by_embedding("user_templates_vector", prompt_embedding, k=k, user_id=user_id)
 
     elif collection_name == "textbooks":
         results += retrieve_top_k_by_embedding("textbooks", prompt_embedding, k=k)
 
-    results = sorted(results, key=lambda x: x.get("distance", 9999))
-    return results[:k]
+    results = sorted(results, key=lambda x: x.get("distance", 9999))[:k]
+    if token_budget is not None:
+        return assemble_context(results, token_budget).docs
+    return results
 
 
-# ---------- Fallback Basic Generator ----------
-def fallback_generate_with_supabase(prompt: str):
+def _lexical_fast_path(prompt: str, wants: Dict[str, int], user_id: Optional[str]) -> Optional[Dict[str, List[dict]]]:
     """
-    Basic fallback RAG generator if Gemini is unavailable.
-    Retrieves text chunks from Supabase and simulates generation.
+    Keyword-only retrieval used by "auto" mode. Returns None (→ embed and use
+    hybrid) unless the full-text match is confident enough to skip the embedding.
     """
-    try:
-        response = supabase.table("text_chunks").select("content").limit(5).execute()
-        chunks = [item["content"] for item in response.data] if response.data else []
-        context = "\n\n".join(chunks)
+    results: Dict[str, List[dict]] = {}
+    if "textbooks" in wants:
+        k = wants["textbooks"]
+        lex = retrieve_lexical("textbooks", prompt, k=k)
+        if len(lex) < k or lex[0]["score"] < LEXICAL_CONFIDENCE:
+            return None
+        results["textbooks"] = lex
+    if "templates" in wants:
+        if user_id:
+            return None  # user templates are ranked by vector
+        tmpl = system_templates_index.search_lexical(prompt, k=wants["templates"])
+        if not tmpl:
+            return None
+        results["templates"] = tmpl
+    return results
 
-        full_prompt = f"Context:\n{context}\n\nUser Prompt:\n{prompt}"
-        generated_text = f"Generated content based on: {prompt}\n\n[Simulated AI Output]"
 
-        return generated_text
-    except Exception as e:
-        print(f"❌ Error in fallback generate: {str(e)}")
-        return f"Error generating content: {str(e)}"
+def retrieve_multi(
+    prompt: str,
+    wants: Dict[str, int],
+    user_id: Optional[str] = None,
+    query_embedding: Optional[List[float]] = None,
+    mode: str = RAG_RETRIEVAL_MODE,
+) -> Dict[str, List[dict]]:
+    """
+    Retrieve several collections at once: `wants` maps collection -> k, for
+    "textbooks" and "templates" (system + the user's own when `user_id` is given).
+    All Postgres-backed collections are fetched in one SQL round trip; system
+    templates come from the in-memory index.
+
+    mode: "vector" (cosine only), "hybrid" (textbooks ranked by vector + full-text
+    with reciprocal rank fusion) or "auto" (keyword-only when the full-text match
+    is confident — no embedding call — otherwise hybrid).
+    """
+    if mode == "auto":
+        fast = _lexical_fast_path(prompt, wants, user_id)
+        if fast is not None:
+            return fast
+
+    prompt_embedding = query_embedding if query_embedding is not None else embed_query(prompt)
+    hybrid = mode in ("hybrid", "auto")
+
+    specs = []
+    if "textbooks" in wants:
+        specs.append(("textbooks", wants["textbooks"], None, prompt if hybrid else None))
+    if "templates" in wants and user_id:
+        specs.append(("user_templates_vector", wants["templates"], user_id))
+    rows = retrieve_multi_by_embedding(prompt_embedding, specs)
+
+    results: Dict[str, List[dict]] = {}
+    if "textbooks" in wants:
+        results["textbooks"] = [r for r in rows if r["collection"] == "textbooks"]
+    if "templates" in wants:
+        k = wants["templates"]
+        tmpl = _search_system_templates(prompt_embedding, k)
+        tmpl += [r for r in rows if r["collection"] == "user_templates_vector"]
+        results["templates"] = sorted(tmpl, key=lambda x: x.get("distance", 9999))[:k]
+    return results
+
+
+# ---------- Fallback Basic Generator ----------
+def fallback_generate_with_supabase(prompt: str):
+    """
+    Basic fallback generator if Gemini is unavailable: returns a simulated
+    response. (It used to fetch text_chunks first but never used the rows.)
+    """
+    return f"Generated content based on: {prompt}\n\n[Simulated AI Output]"
 
 
 # ---------- Timeout Helper ----------
@@ -145,21 +379,31 @@ class TimeoutHandler:
         if self.timed_out:
             raise TimeoutException("⏱ Gemini generation took too long (timeout).")
 
-# ---------- Main Generator (RAG + Gemini) ----------
-def generate_with_rag(
-    prompt: str,
-    grade: str = None,
-    user_id: Optional[str] = None,
-    selected_template: Optional[str] = None,
-    additional_ctx: str = "",
-    temperature: float = 0.3,
-) -> str:
-    """RAG-powered generation with Gemini + Supabase retrieval (with timeout)."""
-    if not GENAI_AVAILABLE:
-        print("[INFO] Gemini not available, using fallback generator.")
-        return fallback_generate_with_supabase(prompt)
+# ---------- Cancellation ----------
+class GenerationCancelled(Exception):
+    """Raised inside the pipeline once the client that asked for the work has gone away."""
 
-    # --- Detect grade & subject ---
+
+def _check_cancelled(cancel_event: Optional[threading.Event]):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled("Generation cancelled (client disconnected).")
+
+
+# ---------- Prompt Building (detection + retrieval + context) ----------
+GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "max_output_tokens": 8192,
+    "top_p": 0.8,
+    "top_k": 40,
+}
+
+
+def _retrieval_wants(selected_template: Optional[str]) -> Dict[str, int]:
+    return {"textbooks": RAG_TEXTBOOK_CANDIDATES, "templates": 10 if selected_template else 1}
+
+
+def detect_grade_subject(prompt: str, grade: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """(grade, subject) for the prompt; an explicit grade wins over one mentioned in the prompt."""
     prompt_lower = prompt.lower()
     grade = grade or None
     if grade is None:
@@ -173,19 +417,56 @@ def generate_with_rag(
         if subj in prompt_lower:
             subject = subj
             break
+    return grade, subject
+
+
+def build_rag_prompt(
+    prompt: str,
+    grade: str = None,
+    user_id: Optional[str] = None,
+    selected_template: Optional[str] = None,
+    additional_ctx: str = "",
+    cancel_event: Optional[threading.Event] = None,
+    retrieved: Optional[Dict[str, List[dict]]] = None,
+) -> Tuple[str, dict]:
+    """
+    Detect grade/subject, retrieve context and assemble the full Gemini prompt (blocking I/O).
+    Returns (full_prompt, retrieval metadata incl. stage timings in ms).
+    Pass `retrieved` (a retrieve_multi result) to reuse retrieval shared with similar prompts.
+    """
+    # --- Detect grade & subject ---
+    prompt_lower = prompt.lower()
+    grade, subject = detect_grade_subject(prompt, grade)
 
     topic = prompt
 
-    # --- Query Supabase (textbooks) ---
-    tb_docs = retrieve_top_k(prompt, "textbooks", k=3)
+    # --- Embed the query once; every retrieval below reuses it ---
+    # ("auto" retrieval may answer from full-text alone, so it embeds only if needed)
+    t0 = time.perf_counter()
+    query_embedding = embed_query(prompt) if RAG_RETRIEVAL_MODE != "auto" and retrieved is None else None
+    t_embed = time.perf_counter()
+    _check_cancelled(cancel_event)
+
+    # --- Query Supabase (textbooks + templates, one round trip) ---
+    if retrieved is None:
+        retrieved = retrieve_multi(
+            prompt,
+            _retrieval_wants(selected_template),
+            user_id=user_id if selected_template else None,
+            query_embedding=query_embedding,
+        )
+    # dedup + MMR diversity + token budget (templates are kept whole)
+    assembled = assemble_context(retrieved["textbooks"], RAG_CONTEXT_TOKEN_BUDGET)
+    tb_docs = assembled.docs
 
     # --- Templates logic ---
     tmpl_docs = []
     if selected_template:
-        tmpl_results = retrieve_top_k(prompt, "templates", user_id=user_id, k=10)
-        tmpl_docs = [d for d in tmpl_results if str(d["id"]) == str(selected_template)]
+        tmpl_docs = [d for d in retrieved["templates"] if str(d["id"]) == str(selected_template)]
     else:
-        tmpl_docs = retrieve_top_k(prompt, "templates", user_id=None, k=1)
+        tmpl_docs = retrieved["templates"]
+    t_retrieve = time.perf_counter()
+    _check_cancelled(cancel_event)
 
     # --- Build context ---
     relevant_context_parts = []
@@ -241,44 +522,507 @@ After the header, continue with the provided template or generate structured tea
 """
 
     full_prompt = f"{system_prompt}\n\nContext:\n{context}\n\nUser request:\n{prompt}"
+    meta = {
+        "grade": grade,
+        "subject": subject,
+        "retrieval_mode": RAG_RETRIEVAL_MODE,
+        "context_tokens": assembled.report() if prompt_mentions_subject else None,
+        "textbooks": [_doc_ref(d) for d in tb_docs] if prompt_mentions_subject else [],
+        "templates": [_doc_ref(d) for d in tmpl_docs],
+        "timings_ms": {
+            "embed": round((t_embed - t0) * 1000, 1),
+            "retrieval": round((t_retrieve - t_embed) * 1000, 1),
+        },
+    }
+    return full_prompt, meta
+
+
+def _doc_ref(doc: dict) -> dict:
+    """Lightweight reference to a retrieved document (no body) for response metadata."""
+    distance = doc.get("distance")
+    meta = doc.get("metadata") or {}
+    ref = {
+        "id": doc["id"],
+        "distance": round(float(distance), 4) if distance is not None else None,
+        "source": meta.get("source") or meta.get("title"),
+    }
+    # textbook chunks carry their location (see src/chunking.py)
+    if meta.get("page_start") is not None:
+        ref.update(page_start=meta["page_start"], page_end=meta.get("page_end"), section=meta.get("section"))
+    return ref
+
+
+def _extract_text(response) -> Optional[str]:
+    """Pull the generated text out of a Gemini response (handles multi-part candidates)."""
+    try:
+        text_out = getattr(response, "text", None)
+    except ValueError:  # raised by the SDK when a candidate has no text parts
+        text_out = None
+    if not text_out and hasattr(response, "candidates"):
+        parts = []
+        for cand in response.candidates:
+            if cand.content and cand.content.parts:
+                for part in cand.content.parts:
+                    if hasattr(part, "text") and part.text:
+                        parts.append(part.text)
+        text_out = "\n".join(parts) if parts else None
+    return text_out
+
+
+# ---------- Generation Cache ----------
+from src.generation_cache import GEN_CACHE_ENABLED, GenerationCache, generation_scope
+
+generation_cache = GenerationCache()
+
+
+def _cache_lookup(prompt, grade, user_id, selected_template, additional_ctx, temperature, use_cache):
+    """
+    Returns (content or None, status, scope, query_embedding). status is
+    "exact" / "semantic" / "miss" / "bypass". Blocking when semantic mode embeds.
+    """
+    if not GEN_CACHE_ENABLED:
+        return None, "disabled", None, None
+    # the detected values, not just the request's grade: they shape the prompt Gemini sees,
+    # so semantic hits must not cross e.g. "grade 7 ..." and "grade 8 ..." prompts
+    grade, subject = detect_grade_subject(prompt, grade)
+    scope = generation_scope(grade, selected_template, additional_ctx, temperature, GEN_MODEL, user_id,
+                             subject=subject)
+    if not use_cache:
+        generation_cache.record_bypass()
+        return None, "bypass", scope, None
+    embedding = embed_query(prompt) if generation_cache.semantic else None
+    content, status = generation_cache.get(prompt, scope, embedding)
+    return content, status, scope, embedding
+
+
+def _cache_store(prompt, scope, content, embedding):
+    if scope is not None and content:
+        generation_cache.set(prompt, scope, content, embedding)
+
+
+# ---------- Main Generator (RAG + Gemini) ----------
+GEN_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "40"))
+
+
+def generate_with_rag(
+    prompt: str,
+    grade: str = None,
+    user_id: Optional[str] = None,
+    selected_template: Optional[str] = None,
+    additional_ctx: str = "",
+    temperature: float = 0.3,
+    use_cache: bool = True,
+) -> str:
+    """RAG-powered generation with Gemini + Supabase retrieval (with timeout)."""
+    if not genai_available():
+        print("[INFO] Gemini not available, using fallback generator.")
+        return fallback_generate_with_supabase(prompt)
+
+    cached, _, scope, cache_embedding = _cache_lookup(
+        prompt, grade, user_id, selected_template, additional_ctx, temperature, use_cache)
+    if cached is not None:
+        return cached
+
+    full_prompt, _ = build_rag_prompt(prompt, grade, user_id, selected_template, additional_ctx)
 
     # --- Timeout Wrapper for Gemini ---
-    timeout_handler = TimeoutHandler(40)  # ⏱ Limit Gemini to 40 seconds
-    timeout_handler.start()
+    timeout_handler = TimeoutHandler(GEN_TIMEOUT_SECONDS)  # ⏱ Limit Gemini to 40 seconds
 
     try:
-        response = gemini_model.generate_content(
-            full_prompt,
-            generation_config={
-                "temperature": temperature,
-                "max_output_tokens": 8192,
-                "top_p": 0.8,
-                "top_k": 40,
-            },
-        )
+        with generation_governor.slot():
+            timeout_handler.start()  # admission wait doesn't count towards the timeout
+            response = gemini_model.generate_content(
+                full_prompt,
+                generation_config={**GENERATION_CONFIG, "temperature": temperature},
+            )
 
         timeout_handler.stop()  # clear timeout
         timeout_handler.check_timeout()  # check if we timed out during generation
 
-        text_out = getattr(response, "text", None)
-        if not text_out and hasattr(response, "candidates"):
-            parts = []
-            for cand in response.candidates:
-                if cand.content and cand.content.parts:
-                    for part in cand.content.parts:
-                        if hasattr(part, "text") and part.text:
-                            parts.append(part.text)
-            text_out = "\n".join(parts) if parts else None
-
-        return clean_text_output(text_out) if text_out else "No content generated"
+        text_out = _extract_text(response)
+        if not text_out:
+            return "No content generated"
+        content = clean_text_output(text_out)
+        _cache_store(prompt, scope, content, cache_embedding)
+        return content
 
     except TimeoutException as e:
         print(f"⚠️ {str(e)} — falling back to Supabase generator.")
         return fallback_generate_with_supabase(prompt)
 
+    except GovernorRejected:
+        raise
+
     except Exception as e:
         print(f"[ERROR] Generation failed: {e}")
         return f"Error generating content: {str(e)}"
 
     finally:
         timeout_handler.stop()  # make sure timer is stopped
+
+
+# ---------- Async Generator (keeps the event loop free) ----------
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "8"))
+
+# Dedicated, bounded pool for the blocking parts of the pipeline (embedding + psycopg2
+# retrieval) so they never run on — or starve — the shared default executor.
+generation_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="rag")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the generation executor (in the caller's context, e.g. its priority)."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(generation_executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+
+async def _gemini_generate_async(full_prompt: str, temperature: float) -> Optional[str]:
+    """
+    One non-streaming Gemini call (bounded by GEN_TIMEOUT_SECONDS once admitted
+    by the generation governor); cleaned text or None.
+    """
+    async with generation_governor.slot_async():
+        response = await asyncio.wait_for(
+            gemini_model.generate_content_async(
+                full_prompt,
+                generation_config={**GENERATION_CONFIG, "temperature": temperature},
+            ),
+            timeout=GEN_TIMEOUT_SECONDS,
+        )
+    text_out = _extract_text(response)
+    return clean_text_output(text_out) if text_out else None
+
+
+async def generate_with_rag_async(
+    prompt: str,
+    grade: str = None,
+    user_id: Optional[str] = None,
+    selected_template: Optional[str] = None,
+    additional_ctx: str = "",
+    temperature: float = 0.3,
+    use_cache: bool = True,
+) -> str:
+    """
+    Async variant of generate_with_rag. Retrieval runs on the bounded generation
+    executor and Gemini is awaited natively, so cancelling the task (e.g. on client
+    disconnect) aborts the in-flight Gemini call and stops retrieval at the next stage.
+    """
+    if not await genai_available_async():
+        print("[INFO] Gemini not available, using fallback generator.")
+        return await run_blocking(fallback_generate_with_supabase, prompt)
+
+    cached, _, scope, cache_embedding = await run_blocking(
+        _cache_lookup, prompt, grade, user_id, selected_template, additional_ctx, temperature, use_cache)
+    if cached is not None:
+        return cached
+
+    cancel_event = threading.Event()
+    try:
+        full_prompt, _ = await run_blocking(
+            build_rag_prompt, prompt, grade, user_id, selected_template, additional_ctx,
+            cancel_event=cancel_event,
+        )
+
+        content = await _gemini_generate_async(full_prompt, temperature)
+        if content is None:
+            return "No content generated"
+        _cache_store(prompt, scope, content, cache_embedding)
+        return content
+
+    except asyncio.CancelledError:
+        cancel_event.set()  # tell the retrieval thread to stop at its next checkpoint
+        raise
+
+    except asyncio.TimeoutError:
+        print("⚠️ ⏱ Gemini generation took too long (timeout). — falling back to Supabase generator.")
+        return await run_blocking(fallback_generate_with_supabase, prompt)
+
+    except (GenerationCancelled, GovernorRejected):
+        raise
+
+    except Exception as e:
+        print(f"[ERROR] Generation failed: {e}")
+        return f"Error generating content: {str(e)}"
+
+
+# ---------- Streaming Generator (SSE) ----------
+async def stream_with_rag_async(
+    prompt: str,
+    grade: str = None,
+    user_id: Optional[str] = None,
+    selected_template: Optional[str] = None,
+    additional_ctx: str = "",
+    temperature: float = 0.3,
+    use_cache: bool = True,
+) -> AsyncIterator[dict]:
+    """
+    Stream a RAG generation as events: {"event": "chunk", "data": {"text"}} for each
+    cleaned piece of Gemini output, then one {"event": "done", "data": {retrieval, timings}}.
+    Errors are reported as an {"event": "error"} event. Closing the generator
+    (client disconnect) aborts Gemini and stops retrieval.
+    """
+    start = time.perf_counter()
+    if not await genai_available_async():
+        text = await run_blocking(fallback_generate_with_supabase, prompt)
+        yield {"event": "chunk", "data": {"text": text}}
+        yield {"event": "done", "data": {"retrieval": None, "timings_ms": {}}}
+        return
+
+    cached, cache_status, scope, cache_embedding = await run_blocking(
+        _cache_lookup, prompt, grade, user_id, selected_template, additional_ctx, temperature, use_cache)
+    if cached is not None:
+        elapsed = round((time.perf_counter() - start) * 1000, 1)
+        yield {"event": "chunk", "data": {"text": cached}}
+        yield {"event": "done", "data": {"retrieval": None, "cache": cache_status,
+                                         "timings_ms": {"time_to_first_token": elapsed, "total": elapsed}}}
+        return
+
+    cancel_event = threading.Event()
+    try:
+        full_prompt, meta = await run_blocking(
+            build_rag_prompt, prompt, grade, user_id, selected_template, additional_ctx,
+            cancel_event=cancel_event,
+        )
+        t_prompt = time.perf_counter()
+
+        # the slot is held for the whole stream (it is one in-flight Gemini call)
+        async with generation_governor.slot_async():
+            response = await asyncio.wait_for(
+                gemini_model.generate_content_async(
+                    full_prompt,
+                    generation_config={**GENERATION_CONFIG, "temperature": temperature},
+                    stream=True,
+                ),
+                timeout=GEN_TIMEOUT_SECONDS,
+            )
+
+            cleaner = StreamingMarkdownCleaner()
+            chunks = response.__aiter__()
+            first_token_at = None
+            emitted = 0
+            raw = []  # uncleaned output: the cache stores exactly what /generate would
+            while True:
+                try:
+                    # the timeout bounds the gap between chunks, not the whole response
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=GEN_TIMEOUT_SECONDS)
+                except StopAsyncIteration:
+                    break
+                piece = _extract_text(chunk) or ""
+                raw.append(piece)
+                text = cleaner.feed(piece)
+                if text:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    emitted += len(text)
+                    yield {"event": "chunk", "data": {"text": text}}
+
+        tail = cleaner.flush()
+        if tail:
+            emitted += len(tail)
+            yield {"event": "chunk", "data": {"text": tail}}
+        if not emitted:
+            yield {"event": "chunk", "data": {"text": "No content generated"}}
+        else:
+            _cache_store(prompt, scope, clean_text_output("".join(raw)), cache_embedding)
+
+        end = time.perf_counter()
+        timings = dict(meta.pop("timings_ms"))
+        timings.update({
+            "time_to_first_token": round(((first_token_at or end) - start) * 1000, 1),
+            "generation": round((end - t_prompt) * 1000, 1),
+            "total": round((end - start) * 1000, 1),
+        })
+        yield {"event": "done", "data": {"retrieval": meta, "cache": cache_status,
+                                         "timings_ms": timings, "chars": emitted}}
+
+    except asyncio.TimeoutError:
+        print("⚠️ ⏱ Gemini stream stalled (timeout).")
+        yield {"event": "error", "data": {"detail": "Gemini generation took too long (timeout)."}}
+
+    except GovernorRejected as e:
+        yield {"event": "error", "data": {"detail": str(e), "retry_after": e.retry_after}}
+
+    except (asyncio.CancelledError, GeneratorExit):
+        raise
+
+    except Exception as e:
+        print(f"[ERROR] Streaming generation failed: {e}")
+        yield {"event": "error", "data": {"detail": f"Error generating content: {str(e)}"}}
+
+    finally:
+        cancel_event.set()  # no-op once finished; stops retrieval if we were torn down early
+
+
+# ---------- Batch Generator (SSE) ----------
+GEN_BATCH_MAX_ITEMS = int(os.getenv("GEN_BATCH_MAX_ITEMS", "100"))
+GEN_BATCH_CONCURRENCY = int(os.getenv("GEN_BATCH_CONCURRENCY", "4"))          # Gemini calls in flight per batch
+GEN_BATCH_MAX_CONCURRENCY = int(os.getenv("GEN_BATCH_MAX_CONCURRENCY", "16"))  # cap on the per-request override
+# prompts in the same retrieval scope at or above this cosine similarity share one retrieval
+GEN_BATCH_SHARE_SIMILARITY = float(os.getenv("GEN_BATCH_SHARE_SIMILARITY", "0.92"))
+
+
+def prefetch_query_embeddings(prompts: List[str]) -> List[List[float]]:
+    """Embed all uncached prompts in one batched call and fill query_embedding_cache."""
+    keys = [normalize_prompt(p) for p in prompts]
+    found = {}
+    missing = {}
+    for key, prompt in zip(keys, prompts):
+        cached = query_embedding_cache.get(key)
+        if cached is not None:
+            found[key] = cached
+        elif key not in missing:
+            missing[key] = prompt
+    if missing:
+        for key, embedding in zip(missing, embed_texts(list(missing.values()))):
+            query_embedding_cache.set(key, embedding)
+            found[key] = embedding
+    return [found[k] for k in keys]
+
+
+def _retrieval_scope(item: dict) -> tuple:
+    # same inputs to retrieve_multi apart from the query itself
+    selected = item.get("selected_template")
+    return bool(selected), item.get("user_id") if selected else None
+
+
+def group_for_retrieval(items: List[dict], embeddings: List[Optional[List[float]]],
+                        threshold: float = GEN_BATCH_SHARE_SIMILARITY) -> List[int]:
+    """
+    Group id per item. Items share a group (and one retrieval) when their
+    retrieval scope matches and their prompts are identical after
+    normalization or their query embeddings reach `threshold` cosine
+    similarity to the group's first prompt.
+    """
+    leaders: List[tuple] = []  # (scope, normalized prompt, unit vector)
+    groups = []
+    for item, embedding in zip(items, embeddings):
+        scope, key, unit = _retrieval_scope(item), normalize_prompt(item["prompt"]), None
+        if embedding is not None:
+            vec = np.asarray(embedding, dtype=np.float32)
+            norm = float(np.linalg.norm(vec))
+            unit = vec / norm if norm else None
+        for gid, (l_scope, l_key, l_unit) in enumerate(leaders):
+            if l_scope == scope and (
+                l_key == key or (unit is not None and l_unit is not None and float(l_unit @ unit) >= threshold)
+            ):
+                groups.append(gid)
+                break
+        else:
+            groups.append(len(leaders))
+            leaders.append((scope, key, unit))
+    return groups
+
+
+def _cache_lookup_item(item: dict):
+    try:
+        return _cache_lookup(item["prompt"], item.get("grade"), item.get("user_id"), item.get("selected_template"),
+                             item.get("additional_ctx", ""), item.get("temperature", 0.3), item.get("use_cache", True))
+    except Exception as e:
+        print(f"⚠️ Generation cache lookup failed: {e}")
+        return None, "error", None, None
+
+
+async def generate_batch_async(items: List[dict], concurrency: int = GEN_BATCH_CONCURRENCY) -> AsyncIterator[dict]:
+    """
+    Generate many prompts (dicts with generate_with_rag's arguments), yielding
+    {"event": "item", "data": {"index", "content" | "error", ...}} as each one
+    finishes (completion order, not request order), then one {"event": "done"}.
+
+    Uncached prompts are embedded in one batched call; prompts that are close
+    enough (see group_for_retrieval) share one retrieval round trip. At most
+    `concurrency` Gemini calls are in flight. Closing the generator (client
+    disconnect) cancels everything still running.
+    """
+    start = time.perf_counter()
+    concurrency = max(1, min(concurrency, GEN_BATCH_MAX_CONCURRENCY))
+
+    if not await genai_available_async():
+        for index, item in enumerate(items):
+            text = await run_blocking(fallback_generate_with_supabase, item["prompt"])
+            yield {"event": "item", "data": {"index": index, "content": text}}
+        yield {"event": "done", "data": {"items": len(items), "errors": 0}}
+        return
+
+    # --- one embedding call for the whole batch (feeds cache lookup + retrieval) ---
+    embeddings: List[Optional[List[float]]] = [None] * len(items)
+    if RAG_RETRIEVAL_MODE != "auto" or generation_cache.semantic:
+        try:
+            embeddings = await run_blocking(prefetch_query_embeddings, [it["prompt"] for it in items])
+        except Exception as e:
+            print(f"⚠️ Batch embedding failed ({e}) — items will embed individually.")
+
+    lookups = await asyncio.gather(*(run_blocking(_cache_lookup_item, it) for it in items))
+    misses = [i for i, lookup in enumerate(lookups) if lookup[0] is None]
+    groups = dict(zip(misses, group_for_retrieval([items[i] for i in misses], [embeddings[i] for i in misses])))
+    group_sizes: Dict[int, int] = {}
+    for gid in groups.values():
+        group_sizes[gid] = group_sizes.get(gid, 0) + 1
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+    shared: Dict[int, asyncio.Future] = {}
+    cancel_event = threading.Event()
+
+    def shared_retrieval(index: int) -> asyncio.Future:
+        # the first item of a group starts its retrieval; the others await the same future
+        gid = groups[index]
+        if gid not in shared:
+            item = items[index]
+            shared[gid] = asyncio.ensure_future(run_blocking(
+                retrieve_multi, item["prompt"], _retrieval_wants(item.get("selected_template")),
+                user_id=item.get("user_id") if item.get("selected_template") else None,
+                query_embedding=embeddings[index],
+            ))
+        return shared[gid]
+
+    async def run_item(index: int):
+        item, t = items[index], time.perf_counter()
+        _, cache_status, scope, cache_embedding = lookups[index]
+        data = {"index": index, "cache": cache_status, "shared_retrieval": group_sizes[groups[index]]}
+        try:
+            # shielded: one item being cancelled must not cancel its group's retrieval
+            retrieved = await asyncio.shield(shared_retrieval(index))
+            full_prompt, _ = await run_blocking(
+                build_rag_prompt, item["prompt"], item.get("grade"), item.get("user_id"),
+                item.get("selected_template"), item.get("additional_ctx", ""),
+                cancel_event=cancel_event, retrieved=retrieved,
+            )
+            async with semaphore:
+                content = await _gemini_generate_async(full_prompt, item.get("temperature", 0.3))
+            if content is None:
+                content = "No content generated"
+            else:
+                _cache_store(item["prompt"], scope, content, cache_embedding)
+            data["content"] = content
+        except asyncio.TimeoutError:
+            data["error"] = "Gemini generation took too long (timeout)."
+        except GovernorRejected as e:
+            data.update(error=str(e), retry_after=e.retry_after)
+        except Exception as e:
+            print(f"[ERROR] Batch item {index} failed: {e}")
+            data["error"] = f"Error generating content: {str(e)}"
+        data["ms"] = round((time.perf_counter() - t) * 1000, 1)
+        results.put_nowait(data)
+
+    tasks = [asyncio.create_task(run_item(i)) for i in misses]
+    errors = 0
+    try:
+        for index, (content, cache_status, _, _) in enumerate(lookups):
+            if content is not None:
+                yield {"event": "item", "data": {"index": index, "content": content, "cache": cache_status, "ms": 0.0}}
+        for _ in tasks:
+            data = await results.get()
+            errors += "error" in data
+            yield {"event": "item", "data": data}
+        yield {"event": "done", "data": {
+            "items": len(items),
+            "cached": len(items) - len(misses),
+            "retrievals": len(shared),
+            "errors": errors,
+            "concurrency": concurrency,
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        }}
+    finally:
+        cancel_event.set()  # stops prompt building at its next checkpoint
+        for task in tasks:
+            task.cancel()
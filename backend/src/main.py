@@ -1,28 +1,79 @@
+import time
+_IMPORT_T0 = time.perf_counter()  # measures the cost of importing the app
+
 import os
+import json
+import asyncio
+import importlib
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
-from pydantic import BaseModel
-from supabase import create_client
-from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # ✅ Load environment variables FIRST
 backend_dir = Path(__file__).resolve().parent.parent
 load_dotenv(backend_dir / ".env")
 
 # ✅ Import after envs are loaded
-from src.llm import generate_with_rag  # adjust if needed
-from src.embed_user_template import embed_and_store_user_template
-from src.routes.drafts import router as drafts_router
+# Heavy SDKs (google.generativeai, markdownify, supabase) and all clients are
+# created lazily, so importing the app stays cheap; see WARMUP_STEPS.
+from src.llm import (
+    generate_with_rag_async, stream_with_rag_async, generate_batch_async, get_embedding_stats,
+    query_embedding_cache, system_templates_index, generation_cache, run_blocking, genai_available,
+    GEN_BATCH_CONCURRENCY, GEN_BATCH_MAX_CONCURRENCY, GEN_BATCH_MAX_ITEMS,
+)  # adjust if needed
+from src.supabase_vector import describe_vector_index, get_pool, get_pool_stats, migrate_user_templates_table
+from src.embed_user_template import embed_job_worker
+from src.embed_jobs import get_job_store
+from src.governor import GovernorRejected, generation_governor, governor_stats
+from src.routes.drafts import router as drafts_router, draft_buffer
+from src.supabase_client import get_supabase, close_supabase
+from src import startup
+from src.startup import FirstRequestTimer, startup_state
+
+startup.PROCESS_T0 = _IMPORT_T0
+
+# ✅ Startup / shutdown
+WARMUP_IN_BACKGROUND = os.getenv("WARMUP_IN_BACKGROUND", "1") == "1"
+
+# Everything the first /generate or /drafts request would otherwise initialize
+WARMUP_STEPS = {
+    "gemini": genai_available,
+    "markdownify": lambda: importlib.import_module("markdownify"),
+    "postgres": get_pool,
+    "user_templates_schema": migrate_user_templates_table,
+    "template_index": system_templates_index.load,
+    "supabase": get_supabase,
+    "embed_job_store": get_job_store,
+}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # In the background by default: the port opens immediately and /ready
+    # flips once warm-up is done.
+    if WARMUP_IN_BACKGROUND:
+        startup_state.start_background(WARMUP_STEPS, run_blocking)
+    else:
+        await startup_state.warm_up(WARMUP_STEPS, run_blocking)
+    draft_buffer.start()
+    embed_job_worker.start()
+    yield
+    await startup_state.wait()
+    # Write buffered draft saves before the process exits, then close the shared pool
+    # (queued embedding jobs are persisted and resume on the next start)
+    await draft_buffer.stop()
+    await embed_job_worker.stop()
+    await close_supabase()
+
 
 # ✅ Initialize FastAPI
-app = FastAPI(title="PrepSmart Backend", version="1.0")
+app = FastAPI(title="PrepSmart Backend", version="1.0", lifespan=lifespan)
 
-# ✅ Initialize Supabase client
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # use only in backend
-)
+app.add_middleware(FirstRequestTimer, state=startup_state)
 
 # ✅ Add CORS middleware for both local + deployed frontend
 app.add_middleware(
@@ -35,8 +86,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow GET, POST, OPTIONS, etc.
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Retry-After"],  # version history pagination/caching, load shedding
 )
 
+
+# ✅ Load shedding: the Gemini governor refused admission
+@app.exception_handler(GovernorRejected)
+async def governor_rejected_handler(request: Request, exc: GovernorRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # ✅ Include routers
 app.include_router(drafts_router)
 
@@ -44,20 +106,112 @@ app.include_router(drafts_router)
 class GenerateRequest(BaseModel):
     prompt: str
     additional_ctx: str | None = None  # ✅ Add optional field for context
+    grade: str | None = None
+    user_id: str | None = None
+    selected_template: str | None = None
+    temperature: float = 0.3
+    bypass_cache: bool = False  # ✅ force a fresh generation
+
+
+def _generation_kwargs(req: GenerateRequest) -> dict:
+    return {
+        "grade": req.grade,
+        "user_id": req.user_id,
+        "selected_template": req.selected_template,
+        "additional_ctx": req.additional_ctx or "",
+        "temperature": req.temperature,
+        "use_cache": not req.bypass_cache,
+    }
+
+
+# -------- Helper: cancel work when the client goes away --------
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+async def run_until_disconnect(request: Request, coro):
+    """
+    Await `coro` as a task, polling the connection; if the client disconnects
+    the task is cancelled so in-flight Gemini/retrieval work stops.
+    """
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                print("⚠️ Client disconnected — generation cancelled.")
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
 
 
 # -------- Endpoint: Generate AI content --------
 @app.post("/generate")
-async def generate_endpoint(req: GenerateRequest):
+async def generate_endpoint(req: GenerateRequest, request: Request):
     try:
         # ✅ Pass both prompt and optional context if available
-        content = generate_with_rag(req.prompt, req.additional_ctx)
+        content = await run_until_disconnect(
+            request,
+            generate_with_rag_async(req.prompt, **_generation_kwargs(req)),
+        )
         return {"content": content}
+    except (HTTPException, GovernorRejected):
+        raise
     except Exception as e:
         print(f"❌ Error in /generate: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
 
 
+# -------- Endpoint: Stream AI content (Server-Sent Events) --------
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/generate/stream")
+async def generate_stream_endpoint(req: GenerateRequest):
+    # shed before the 200 is sent; later rejections arrive as an "error" event
+    generation_governor.check_admission()
+
+    async def event_stream():
+        # Starlette cancels this generator when the client disconnects,
+        # which closes stream_with_rag_async and aborts the Gemini stream.
+        async for evt in stream_with_rag_async(req.prompt, **_generation_kwargs(req)):
+            yield _sse(evt["event"], evt["data"])
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# -------- Endpoint: Batch generation (Server-Sent Events) --------
+class BatchGenerateRequest(BaseModel):
+    items: list[GenerateRequest] = Field(..., min_length=1, max_length=GEN_BATCH_MAX_ITEMS)
+    concurrency: int = Field(GEN_BATCH_CONCURRENCY, ge=1, le=GEN_BATCH_MAX_CONCURRENCY)
+
+
+@app.post("/generate/batch")
+async def generate_batch_endpoint(req: BatchGenerateRequest):
+    generation_governor.check_admission()
+    items = [{"prompt": item.prompt, **_generation_kwargs(item)} for item in req.items]
+
+    async def event_stream():
+        # one "item" event per prompt as it finishes (carries its request index), then "done";
+        # disconnecting closes the generator and cancels the remaining items
+        async for evt in generate_batch_async(items, req.concurrency):
+            yield _sse(evt["event"], evt["data"])
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # -------- Endpoint: Save draft --------
 class DraftCreate(BaseModel):
     user_id: str
@@ -66,10 +220,10 @@ class DraftCreate(BaseModel):
 
 
 @app.post("/drafts")
-async def save_draft(draft: DraftCreate):
+async def save_draft(draft: DraftCreate, db=Depends(get_supabase)):
     try:
-        response = (
-            supabase.table("drafts")
+        response = await (
+            db.table("drafts")
             .insert(
                 {
                     "user_id": draft.user_id,
@@ -93,25 +247,75 @@ class UserTemplateEmbed(BaseModel):
     content: str
 
 
-@app.post("/embed-user-template")
+@app.post("/embed-user-template", status_code=202)
 async def embed_user_template_endpoint(template: UserTemplateEmbed):
     try:
-        # Convert to dict for the embedding function
+        # Convert to dict for the embedding job
         template_dict = {
             "id": template.id,
             "user_id": template.user_id,
             "title": template.title,
             "content": template.content,
         }
-        
-        embed_and_store_user_template(template_dict)
-        return {"success": True, "message": "Template embedded successfully"}
+
+        # Embedded in the background (batched with other pending templates)
+        job = await embed_job_worker.enqueue(template_dict)
+        return {"success": True, "job_id": job["id"], "status": job["status"]}
     except Exception as e:
-        print(f"❌ Error embedding template: {str(e)}")
+        print(f"❌ Error queueing template embedding: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
 
 
+@app.get("/embed-user-template/jobs/{job_id}")
+async def embed_job_status(job_id: str):
+    job = await embed_job_worker.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# -------- Endpoint: Runtime metrics (for tuning) --------
+VECTOR_TABLES = ("textbooks", "templates", "user_templates_vector")
+
+
+async def vector_index_stats() -> dict:
+    """ANN index per vector table as it is in Postgres now (None = exact scan)."""
+    out = {}
+    for table in VECTOR_TABLES:
+        try:
+            out[table] = await run_blocking(describe_vector_index, table)
+        except Exception as e:
+            out[table] = {"error": str(e)}
+    return out
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "embeddings": get_embedding_stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "pg_pool": get_pool_stats(),
+        "vector_indexes": await vector_index_stats(),
+        "template_index": system_templates_index.stats(),
+        "generation_cache": generation_cache.stats(),
+        "draft_write_buffer": draft_buffer.stats(),
+        "embed_jobs": await embed_job_worker.stats(),
+        "governor": governor_stats(),
+        "startup": startup_state.report(),
+    }
+
+
 # ✅ Health check route (so Render shows 200 OK instead of 404)
 @app.get("/")
 async def health_check():
     return {"status": "ok", "message": "Backend is live!"}
+
+
+# ✅ Readiness: 200 once every warm-up step succeeded, 503 (with details) until then
+@app.get("/ready")
+async def readiness():
+    report = startup_state.report()
+    return JSONResponse(content=report, status_code=200 if report["ready"] else 503)
+
+
+startup_state.mark_imported()
@@ -1,24 +1,19 @@
-from fastapi import APIRouter, HTTPException
-from supabase import create_client
-import os
+from fastapi import APIRouter, Depends, HTTPException
 
-router = APIRouter(prefix="/collaborators", tags=["collaborators"])
+from src.supabase_client import get_supabase
 
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-)
+router = APIRouter(prefix="/collaborators", tags=["collaborators"])
 
 @router.get("/{draft_id}")
-async def get_collaborators(draft_id: str):
+async def get_collaborators(draft_id: str, db=Depends(get_supabase)):
     """Get collaborators for a draft"""
-    res = supabase.table("draft_collaborators").select("*, profiles(*)").eq("draft_id", draft_id).execute()
+    res = await db.table("draft_collaborators").select("*, profiles(*)").eq("draft_id", draft_id).execute()
     return res.data
 
 @router.post("/{draft_id}/add")
-async def add_collaborator(draft_id: str, user_id: str, added_by: str):
+async def add_collaborator(draft_id: str, user_id: str, added_by: str, db=Depends(get_supabase)):
     """Add collaborator to a draft"""
-    res = supabase.table("draft_collaborators").insert({
+    res = await db.table("draft_collaborators").insert({
         "draft_id": draft_id,
         "user_id": user_id,
         "added_by": added_by
@@ -26,7 +21,7 @@ async def add_collaborator(draft_id: str, user_id: str, added_by: str):
     return {"success": True, "data": res.data}
 
 @router.delete("/{draft_id}/remove/{user_id}")
-async def remove_collaborator(draft_id: str, user_id: str):
+async def remove_collaborator(draft_id: str, user_id: str, db=Depends(get_supabase)):
     """Remove collaborator from a draft"""
-    supabase.table("draft_collaborators").delete().eq("draft_id", draft_id).eq("user_id", user_id).execute()
+    await db.table("draft_collaborators").delete().eq("draft_id", draft_id).eq("user_id", user_id).execute()
     return {"success": True}
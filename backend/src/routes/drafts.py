@@ -1,64 +1,295 @@
 # backend/src/routes/drafts.py
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from supabase import create_client
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import TYPE_CHECKING, Optional
 import os
+import asyncio
+import gzip
+import json
+import base64
+import hashlib
+import uuid
+from datetime import datetime
+
+from src.cache import TTLCache
+from src.draft_buffer import DRAFT_WRITE_BEHIND, DraftWriteBuffer
+from src.draft_delta import DRAFT_SNAPSHOT_EVERY, DeltaError, chain_length, plan_version, reconstruct
+from src.supabase_client import get_supabase
+
+if TYPE_CHECKING:
+    from supabase import AsyncClient
 
 router = APIRouter()
 
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+CHAIN_COLUMNS = "version_number, content, delta, base_version, content_hash"
+
+# Latest version per draft: {"version_number", "content", "content_hash", "chain"}.
+# Lets a save go out as a single RPC; save_draft_version() rejects a stale entry.
+draft_heads = TTLCache(
+    maxsize=int(os.getenv("DRAFT_HEAD_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("DRAFT_HEAD_CACHE_TTL", "600")),
+)
+SAVE_ATTEMPTS = 3
+
+HISTORY_COLUMNS = "id, version_number, created_at, content_size, author_id, author_name"
+HISTORY_PAGE_SIZE = int(os.getenv("DRAFT_HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = 100
+GZIP_MIN_BYTES = 1024
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+
+async def _chain_rows(db: "AsyncClient", draft_id: str, upto: int = None, limit: int = DRAFT_SNAPSHOT_EVERY):
+    """Newest-first version rows (chain columns only) at or below `upto`."""
+    query = db.table("draft_versions").select(CHAIN_COLUMNS).eq("draft_id", draft_id)
+    if upto is not None:
+        query = query.lte("version_number", upto)
+    query = query.order("version_number", desc=True)
+    if limit:
+        query = query.limit(limit)
+    return (await query.execute()).data or []
+
+
+async def _version_content(db: "AsyncClient", draft_id: str, version_number: int, rows=None) -> str:
+    """
+    Rebuild one version server-side. A snapshot is stored every
+    DRAFT_SNAPSHOT_EVERY versions, so the last N rows normally hold the chain;
+    older chains (e.g. after a config change) fall back to reading all rows.
+    """
+    if rows is None:
+        rows = await _chain_rows(db, draft_id, version_number)
+    try:
+        return reconstruct(rows, version_number)
+    except DeltaError:
+        return reconstruct(await _chain_rows(db, draft_id, version_number, limit=0), version_number)
+
+
+async def _load_head(db: "AsyncClient", draft_id: str):
+    rows = await _chain_rows(db, draft_id)
+    if not rows:
+        return None
+    latest = rows[0]
+    return {
+        "version_number": latest["version_number"],
+        "content": await _version_content(db, draft_id, latest["version_number"], rows),
+        "content_hash": latest.get("content_hash"),
+        "chain": chain_length(rows),
+    }
+
+
+async def _save(draft_id: str, content: str, author_id: Optional[str] = None,
+                author_name: Optional[str] = None) -> dict:
+    """
+    Store `content` as the next version with one save_draft_version() RPC, which
+    allocates the number, inserts and updates drafts.content in one transaction.
+    A conflict (another writer moved the head) reloads the head and retries;
+    the last attempt sends a full snapshot, which cannot conflict.
+    """
+    db = await get_supabase()
+    digest = content_hash(content)
+    for attempt in range(SAVE_ATTEMPTS):
+        head = draft_heads.get(draft_id)
+        if head is None:
+            head = await _load_head(db, draft_id)
+            # just read from the database, so safe to compare here (also covers
+            # rows saved before content_hash existed); cached heads are checked by the RPC
+            if head is not None and head["content"] == content:
+                draft_heads.set(draft_id, head)
+                return {"status": "unchanged", "version": head["version_number"]}
+
+        if attempt == SAVE_ATTEMPTS - 1:
+            plan = {"content": content, "delta": None, "base_version": None}
+        else:
+            # diffing is CPU work; keep it off the event loop
+            plan = await asyncio.to_thread(plan_version, content, head, head["chain"] if head else 0)
+        result = (await db.rpc("save_draft_version", {
+            "p_draft_id": draft_id,
+            "p_content": content,
+            "p_content_hash": digest,
+            "p_delta": plan["delta"],
+            "p_base_version": plan["base_version"],
+            "p_base_hash": head["content_hash"] if head else None,
+            "p_author_id": author_id,
+            "p_author_name": author_name,
+        }).execute()).data
+
+        if result["status"] == "conflict":
+            draft_heads.pop(draft_id)
+            continue
+        if result["status"] == "saved":
+            draft_heads.set(draft_id, {
+                "version_number": result["version"],
+                "content": content,
+                "content_hash": digest,
+                "chain": 0 if plan["delta"] is None else head["chain"] + 1,
+            })
+        return result
+    raise RuntimeError("save_draft_version kept conflicting")
+
+
+# ---------- HTTP helpers ----------
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    """(created_at, id) re-serialised from parsed values, so nothing raw reaches the or_ filter."""
+    try:
+        created_at, version_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at).isoformat(), str(uuid.UUID(version_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def _json_response(request: Request, data, etag: Optional[str] = None,
+                   cache_control: str = "no-cache", headers: Optional[dict] = None) -> Response:
+    """
+    JSON with an ETag (304 when If-None-Match matches) and gzip for larger
+    bodies. The default ETag is a hash of the body plus the extra headers.
+    """
+    body = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+    headers = dict(headers or {})
+    if etag is None:
+        digest = hashlib.sha1(body + json.dumps(headers, sort_keys=True).encode("utf-8")).hexdigest()
+        etag = f'W/"{digest}"'
+    headers.update({"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"})
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Coalesces bursts of saves into one version per draft; started/stopped by main.lifespan
+draft_buffer = DraftWriteBuffer(_save)
+
 
 @router.get("/drafts/{draft_id}/versions")
-async def get_draft_versions(draft_id: str):
-    """Get all versions of a draft for history sidebar"""
+async def get_draft_versions(
+    draft_id: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    db=Depends(get_supabase),
+):
+    """
+    Version history for the sidebar: newest first, metadata only (no content),
+    keyset-paginated over (created_at, id). The cursor for the next page is
+    returned in the X-Next-Cursor header; content comes from /content.
+    """
     try:
-        print(f"🔍 Fetching versions for draft: {draft_id}")
-        response = supabase.table("draft_versions").select("*").eq("draft_id", draft_id).order("created_at", desc=True).execute()
-        print(f"✅ Found {len(response.data)} versions")
-        return JSONResponse(content=response.data)
+        query = db.table("draft_versions").select(HISTORY_COLUMNS).eq("draft_id", draft_id)
+        if cursor:
+            created_at, version_id = _decode_cursor(cursor)
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{version_id})'
+            )
+        rows = (await query.order("created_at", desc=True).order("id", desc=True)
+                .limit(limit + 1).execute()).data or []
+        headers = {"X-Next-Cursor": _encode_cursor(rows[limit - 1])} if len(rows) > limit else {}
+        return _json_response(request, rows[:limit], headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error in get_draft_versions: {str(e)}")
         print(f"❌ Exception type: {type(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@router.get("/drafts/{draft_id}/versions/{version_id}/content")
+async def get_version_content(draft_id: str, version_id: str, request: Request,
+                              db=Depends(get_supabase)):
+    """
+    One version's content, rebuilt server-side. Versions never change once
+    written, so the ETag is the version id and clients may cache indefinitely.
+    """
+    etag = f'"{version_id}"'
+    cache_control = "private, max-age=31536000, immutable"
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    try:
+        rows = (await db.table("draft_versions").select("version_number")
+                .eq("id", version_id).eq("draft_id", draft_id).limit(1).execute()).data
+        if not rows:
+            raise HTTPException(status_code=404, detail="Version not found")
+        version_number = rows[0]["version_number"]
+        content = await _version_content(db, draft_id, version_number)
+        return _json_response(
+            request,
+            {"id": version_id, "version_number": version_number, "content": content},
+            etag=etag,
+            cache_control=cache_control,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in get_version_content: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
 @router.post("/drafts/{draft_id}/save_version")
 async def save_version(draft_id: str, body: dict):
     content = body.get("content", "")
-    
-    try:
-        # Fetch latest version number
-        versions = supabase.table("draft_versions").select("version_number").eq("draft_id", draft_id).order("version_number", desc=True).limit(1).execute()
-        next_version = (versions.data[0]["version_number"] + 1) if versions.data else 1
 
-        # Insert new version
-        result = supabase.table("draft_versions").insert({
-            "draft_id": draft_id,
-            "content": content,
-            "version_number": next_version,
-        }).execute()
+    author = (body.get("user_id"), body.get("user_name"))
 
-        # Update main draft
-        supabase.table("drafts").update({"content": content}).eq("id", draft_id).execute()
+    try:
+        # Autosaves are buffered and written as one version once the draft goes quiet;
+        # a checkpoint (explicit save) is written now, superseding anything buffered.
+        if DRAFT_WRITE_BEHIND and not body.get("checkpoint"):
+            coalesced = draft_buffer.submit(draft_id, content, *author)
+            # an earlier buffered save of this draft could not be written (see /unsaved)
+            unsaved = draft_buffer.dead_letter(draft_id) is not None
+            return {"success": True, "buffered": True, "version": None, "coalesced": coalesced,
+                    "unsaved": unsaved}
 
-        return {"success": True, "version": next_version}
+        # Diff against the cached head, then one atomic RPC (skipped if content is unchanged)
+        result = await draft_buffer.checkpoint(draft_id, content, *author)
+        return {"success": True, "version": result["version"], "unchanged": result["status"] == "unchanged"}
     except Exception as e:
         print(f"❌ Error saving version: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@router.get("/drafts/{draft_id}/unsaved")
+async def get_unsaved(draft_id: str):
+    """
+    A buffered save that failed all its retries (content, authors, error), kept
+    until the draft is saved again so the user can recover it.
+    """
+    entry = draft_buffer.dead_letter(draft_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No unsaved content")
+    return entry
+
 @router.post("/drafts/{draft_id}/versions/{version_id}/restore")
-async def restore_version(draft_id: str, version_id: str):
+async def restore_version(draft_id: str, version_id: str, db=Depends(get_supabase)):
     try:
         # Get the version to restore
-        version_to_restore = supabase.table("draft_versions").select("content", "created_at").eq("id", version_id).single().execute()
+        version_to_restore = await db.table("draft_versions").select("version_number", "created_at").eq("id", version_id).single().execute()
 
         if not version_to_restore.data:
             raise HTTPException(status_code=404, detail="Version not found")
 
+        content = await _version_content(db, draft_id, version_to_restore.data["version_number"])
+        # buffered autosaves predate the restore and must not overwrite it
+        draft_buffer.discard(draft_id)
+
         # Update the main draft's content
-        supabase.table("drafts").update({"content": version_to_restore.data["content"]}).eq("id", draft_id).execute()
+        await db.table("drafts").update({"content": content}).eq("id", draft_id).execute()
 
         # Delete all versions newer than the one being restored
-        supabase.table("draft_versions").delete().eq("draft_id", draft_id).gt("created_at", version_to_restore.data["created_at"]).execute()
+        # (deltas only reference older versions, so the remaining chains stay intact)
+        await db.table("draft_versions").delete().eq("draft_id", draft_id).gt("created_at", version_to_restore.data["created_at"]).execute()
+        draft_heads.pop(draft_id)
 
         return {"success": True}
     except Exception as e:
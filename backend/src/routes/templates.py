@@ -1,21 +1,19 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from src.embed_user_template import embed_and_store_user_template
-from supabase import create_client
-import os
+from src.embed_user_template import embed_job_worker
+from src.supabase_client import get_supabase
 
 router = APIRouter()
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_ANON_KEY"))
 
 class TemplateCreate(BaseModel):
     user_id: str
     title: str
     content: str
 
-@router.post("/create-template")
-def create_user_template(data: TemplateCreate):
+@router.post("/create-template", status_code=202)
+async def create_user_template(data: TemplateCreate, db=Depends(get_supabase)):
     # Insert template into main user_templates table
-    res = supabase.table("user_templates").insert({
+    res = await db.table("user_templates").insert({
         "user_id": data.user_id,
         "title": data.title,
         "content": data.content
@@ -25,6 +23,7 @@ def create_user_template(data: TemplateCreate):
         raise HTTPException(status_code=400, detail="Failed to insert template")
 
     new_template = res.data[0]
-    embed_and_store_user_template(new_template)
+    # Embedded in the background; poll /embed-user-template/jobs/{job_id} for progress
+    job = await embed_job_worker.enqueue(new_template)
 
-    return {"message": "Template created and embedded successfully"}
+    return {"message": "Template created; embedding queued", "job_id": job["id"]}
@@ -0,0 +1,106 @@
+# backend/src/startup.py
+import time
+import asyncio
+import inspect
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+# perf_counter() when src.main started importing; set by main.py
+PROCESS_T0: Optional[float] = None
+
+
+class StartupState:
+    """
+    Startup timings and warm-up status behind /ready and /metrics.
+
+    Each warm-up step initializes one lazily created dependency (Gemini SDK,
+    Postgres pool, template matrix, Supabase client) so the first real request
+    doesn't pay for it. The app is live as soon as it's imported; it's ready
+    once every step has succeeded.
+    """
+
+    def __init__(self):
+        self.import_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+        self.first_request_ms: Optional[float] = None
+        self.components: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _since_start() -> Optional[float]:
+        return round((time.perf_counter() - PROCESS_T0) * 1000, 1) if PROCESS_T0 is not None else None
+
+    def mark_imported(self):
+        self.import_ms = self._since_start()
+        print(f"⏱️ Backend imported in {self.import_ms} ms")
+
+    def mark_first_request(self):
+        if self.first_request_ms is None:
+            self.first_request_ms = self._since_start()
+            print(f"⏱️ First request served {self.first_request_ms} ms after import start")
+
+    async def _step(self, name: str, fn: Callable[[], Union[Awaitable, object]], run_blocking):
+        t = time.perf_counter()
+        self.components[name] = {"status": "pending"}
+        try:
+            result = fn() if inspect.iscoroutinefunction(fn) else run_blocking(fn)
+            value = await result
+            if value is False:
+                raise RuntimeError("unavailable")
+            status = {"status": "ok"}
+        except Exception as e:
+            status = {"status": "failed", "error": str(e)}
+            print(f"⚠️ Warm-up step '{name}' failed (will initialize on first use): {e}")
+        status["ms"] = round((time.perf_counter() - t) * 1000, 1)
+        self.components[name] = status
+
+    async def warm_up(self, steps: Dict[str, Callable], run_blocking):
+        """Run all steps concurrently (blocking ones via `run_blocking`)."""
+        t = time.perf_counter()
+        for name in steps:
+            self.components[name] = {"status": "pending"}
+        await asyncio.gather(*(self._step(name, fn, run_blocking) for name, fn in steps.items()))
+        self.warmup_ms = round((time.perf_counter() - t) * 1000, 1)
+        print(f"✅ Warm-up finished in {self.warmup_ms} ms ({'ready' if self.ready else 'degraded'})")
+
+    def start_background(self, steps: Dict[str, Callable], run_blocking):
+        self.components = {name: {"status": "pending"} for name in steps}
+        self._task = asyncio.create_task(self.warm_up(steps, run_blocking))
+
+    async def wait(self):
+        if self._task is not None:
+            await self._task
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.components) and all(c["status"] == "ok" for c in self.components.values())
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "import_ms": self.import_ms,
+            "warmup_ms": self.warmup_ms,
+            "first_request_ms": self.first_request_ms,
+            "components": self.components,
+        }
+
+
+class FirstRequestTimer:
+    """ASGI middleware recording when the first HTTP response starts (then a no-op)."""
+
+    def __init__(self, app, state: StartupState):
+        self.app = app
+        self.state = state
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.state.first_request_ms is not None:
+            return await self.app(scope, receive, send)
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                self.state.mark_first_request()
+            await send(message)
+
+        return await self.app(scope, receive, send_and_record)
+
+
+startup_state = StartupState()
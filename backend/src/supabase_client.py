@@ -0,0 +1,65 @@
+# backend/src/supabase_client.py
+import os
+import asyncio
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:  # supabase/httpx are imported on first use to keep startup fast
+    import httpx
+    from supabase import AsyncClient
+
+# ---------- ENV CONFIG ----------
+SUPABASE_POOL_MAX = int(os.getenv("SUPABASE_POOL_MAX", "20"))              # concurrent HTTP connections
+SUPABASE_POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", "10"))  # idle connections kept open
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))              # seconds per request
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+
+_client: Optional["AsyncClient"] = None
+_http: Optional["httpx.AsyncClient"] = None
+_lock = asyncio.Lock()
+
+
+async def get_supabase() -> "AsyncClient":
+    """
+    The process-wide async Supabase client, created on first use.
+    Use as a FastAPI dependency (`db=Depends(get_supabase)`) or
+    await it directly from background tasks.
+
+    All PostgREST calls share one keep-alive httpx pool, so requests reuse
+    TLS connections instead of handshaking per client.
+    """
+    global _client, _http
+    if _client is not None:
+        return _client
+    async with _lock:
+        if _client is None:
+            import httpx
+            from supabase import AsyncClientOptions, acreate_client
+
+            _http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_POOL_MAX,
+                    max_keepalive_connections=SUPABASE_POOL_KEEPALIVE,
+                    keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+            )
+            _client = await acreate_client(
+                os.getenv("SUPABASE_URL"),
+                os.getenv("SUPABASE_SERVICE_ROLE_KEY"),  # backend only
+                options=AsyncClientOptions(
+                    postgrest_client_timeout=SUPABASE_TIMEOUT,
+                    httpx_client=_http,
+                    auto_refresh_token=False,
+                    persist_session=False,
+                ),
+            )
+    return _client
+
+
+async def close_supabase():
+    """Close the shared connection pool (called from main.lifespan on shutdown)."""
+    global _client, _http
+    http, _client, _http = _http, None, None
+    if http is not None:
+        await http.aclose()
@@ -1,37 +1,277 @@
 # services/backend/src/supabase_vector.py
 import os
-import json
-from typing import List, Dict, Any, Optional
+import re
+import math
+import hashlib
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 import psycopg2
-from psycopg2.extras import Json
+import psycopg2.errors
+from psycopg2.extras import Json, execute_values
 from pgvector.psycopg2 import register_vector
+from src.lexical import keyword_tsquery
 
 # === Environment ===
-DATABASE_URL = os.environ.get("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL not set in environment")
+DATABASE_URL = os.environ.get("DATABASE_URL")  # checked when the pool is first created
 
-_conn: Optional[psycopg2.extensions.connection] = None
+PG_POOL_MIN = int(os.environ.get("PG_POOL_MIN", "1"))                        # opened eagerly; up to max stay open when idle
+PG_POOL_MAX = int(os.environ.get("PG_POOL_MAX", "10"))
+PG_POOL_TIMEOUT = float(os.environ.get("PG_POOL_TIMEOUT", "10"))             # seconds to wait for a free connection
+PG_HEALTHCHECK_IDLE = float(os.environ.get("PG_HEALTHCHECK_IDLE", "30"))      # ping connections idle longer than this
+# Server-side prepared statements don't survive a transaction-mode pooler (pgbouncer / Supabase :6543),
+# so they're opt-in: enable only with a direct or session-mode connection.
+PG_PREPARE_STATEMENTS = os.environ.get("PG_PREPARE_STATEMENTS", "0") == "1"
 
+UPSERT_BATCH_SIZE = int(os.environ.get("UPSERT_BATCH_SIZE", "500"))
 
-def get_conn():
+TEXT_SEARCH_CONFIG = os.environ.get("TEXT_SEARCH_CONFIG", "english")
+RRF_K = int(os.environ.get("RRF_K", "60"))                         # reciprocal rank fusion constant
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))  # per-list candidates fused in hybrid mode
+
+_IDENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _ident(name: str) -> str:
+    """Validate a table/index name before it is interpolated into SQL."""
+    if not _IDENT_RE.match(name):
+        raise ValueError(f"Invalid SQL identifier: {name!r}")
+    return name
+
+
+class PoolTimeout(RuntimeError):
+    """No pooled connection became free within PG_POOL_TIMEOUT."""
+
+
+class _VectorConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers its one-time setup (pgvector types, prepared statements)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vector_registered = False
+        self.prepared: Set[str] = set()
+        self.last_used = time.monotonic()
+
+
+class VectorConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool that
+    - keeps every returned connection open (up to `maxconn`) for reuse, so
+      the TLS handshake, register_vector and PREPAREs are paid once per
+      connection (psycopg2's ThreadedConnectionPool closes anything above minconn),
+    - blocks (up to `timeout`) instead of raising when all connections are busy,
+    - health-checks connections on checkout and transparently replaces dead ones,
+    - runs register_vector exactly once per physical connection,
+    - records wait-time and utilization metrics.
+    """
+
+    def __init__(self, dsn: str, minconn: int = PG_POOL_MIN, maxconn: int = PG_POOL_MAX,
+                 timeout: float = PG_POOL_TIMEOUT, healthcheck_idle: float = PG_HEALTHCHECK_IDLE):
+        self._dsn = dsn
+        self._idle: List[_VectorConnection] = []  # LIFO: the most recently used connection is reused first
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waits = deque(maxlen=500)
+        self._counters = {"checkouts": 0, "timeouts": 0, "reconnects": 0, "connects": 0,
+                          "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "peak_in_use": 0}
+        for _ in range(min(minconn, maxconn)):
+            self._idle.append(self._connect())
+
+    def getconn(self) -> _VectorConnection:
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+        try:
+            conn = self._checkout_healthy()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._in_use += 1
+            self._waits.append(waited)
+            c = self._counters
+            c["checkouts"] += 1
+            c["wait_seconds_total"] += waited
+            c["wait_seconds_max"] = max(c["wait_seconds_max"], waited)
+            c["peak_in_use"] = max(c["peak_in_use"], self._in_use)
+        return conn
+
+    def putconn(self, conn: _VectorConnection, broken: bool = False):
+        try:
+            close = broken or conn.closed != 0
+            if not close and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+            conn.last_used = time.monotonic()
+            if close:
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commit on success, roll back on error, always return it."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True  # dropped connection: discard it, the next checkout reconnects
+            raise
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            c = dict(self._counters)
+            in_use = self._in_use
+        c["wait_seconds_total"] = round(c["wait_seconds_total"], 4)
+        c["wait_seconds_max"] = round(c["wait_seconds_max"], 4)
+        return {
+            "min": self.minconn,
+            "max": self.maxconn,
+            "in_use": in_use,
+            "idle": len(self._idle),
+            "utilization": round(in_use / self.maxconn, 3),
+            "wait_p50_ms": round(_percentile(waits, 0.50) * 1000, 2),
+            "wait_p95_ms": round(_percentile(waits, 0.95) * 1000, 2),
+            **c,
+        }
+
+    # --- internals ---
+    def _connect(self) -> _VectorConnection:
+        conn = psycopg2.connect(self._dsn, connection_factory=_VectorConnection)
+        with self._lock:
+            self._counters["connects"] += 1
+        return conn
+
+    @staticmethod
+    def _close(conn: _VectorConnection):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _checkout_healthy(self) -> _VectorConnection:
+        # holding a slot guarantees in-use + idle stays <= maxconn, so connecting here is safe
+        for _ in range(self.maxconn + 1):
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            if self._is_healthy(conn):
+                if not conn.vector_registered:
+                    register_vector(conn)  # ✅ this makes lists <-> vector automatic
+                    conn.vector_registered = True
+                    conn.commit()
+                return conn
+            with self._lock:
+                self._counters["reconnects"] += 1
+            self._close(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+    def _is_healthy(self, conn: _VectorConnection) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+_pool: Optional[VectorConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> VectorConnectionPool:
+    """Create the process-wide connection pool on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if not DATABASE_URL:
+                    raise RuntimeError("DATABASE_URL not set in environment")
+                _pool = VectorConnectionPool(DATABASE_URL)
+    return _pool
+
+
+def connection():
     """
-    Create and cache a single psycopg2 connection.
-    Registers pgvector type so Python lists map to vector automatically.
+    Context manager yielding a pooled psycopg2 connection with pgvector registered.
+    Commits on success and rolls back on error.
     """
-    global _conn
-    if _conn is None:
-        _conn = psycopg2.connect(DATABASE_URL)
-        register_vector(_conn)  # ✅ this makes lists <-> vector automatic
-    return _conn
+    return get_pool().connection()
+
+
+def get_pool_stats() -> dict:
+    """Wait-time and utilization metrics for the pgvector pool."""
+    return get_pool().stats() if _pool is not None else {"max": PG_POOL_MAX, "in_use": 0, "checkouts": 0}
+
+
+# ---------- Write Listeners ----------
+_write_listeners: Dict[str, List[Callable[[str], None]]] = {}
+
+
+def add_write_listener(table: str, callback: Callable[[str], None]):
+    """Call `callback(table)` after rows in `table` are upserted or deleted by this process."""
+    _write_listeners.setdefault(table, []).append(callback)
+
+
+def _notify_write(table: str):
+    for callback in _write_listeners.get(table, []):
+        try:
+            callback(table)
+        except Exception as e:
+            print(f"⚠️ Write listener for '{table}' failed: {e}")
 
 
 def create_tables_if_not_exists(dim: int):
     """
     Create textbooks and templates tables if they don't exist.
     """
-    conn = get_conn()
-    with conn.cursor() as cur:
+    with connection() as conn, conn.cursor() as cur:
         cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
         cur.execute(f"""
         CREATE TABLE IF NOT EXISTS textbooks (
@@ -49,81 +289,619 @@ def create_tables_if_not_exists(dim: int):
             embedding VECTOR({dim})
         );
         """)
-    conn.commit()
+    create_user_templates_table(dim)
+    for table in ("textbooks", "templates", "user_templates_vector"):
+        create_fulltext_index(table)
 
 
-def upsert_text_chunks(table: str, records: List[Dict[str, Any]]):
+def create_user_templates_table(dim: int):
     """
-    Upsert multiple text+embedding rows into the given table.
+    Create (or migrate) user_templates_vector with a real user_id column.
+
+    user_id is a STORED generated column over metadata->>'user_id', so existing
+    writers that only fill metadata keep working. Per-user search uses the btree
+    index to narrow to that teacher's handful of rows and then ranks them exactly;
+    we deliberately don't put an ANN index on this table, because ANN + WHERE
+    post-filters the global top-k and loses recall as the table grows.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS user_templates_vector (
+            id TEXT PRIMARY KEY,
+            document TEXT,
+            metadata JSONB,
+            embedding VECTOR({dim}),
+            user_id TEXT GENERATED ALWAYS AS (metadata->>'user_id') STORED
+        );
+        """)
+    migrate_user_templates_table()
+
+
+def migrate_user_templates_table():
+    """
+    Add the user_id column and its index to a user_templates_vector created
+    before they existed (same as backend/migrate_user_templates_user_id.sql).
+    Idempotent and run by the API's startup warm-up, since per-user search
+    filters on the column. A missing table is left to the ingestion scripts.
+    """
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('user_templates_vector') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            print("⚠️ user_templates_vector doesn't exist yet (created by the ingestion scripts).")
+            return
+        # check first: ALTER TABLE takes an exclusive lock even when it's a no-op
+        cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'user_templates_vector' AND column_name = 'user_id';
+        """)
+        if cur.fetchone() is None:
+            cur.execute("""
+            ALTER TABLE user_templates_vector
+            ADD COLUMN IF NOT EXISTS user_id TEXT GENERATED ALWAYS AS (metadata->>'user_id') STORED;
+            """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS user_templates_vector_user_id_idx
+        ON user_templates_vector (user_id);
+        """)
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_text_chunks(
+    table: str,
+    records: Iterable[Dict[str, Any]],
+    batch_size: int = UPSERT_BATCH_SIZE,
+    on_batch_committed: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Upsert text+embedding rows into the given table in multi-row batches.
     Each record must include: id, document, metadata, embedding.
+
+    `records` may be any iterable (e.g. a generator). Each batch is one
+    INSERT ... VALUES (...), (...) ON CONFLICT statement and is committed on its
+    own, so a failure partway through keeps the batches already written;
+    `on_batch_committed(batch)` is called after each commit (for checkpointing).
+    Returns {"rows", "batches", "seconds", "rows_per_second"}.
     """
-    if not records:
+    table = _ident(table)
+    sql = f"""
+        INSERT INTO {table} (id, document, metadata, embedding)
+        VALUES %s
+        ON CONFLICT (id) DO UPDATE
+        SET document = EXCLUDED.document,
+            metadata = EXCLUDED.metadata,
+            embedding = EXCLUDED.embedding
+    """
+
+    rows_written = 0
+    batches = 0
+    start = time.perf_counter()
+    with connection() as conn:
+        for batch in _batched(records, max(1, batch_size)):
+            # ON CONFLICT can't touch the same id twice in one statement: last one wins
+            rows = {
+                r["id"]: (r["id"], r["document"], Json(r.get("metadata", {})), r["embedding"])
+                for r in batch
+            }
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, sql, list(rows.values()),
+                                   template="(%s, %s, %s, %s::vector)", page_size=len(rows))
+                conn.commit()
+            except Exception:
+                print(f"❌ Upsert into '{table}' failed after {rows_written} committed rows.")
+                raise
+            rows_written += len(rows)
+            batches += 1
+            if on_batch_committed is not None:
+                on_batch_committed(batch)
+
+    seconds = time.perf_counter() - start
+    result = {
+        "rows": rows_written,
+        "batches": batches,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows_written / seconds, 1) if seconds else 0.0,
+    }
+    if rows_written:
+        _notify_write(table)
+    if not rows_written:
         print("⚠️ No records to upsert.")
+    else:
+        print(f"✅ Upserted {rows_written} records into '{table}' "
+              f"({batches} batches, {result['rows_per_second']} rows/s).")
+    return result
+
+
+def delete_chunks(table: str, ids: List[str]) -> int:
+    """Delete rows by id (used to drop chunks that no longer exist in the source)."""
+    if not ids:
+        return 0
+    table = _ident(table)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {table} WHERE id = ANY(%s)", (list(ids),))
+        deleted = cur.rowcount
+    _notify_write(table)
+    print(f"🗑️ Deleted {deleted} stale records from '{table}'.")
+    return deleted
+
+
+def fetch_all_rows(table: str) -> List[Dict[str, Any]]:
+    """Every row of a (small) vector table, embeddings included."""
+    table = _ident(table)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT id, document, metadata, embedding FROM {table};")
+        rows = cur.fetchall()
+    return [{"id": r[0], "document": r[1], "metadata": r[2], "embedding": r[3]} for r in rows]
+
+
+def _prepare(conn: _VectorConnection, cur, name: str, statement: str):
+    """PREPARE once per connection; a statement the server session already has counts as prepared."""
+    if name in conn.prepared:
         return
+    try:
+        cur.execute(statement)
+    except psycopg2.errors.DuplicatePreparedStatement:
+        conn.rollback()  # e.g. a pooler handed us a session that prepared it earlier
+    conn.prepared.add(name)
 
-    conn = get_conn()
-    with conn.cursor() as cur:
-        for r in records:
-            cur.execute(
-                f"""
-                INSERT INTO {table} (id, document, metadata, embedding)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE
-                SET document = EXCLUDED.document,
-                    metadata = EXCLUDED.metadata,
-                    embedding = EXCLUDED.embedding
-                """,
-                (
-                    r["id"],
-                    r["document"],
-                    Json(r.get("metadata", {})),
-                    r["embedding"],  # ✅ plain list works
-                ),
-            )
-    conn.commit()
-    print(f"✅ Upserted {len(records)} records into '{table}'.")
+
+def _execute_top_k(conn: _VectorConnection, cur, table: str, embedding: List[float], k: int,
+                   user_id: Optional[str] = None, reprepared: bool = False):
+    """Run the hot top-k query, as a per-connection prepared statement when enabled."""
+    where = "WHERE user_id = {user}" if user_id is not None else ""
+    # ef_search / probes for the target recall, sent in the same round trip as the query
+    settings = _search_settings_sql(cur, table, k)
+    if not PG_PREPARE_STATEMENTS:
+        params = (embedding, user_id, k) if user_id is not None else (embedding, k)
+        cur.execute(
+            settings + f"""
+            SELECT id, document, metadata, embedding <=> %s::vector AS distance
+            FROM {table}
+            {where.format(user="%s")}
+            ORDER BY distance ASC
+            LIMIT %s;
+            """,
+            params,   # ✅ plain list, but cast to ::vector in SQL
+        )
+        return
+
+    name = f"topk_{table}" + ("_by_user" if user_id is not None else "")
+    _prepare(conn, cur, name, f"""
+        PREPARE {name} (vector, int{", text" if user_id is not None else ""}) AS
+        SELECT id, document, metadata, embedding <=> $1 AS distance
+        FROM {table}
+        {where.format(user="$3")}
+        ORDER BY distance ASC
+        LIMIT $2;
+        """)
+    try:
+        if user_id is not None:
+            cur.execute(settings + f"EXECUTE {name} (%s::vector, %s, %s);", (embedding, k, str(user_id)))
+        else:
+            cur.execute(settings + f"EXECUTE {name} (%s::vector, %s);", (embedding, k))
+    except psycopg2.errors.InvalidSqlStatementName:
+        # statement vanished server-side (e.g. session reset by a pooler): re-prepare once
+        if reprepared:
+            raise
+        conn.rollback()
+        conn.prepared.discard(name)
+        _execute_top_k(conn, cur, table, embedding, k, user_id, reprepared=True)
 
 
-def retrieve_top_k_by_embedding(table: str, embedding: List[float], k: int = 3):
+def retrieve_top_k_by_embedding(table: str, embedding: List[float], k: int = 3, user_id: Optional[str] = None):
     """
     Retrieve top-k most similar rows from the given table based on cosine distance.
     Returns: [{"id", "document", "metadata", "distance"}]
+    `user_id` filters in SQL (tables with a user_id column, i.e. user_templates_vector).
+    A connection that drops mid-query is replaced and the query retried once.
+    """
+    table = _ident(table)
+    if user_id is not None:
+        user_id = str(user_id)
+    for attempt in range(2):
+        try:
+            with connection() as conn, conn.cursor() as cur:
+                _execute_top_k(conn, cur, table, embedding, k, user_id)
+                rows = cur.fetchall()
+            break
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if attempt:
+                raise
+
+    return [
+        {"id": r[0], "document": r[1], "metadata": r[2], "distance": r[3]}
+        for r in rows
+    ]
+
+
+
+def _normalize_specs(specs) -> List[Tuple[str, int, Optional[str], Optional[str]]]:
+    out = []
+    for spec in specs:
+        table, k, user_id = spec[:3]
+        query_text = spec[3] if len(spec) > 3 else None
+        tsq = keyword_tsquery(query_text) if query_text else None
+        out.append((_ident(table), int(k), str(user_id) if user_id is not None else None, tsq))
+    return out
+
+
+def retrieve_multi_by_embedding(
+    embedding: List[float],
+    specs: Sequence[Tuple],
+) -> List[Dict[str, Any]]:
+    """
+    Per-collection top-k for several tables in ONE statement / round trip.
+    `specs` is [(table, k, user_id or None[, query_text]), ...]. With `query_text`
+    the collection is ranked hybrid (vector + full-text, reciprocal rank fusion),
+    otherwise by vector distance. The query vector is sent once (as $1 of a
+    prepared statement, or a CTE when prepared statements are off).
+    Returns rows tagged with "collection" (the table name), in per-collection rank order.
+    """
+    specs = _normalize_specs(specs)
+    if not specs:
+        return []
+    if len(specs) == 1 and specs[0][3] is None:
+        table, k, user_id, _ = specs[0]
+        return [{**r, "collection": table} for r in retrieve_top_k_by_embedding(table, embedding, k, user_id)]
+
+    for attempt in range(2):
+        try:
+            with connection() as conn, conn.cursor() as cur:
+                settings = _multi_search_settings_sql(cur, specs)
+                if PG_PREPARE_STATEMENTS:
+                    _execute_multi_prepared(conn, cur, settings, embedding, specs)
+                else:
+                    _execute_multi_inline(cur, settings, embedding, specs)
+                rows = cur.fetchall()
+            break
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if attempt:
+                raise
+
+    return [
+        {"collection": r[0], "id": r[1], "document": r[2], "metadata": r[3], "distance": r[4]}
+        for r in rows
+    ]
+
+
+def _multi_search_settings_sql(cur, specs) -> str:
+    # GUCs apply to the whole statement, so use the most demanding value across tables
+    merged: Dict[str, int] = {}
+    for table, k, _, tsq in specs:
+        # hybrid branches pull a wider vector candidate list
+        for name, value in _search_params(cur, table, _hybrid_candidates(k) if tsq else k).items():
+            merged[name] = max(merged.get(name, 0), value)
+    return _settings_sql(merged)
+
+
+def _hybrid_candidates(k: int) -> int:
+    return max(4 * k, HYBRID_CANDIDATES)
+
+
+def _multi_branches(specs, vector_ref: str, param) -> Tuple[str, List[Any]]:
+    """
+    UNION ALL of per-table subqueries. `param(i)` renders the i-th placeholder;
+    values are appended in the order their placeholders appear in the SQL text.
+    """
+    branches, values = [], []
+
+    def bind(value) -> str:
+        values.append(value)
+        return param(len(values))
+
+    for table, k, user_id, tsq in specs:
+        if tsq is None:
+            where = f"WHERE user_id = {bind(user_id)}" if user_id is not None else ""
+            branches.append(
+                f"(SELECT '{table}' AS collection, id, document, metadata, "
+                f"embedding <=> {vector_ref} AS distance FROM {table} {where} "
+                f"ORDER BY distance ASC LIMIT {bind(k)})"
+            )
+            continue
+
+        # Hybrid: vector top-n and full-text top-n, fused with reciprocal rank fusion
+        n = _hybrid_candidates(k)
+        vec_where = f"WHERE user_id = {bind(user_id)}" if user_id is not None else ""
+        vec_limit = bind(n)
+        tsquery = f"to_tsquery('{TEXT_SEARCH_CONFIG}', {bind(tsq)})"
+        lex_user = f"AND user_id = {bind(user_id)}" if user_id is not None else ""
+        lex_limit = bind(n)
+        final_limit = bind(k)
+        branches.append(f"""(
+            SELECT '{table}' AS collection, t.id, t.document, t.metadata,
+                   t.embedding <=> {vector_ref} AS distance
+            FROM (
+                SELECT id, sum(1.0 / ({RRF_K} + r)) AS score
+                FROM (
+                    SELECT id, row_number() OVER (ORDER BY d) AS r
+                    FROM (SELECT id, embedding <=> {vector_ref} AS d FROM {table} {vec_where}
+                          ORDER BY d LIMIT {vec_limit}) v
+                    UNION ALL
+                    SELECT id, row_number() OVER (ORDER BY s DESC) AS r
+                    FROM (SELECT id, ts_rank_cd({_tsvector_sql()}, q, 32) AS s
+                          FROM {table}, {tsquery} q
+                          WHERE {_tsvector_sql()} @@ q {lex_user}
+                          ORDER BY s DESC LIMIT {lex_limit}) l
+                ) ranks
+                GROUP BY id
+            ) f
+            JOIN {table} t ON t.id = f.id
+            ORDER BY f.score DESC
+            LIMIT {final_limit}
+        )""")
+    return "\nUNION ALL\n".join(branches), values
+
+
+def _execute_multi_prepared(conn: _VectorConnection, cur, settings: str, embedding, specs,
+                            reprepared: bool = False):
+    sql, values = _multi_branches(specs, "$1", lambda i: f"${i + 1}")
+    shape = ",".join(f"{t}:{'u' if u is not None else ''}:{'h' if q else ''}" for t, _, u, q in specs)
+    name = "multi_" + hashlib.sha1(shape.encode()).hexdigest()[:12]
+    types = ["vector"] + ["text" if isinstance(v, str) else "int" for v in values]
+    _prepare(conn, cur, name, f"PREPARE {name} ({', '.join(types)}) AS {sql};")
+    placeholders = ", ".join(["%s::vector"] + ["%s"] * len(values))
+    try:
+        cur.execute(settings + f"EXECUTE {name} ({placeholders});", [embedding, *values])
+    except psycopg2.errors.InvalidSqlStatementName:
+        if reprepared:
+            raise
+        conn.rollback()
+        conn.prepared.discard(name)
+        _execute_multi_prepared(conn, cur, settings, embedding, specs, reprepared=True)
+
+
+def _execute_multi_inline(cur, settings: str, embedding, specs):
+    # the scalar subquery becomes an InitPlan param, so each branch can still use its ANN index
+    sql, values = _multi_branches(specs, "(SELECT v FROM q)", lambda i: "%s")
+    cur.execute(settings + f"WITH q AS (SELECT %s::vector AS v)\n{sql};", [embedding, *values])
+
+
+# ---------- Full-Text Search ----------
+def _tsvector_sql() -> str:
+    # must match the GIN index expression exactly for the index to be used
+    return f"to_tsvector('{_ident(TEXT_SEARCH_CONFIG)}', coalesce(document, ''))"
+
+
+def create_fulltext_index(table: str):
+    """GIN index over the document's tsvector (lexical + hybrid retrieval)."""
+    table = _ident(table)
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_document_fts_idx ON {table} USING gin ({_tsvector_sql()});")
+
+
+def retrieve_lexical(table: str, query_text: str, k: int = 3, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Full-text top-k (no embedding needed). Each row carries "score" in [0, 1)
+    (ts_rank_cd normalized as rank / (rank + 1)) and "distance" = 1 - score so it
+    sorts alongside vector results.
     """
-    conn = get_conn()
-    with conn.cursor() as cur:
+    table = _ident(table)
+    tsq = keyword_tsquery(query_text)
+    if tsq is None:
+        return []
+    user_where = "AND user_id = %s" if user_id is not None else ""
+    params = [tsq] + ([str(user_id)] if user_id is not None else []) + [k]
+    with connection() as conn, conn.cursor() as cur:
         cur.execute(
             f"""
-            SELECT id, document, metadata, embedding <=> %s::vector AS distance
-            FROM {table}
-            ORDER BY distance ASC
+            SELECT id, document, metadata, ts_rank_cd({_tsvector_sql()}, q, 32) AS score
+            FROM {table}, to_tsquery('{TEXT_SEARCH_CONFIG}', %s) q
+            WHERE {_tsvector_sql()} @@ q {user_where}
+            ORDER BY score DESC
             LIMIT %s;
             """,
-            (embedding, k),   # ✅ plain list, but cast to ::vector in SQL
+            params,
         )
         rows = cur.fetchall()
-
     return [
-        {"id": r[0], "document": r[1], "metadata": r[2], "distance": r[3]}
+        {"id": r[0], "document": r[1], "metadata": r[2], "score": float(r[3]), "distance": 1.0 - float(r[3])}
         for r in rows
     ]
 
 
+# ---------- Vector Index Management ----------
+VECTOR_INDEX_METHOD = os.environ.get("VECTOR_INDEX_METHOD", "hnsw")         # "hnsw" or "ivfflat"
+VECTOR_INDEX_MIN_ROWS = int(os.environ.get("VECTOR_INDEX_MIN_ROWS", "1000"))  # below this a seq scan is exact and fast
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "64"))
+RAG_TARGET_RECALL = float(os.environ.get("RAG_TARGET_RECALL", "0.95"))
+# indexes are (re)built by the ingestion scripts in another process, so cached metadata expires
+VECTOR_INDEX_INFO_TTL = float(os.environ.get("VECTOR_INDEX_INFO_TTL", "300"))
+
+# target recall -> (hnsw ef_search, ivfflat probes as a multiple of sqrt(lists))
+_RECALL_SETTINGS = [(0.90, 40, 1.0), (0.95, 64, 2.0), (0.98, 100, 3.0), (0.99, 200, 4.0)]
+
+_index_info: Dict[str, Tuple[Optional[dict], float]] = {}  # table -> (info, monotonic time read)
+_index_info_lock = threading.Lock()
+
+
+def ivfflat_lists_for_rows(rows: int) -> int:
+    """pgvector guidance: rows/1000 up to 1M rows, sqrt(rows) beyond."""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def search_params_for_recall(method: str, k: int, target_recall: float = RAG_TARGET_RECALL,
+                             lists: Optional[int] = None) -> Dict[str, int]:
+    """Query-time knobs (hnsw.ef_search / ivfflat.probes) for an approximate target recall."""
+    ef_search, probe_factor = _RECALL_SETTINGS[-1][1:]
+    for recall, ef, factor in _RECALL_SETTINGS:
+        if target_recall <= recall:
+            ef_search, probe_factor = ef, factor
+            break
+    if method == "hnsw":
+        return {"hnsw.ef_search": max(ef_search, 2 * k)}
+    if method == "ivfflat" and lists:
+        return {"ivfflat.probes": max(1, min(lists, math.ceil(math.sqrt(lists) * probe_factor)))}
+    return {}
+
+
+def _read_index_info(cur, table: str) -> Optional[dict]:
+    cur.execute(
+        """
+        SELECT i.relname, am.amname, i.reloptions, pg_relation_size(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        JOIN pg_am am ON am.oid = i.relam
+        WHERE t.relname = %s AND am.amname IN ('hnsw', 'ivfflat')
+        ORDER BY i.relname
+        LIMIT 1;
+        """,
+        (table,),
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    options = dict(opt.split("=", 1) for opt in (row[2] or []))
+    return {
+        "name": row[0],
+        "method": row[1],
+        "options": {k: int(v) for k, v in options.items() if v.isdigit()},
+        "size_bytes": row[3],
+    }
+
+
+def _search_params(cur, table: str, k: int) -> Dict[str, int]:
+    """ef_search / probes for this table's ANN index (index metadata cached for VECTOR_INDEX_INFO_TTL)."""
+    cached = _index_info.get(table)
+    if cached is None or time.monotonic() - cached[1] >= VECTOR_INDEX_INFO_TTL:
+        info = _read_index_info(cur, table)
+        with _index_info_lock:
+            _index_info[table] = (info, time.monotonic())
+    else:
+        info = cached[0]
+    if info is None:
+        return {}
+    return search_params_for_recall(info["method"], k, lists=info["options"].get("lists"))
+
+
+def _search_settings_sql(cur, table: str, k: int) -> str:
+    """SET LOCAL statements to prepend to a top-k query on `table`."""
+    return _settings_sql(_search_params(cur, table, k))
 
-def create_ivfflat_index(table: str, lists: int = 100):
+
+def _settings_sql(params: Dict[str, int]) -> str:
+    return "".join(f"SET LOCAL {name} = {int(value)}; " for name, value in params.items())
+
+
+def create_vector_index(
+    table: str,
+    method: str = VECTOR_INDEX_METHOD,
+    m: int = HNSW_M,
+    ef_construction: int = HNSW_EF_CONSTRUCTION,
+    lists: Optional[int] = None,
+    min_rows: int = VECTOR_INDEX_MIN_ROWS,
+    rebuild: bool = False,
+) -> Dict[str, Any]:
     """
-    Create an IVFFlat index for efficient similarity search.
-    (Run only after bulk ingestion.)
+    Build an HNSW or IVFFlat cosine index on `table`.embedding after a bulk load.
+
+    IVFFlat `lists` defaults to a value derived from the current row count.
+    An index of the other method is dropped; `rebuild` recreates an existing one
+    (e.g. so IVFFlat lists tracks a grown table). Tables under `min_rows` are
+    left without an ANN index because an exact scan is already fast.
+    Returns {"table", "status", "method", "rows", "build_seconds", "size_bytes", ...};
+    status is "built", "existing" (index already there, nothing built) or "skipped".
     """
-    conn = get_conn()
-    with conn.cursor() as cur:
+    table = _ident(table)
+    if method not in ("hnsw", "ivfflat"):
+        raise ValueError(f"Unknown vector index method: {method!r}")
+    name = f"{table}_embedding_{method}_idx"
+
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {table};")
+        rows = cur.fetchone()[0]
+        if rows < min_rows:
+            print(f"ℹ️ '{table}' has {rows} rows (< {min_rows}) — exact search, no ANN index built.")
+            return {"table": table, "status": "skipped", "method": None, "rows": rows,
+                    "build_seconds": 0.0, "size_bytes": 0}
+
+        # the legacy IVFFlat name and the other method's index
+        other = "ivfflat" if method == "hnsw" else "hnsw"
+        cur.execute(f"DROP INDEX IF EXISTS {table}_embedding_idx;")
+        cur.execute(f"DROP INDEX IF EXISTS {table}_embedding_{other}_idx;")
+        if rebuild:
+            cur.execute(f"DROP INDEX IF EXISTS {name};")
+
+        if method == "hnsw":
+            with_clause = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+            params = {"m": int(m), "ef_construction": int(ef_construction)}
+        else:
+            lists = int(lists or ivfflat_lists_for_rows(rows))
+            with_clause = f"lists = {lists}"
+            params = {"lists": lists}
+
+        cur.execute("SELECT 1 FROM pg_indexes WHERE schemaname = current_schema() AND indexname = %s;", (name,))
+        if cur.fetchone() is not None:
+            info = _read_index_info(cur, table)
+            print(f"ℹ️ {method.upper()} index '{name}' on '{table}' already exists ({info['options']}) — "
+                  f"not rebuilt (pass rebuild=True to recreate it).")
+            return {
+                "table": table,
+                "status": "existing",
+                "index": name,
+                "method": method,
+                "params": info["options"],
+                "rows": rows,
+                "build_seconds": 0.0,
+                "size_bytes": info["size_bytes"],
+                "search": search_params_for_recall(method, k=10, lists=info["options"].get("lists")),
+            }
+
+        start = time.perf_counter()
         cur.execute(
             f"""
-            CREATE INDEX IF NOT EXISTS {table}_embedding_idx
+            CREATE INDEX {name}
             ON {table}
-            USING ivfflat (embedding vector_cosine_ops)
-            WITH (lists = %s);
-            """,
-            (lists,),
+            USING {method} (embedding vector_cosine_ops)
+            WITH ({with_clause});
+            """
         )
-    conn.commit()
-    print(f"✅ IVFFlat index created for '{table}' (lists={lists}).")
+        build_seconds = time.perf_counter() - start
+        cur.execute("SELECT pg_relation_size(%s::regclass);", (name,))
+        size_bytes = cur.fetchone()[0]
+
+    with _index_info_lock:
+        _index_info.pop(table, None)  # re-read on next query
+
+    report = {
+        "table": table,
+        "status": "built",
+        "index": name,
+        "method": method,
+        "params": params,
+        "rows": rows,
+        "build_seconds": round(build_seconds, 2),
+        "size_bytes": size_bytes,
+        "search": search_params_for_recall(method, k=10, lists=params.get("lists")),
+    }
+    print(f"✅ {method.upper()} index '{name}' on '{table}' ({rows} rows, {params}) "
+          f"built in {build_seconds:.1f}s, {size_bytes / 1_048_576:.1f} MB.")
+    return report
+
+
+def create_ivfflat_index(table: str, lists: Optional[int] = None):
+    """
+    Create an IVFFlat index for efficient similarity search.
+    (Run only after bulk ingestion.) `lists` defaults to one derived from the row count.
+    """
+    return create_vector_index(table, method="ivfflat", lists=lists, rebuild=True)
+
+
+def describe_vector_index(table: str) -> Optional[dict]:
+    """Method, options and on-disk size of the ANN index on `table` (None if there isn't one)."""
+    table = _ident(table)
+    with connection() as conn, conn.cursor() as cur:
+        return _read_index_info(cur, table)
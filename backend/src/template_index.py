@@ -0,0 +1,143 @@
+# backend/src/template_index.py
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.lexical import BM25
+
+# ---------- ENV CONFIG ----------
+# Safety net for writes made by other processes (e.g. scripts/ingest_templates.py);
+# writes from this process refresh the matrix immediately via the write listener.
+TEMPLATE_INDEX_TTL = float(os.getenv("TEMPLATE_INDEX_TTL", "300"))
+
+
+class InMemoryVectorIndex:
+    """
+    Small collection held as one contiguous, L2-normalized float32 matrix.
+    Ranking is a single matrix-vector product, so a search over a few dozen
+    rows takes microseconds instead of a database round trip.
+
+    Results have the same shape as retrieve_top_k_by_embedding:
+    {"id", "document", "metadata", "distance"} with distance = cosine distance.
+    """
+
+    def __init__(self, loader: Callable[[], List[Dict[str, Any]]], ttl_seconds: float = TEMPLATE_INDEX_TTL):
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # single-flight: concurrent misses share one load
+        self._generation = 0                # bumped by invalidate()
+        self._matrix: Optional[np.ndarray] = None
+        self._rows: List[Dict[str, Any]] = []
+        self._bm25: Optional[BM25] = None
+        self._loaded_at = 0.0
+        self._stale = True
+        self.loads = 0
+        self.searches = 0
+
+    # --- loading ---
+    def load(self):
+        """(Re)load rows from the loader and rebuild the matrix."""
+        with self._load_lock:
+            self._load()
+
+    def _ensure_loaded(self):
+        if self._needs_reload():
+            with self._load_lock:
+                if self._needs_reload():  # another thread may have loaded while we waited
+                    self._load()
+
+    def _load(self):
+        with self._lock:
+            generation = self._generation
+        rows = self._loader()
+        matrix, kept = self._build(rows)
+        bm25 = BM25([self._lexical_text(r) for r in kept])
+        with self._lock:
+            if generation != self._generation and self._matrix is not None:
+                # invalidated mid-load: these rows may predate the write; the next search reloads
+                return
+            self._matrix, self._rows, self._bm25 = matrix, kept, bm25
+            self._loaded_at = time.monotonic()
+            self._stale = generation != self._generation
+            self.loads += 1
+        print(f"✅ In-memory vector index loaded ({len(kept)} rows).")
+
+    def invalidate(self, *_):
+        """Mark the matrix stale; the next search reloads it. Usable as a write listener."""
+        with self._lock:
+            self._generation += 1
+            self._stale = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._matrix is not None
+
+    def _needs_reload(self) -> bool:
+        return (self._matrix is None or self._stale
+                or time.monotonic() - self._loaded_at > self.ttl_seconds)
+
+    @staticmethod
+    def _build(rows: Sequence[Dict[str, Any]]):
+        kept = [r for r in rows if r.get("embedding") is not None]
+        if not kept:
+            return np.zeros((0, 0), dtype=np.float32), []
+        matrix = np.ascontiguousarray(np.vstack([np.asarray(r["embedding"], dtype=np.float32) for r in kept]))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        # keep only what results need; the matrix holds the vectors
+        rows_out = [{"id": r["id"], "document": r["document"], "metadata": r["metadata"]} for r in kept]
+        return matrix, rows_out
+
+    # --- search ---
+    def search(self, embedding: Sequence[float], k: int = 3) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        with self._lock:
+            matrix, rows = self._matrix, self._rows
+        self.searches += 1
+        if not rows or k <= 0:
+            return []
+
+        q = np.asarray(embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm:
+            q = q / q_norm
+        sims = matrix @ q
+        k = min(k, len(rows))
+        top = np.argpartition(-sims, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-sims[top])]
+        return [{**rows[i], "distance": float(1.0 - sims[i])} for i in top]
+
+    @staticmethod
+    def _lexical_text(row: Dict[str, Any]) -> str:
+        meta = row.get("metadata") or {}
+        return " ".join(str(x) for x in (meta.get("title"), meta.get("subject"), row.get("document")) if x)
+
+    def search_lexical(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        BM25 keyword ranking over title/subject/document — no embedding needed.
+        Rows with no matching term are left out; "distance" = 1 - score/(score+1).
+        """
+        self._ensure_loaded()
+        with self._lock:
+            rows, bm25 = self._rows, self._bm25
+        if not rows or bm25 is None or k <= 0:
+            return []
+        scores = bm25.scores(query)
+        ranked = sorted((i for i, sc in enumerate(scores) if sc > 0), key=lambda i: -scores[i])[:k]
+        return [{**rows[i], "score": scores[i], "distance": 1.0 - scores[i] / (scores[i] + 1.0)} for i in ranked]
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = len(self._rows)
+            dim = int(self._matrix.shape[1]) if self._matrix is not None and n else 0
+        return {
+            "rows": n,
+            "dim": dim,
+            "loads": self.loads,
+            "searches": self.searches,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
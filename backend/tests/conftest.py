@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+import sys
+from pathlib import Path
+
+# tests import the app as `src.*`, like the server does when started from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
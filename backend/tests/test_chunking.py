@@ -0,0 +1,52 @@
+# backend/tests/test_chunking.py
+from src.chunking import chunk_pages, is_heading
+
+# pdfplumber-style page: one line per printed line, no blank lines between blocks
+PAGE = """CHAPTER 2
+MOTION
+2.1 Describing Motion
+An object is said to be in motion when its
+position changes with time. In
+1947 India became independent and the
+country grew quickly.
+2.2 Measuring the rate of motion
+Speed is the distance covered in unit time.
+Exercises
+3 Find the value of x
+in the equation below.
+4 Motion and Rest
+Everything around us is at rest or in motion."""
+
+
+def test_numbered_headings_without_blank_lines():
+    assert is_heading("2.1 Describing Motion", "An object is said", "")
+    assert is_heading("2.2 Measuring the rate of motion", "Speed is", "covered in unit time.")
+    assert is_heading("4 Motion and Rest", "Everything around us")
+
+
+def test_numbered_body_lines_are_not_headings():
+    assert not is_heading("1947 India became independent and the", "country grew", "changes with time. In")
+    assert not is_heading("3 Find the value of x", "in the equation below.")
+    assert not is_heading("3 Find the value of x", "Solve it.")
+    assert not is_heading("2.1 Describing Motion", "", "position changes with")
+
+
+def test_prefixed_and_all_caps_headings():
+    assert is_heading("Chapter 3", "the")
+    assert is_heading("CELLS AND TISSUES", "x")
+    assert not is_heading("Cells are the building blocks of life.")
+
+
+def test_chunks_follow_pdfplumber_sections():
+    chunks = list(chunk_pages([(7, PAGE)], max_tokens=200, overlap_tokens=0))
+    sections = [c.section for c in chunks]
+    assert sections == [
+        "CHAPTER 2: MOTION: 2.1 Describing Motion",
+        "2.2 Measuring the rate of motion",
+        "4 Motion and Rest",
+    ]
+    # headings stay in the text; numbered body lines stay in their paragraph
+    assert chunks[0].text.startswith("CHAPTER 2 MOTION 2.1 Describing Motion An object")
+    assert "In 1947 India became independent and the country grew quickly." in chunks[0].text
+    assert "3 Find the value of x in the equation below." in chunks[1].text
+    assert all(c.page_start == c.page_end == 7 for c in chunks)
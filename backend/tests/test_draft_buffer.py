@@ -0,0 +1,115 @@
+# backend/tests/test_draft_buffer.py
+import asyncio
+
+from src.draft_buffer import DraftWriteBuffer
+
+
+class FakeStore:
+    """flush_fn recording what reached the "database"; can fail or block per content."""
+
+    def __init__(self):
+        self.saved = []
+        self.fail = set()
+        self.gates = {}
+
+    async def flush(self, draft_id, content, author_id, author_name):
+        if content in self.gates:
+            await self.gates[content].wait()
+        if content in self.fail:
+            raise RuntimeError("db down")
+        self.saved.append((draft_id, content))
+        return {"status": "saved", "version": len(self.saved)}
+
+
+def _buffer(store, **kwargs):
+    kwargs.setdefault("dead_letter_path", None)
+    return DraftWriteBuffer(store.flush, idle_seconds=0, interval=0, tick=0.01, **kwargs)
+
+
+def test_burst_of_saves_is_written_once():
+    async def run():
+        store = FakeStore()
+        buffer = _buffer(store)
+        for i in range(5):
+            buffer.submit("d1", f"v{i}")
+        await buffer.flush_due()
+        return store.saved
+
+    assert asyncio.run(run()) == [("d1", "v4")]
+
+
+def test_failed_flush_does_not_overwrite_newer_checkpoint():
+    async def run():
+        store = FakeStore()
+        store.fail.add("old")
+        store.gates["old"] = asyncio.Event()
+        buffer = _buffer(store, backoff=0)
+        buffer.submit("d1", "old")
+        flush = asyncio.create_task(buffer.flush_due())
+        await asyncio.sleep(0)                # "old" holds the draft's lock
+        checkpoint = asyncio.create_task(buffer.checkpoint("d1", "new"))
+        await asyncio.sleep(0)                # "new" waits for the lock
+        store.gates["old"].set()              # ... and "old" fails
+        await asyncio.gather(flush, checkpoint)
+        store.fail.clear()
+        await buffer.flush_due()              # a retry would write "old" here
+        return store.saved, buffer.pending("d1")
+
+    saved, pending = asyncio.run(run())
+    assert saved == [("d1", "new")]
+    assert not pending
+
+
+def test_stale_flush_is_dropped_when_it_gets_the_lock():
+    async def run():
+        store = FakeStore()
+        store.gates["new"] = asyncio.Event()
+        buffer = _buffer(store)
+        checkpoint = asyncio.create_task(buffer.checkpoint("d1", "new"))
+        await asyncio.sleep(0)                # checkpoint holds the lock
+        buffer.submit("d1", "autosave")
+        flush = asyncio.create_task(buffer.flush_due())
+        await asyncio.sleep(0)
+        later = asyncio.create_task(buffer.checkpoint("d1", "newer"))
+        store.gates["new"].set()
+        await asyncio.gather(checkpoint, flush, later)
+        return store.saved, buffer.stats()["stale"]
+
+    saved, stale = asyncio.run(run())
+    assert saved == [("d1", "new"), ("d1", "newer")]
+    assert stale == 1
+
+
+def test_failures_back_off_then_dead_letter(tmp_path):
+    async def run():
+        store = FakeStore()
+        store.fail.add("lost")
+        path = tmp_path / "dead.json"
+        buffer = _buffer(store, max_attempts=3, backoff=0.01, backoff_max=0.02, dead_letter_path=path)
+        buffer.submit("d1", "lost")
+        buffer.start()
+        await asyncio.sleep(0.3)
+        await buffer.stop()
+        return buffer, path
+
+    buffer, path = asyncio.run(run())
+    assert buffer.stats()["failures"] == 3
+    assert not buffer.pending("d1")
+    assert buffer.dead_letter("d1")["content"] == "lost"
+    # persisted: a restarted server still has it
+    reloaded = DraftWriteBuffer(FakeStore().flush, dead_letter_path=path)
+    assert reloaded.dead_letter("d1")["content"] == "lost"
+
+
+def test_successful_save_clears_dead_letter(tmp_path):
+    async def run():
+        store = FakeStore()
+        store.fail.add("lost")
+        buffer = _buffer(store, max_attempts=1, dead_letter_path=tmp_path / "dead.json")
+        buffer.submit("d1", "lost")
+        await buffer.flush_due()
+        assert buffer.dead_letter("d1") is not None
+        await buffer.checkpoint("d1", "saved")
+        return buffer
+
+    assert asyncio.run(run()).dead_letter("d1") is None
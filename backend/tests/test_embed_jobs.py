@@ -0,0 +1,109 @@
+# backend/tests/test_embed_jobs.py
+import asyncio
+
+import pytest
+
+from src.embed_jobs import EmbedJobWorker, JobStore, SQLiteJobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteJobStore(tmp_path / "jobs.sqlite")
+    yield store
+    store.close()
+
+
+def _template(template_id, content="text"):
+    return {"id": template_id, "user_id": "u1", "title": "t", "content": content}
+
+
+def test_job_store_is_abstract():
+    with pytest.raises(TypeError):
+        JobStore()
+
+
+def test_claim_and_complete(store):
+    job = store.enqueue(_template(1))
+    assert store.get(job["id"])["queue_position"] == 0
+
+    claimed = store.claim(10)
+    assert [j["id"] for j in claimed] == [job["id"]]
+    assert claimed[0]["payload"]["id"] == 1
+    assert claimed[0]["attempts"] == 1
+    assert store.claim(10) == []            # running jobs aren't handed out twice
+
+    store.mark_done([job["id"]])
+    assert store.get(job["id"])["status"] == "done"
+    assert store.counts() == {"done": 1}
+
+
+def test_enqueue_coalesces_queued_template(store):
+    first = store.enqueue(_template(1, "old"))
+    second = store.enqueue(_template(1, "new"))
+    assert second == {"id": first["id"], "status": "queued", "coalesced": True}
+    assert store.claim(10)[0]["payload"]["content"] == "new"
+
+
+def test_failed_job_retries_then_fails(store):
+    job = store.enqueue(_template(1))
+    for attempt in range(1, 4):
+        claimed = store.claim(10, retry_delay=0)
+        assert [j["attempts"] for j in claimed] == [attempt]
+        store.mark_failed([job["id"]], "boom", max_attempts=3)
+    row = store.get(job["id"])
+    assert (row["status"], row["attempts"], row["error"]) == ("failed", 3, "boom")
+    assert store.claim(10, retry_delay=0) == []
+
+
+def test_failed_job_waits_for_retry_delay(store):
+    job = store.enqueue(_template(1))
+    store.claim(10)
+    store.mark_failed([job["id"]], "boom")
+    assert store.get(job["id"])["status"] == "queued"
+    assert store.claim(10, retry_delay=3600) == []
+    assert len(store.claim(10, retry_delay=0)) == 1
+
+
+def test_failure_superseded_by_newer_enqueue(store):
+    job = store.enqueue(_template(1, "old"))
+    store.claim(10)
+    newer = store.enqueue(_template(1, "new"))
+    assert newer["id"] != job["id"]
+    store.mark_failed([job["id"]], "boom")
+    assert store.get(job["id"])["status"] == "superseded"
+    assert store.get(newer["id"])["status"] == "queued"
+
+
+def test_stale_lease_is_reclaimed(store):
+    job = store.enqueue(_template(1))
+    store.claim(10)                          # worker dies without reporting back
+    assert store.claim(10, lease_seconds=3600) == []
+    reclaimed = store.claim(10, lease_seconds=0)
+    assert [(j["id"], j["attempts"]) for j in reclaimed] == [(job["id"], 2)]
+
+
+def test_mark_failed_ignores_jobs_no_longer_running(store):
+    job = store.enqueue(_template(1))
+    store.claim(10)
+    store.mark_done([job["id"]])
+    store.mark_failed([job["id"]], "late failure from a lost lease", max_attempts=1)
+    assert store.get(job["id"])["status"] == "done"
+
+
+def test_worker_retries_failed_batch_one_by_one(store):
+    processed = []
+
+    def process(payloads):
+        if any(p["content"] == "bad" for p in payloads):
+            raise ValueError("bad template")
+        processed.extend(p["id"] for p in payloads)
+
+    async def run():
+        worker = EmbedJobWorker(process, store_factory=lambda: store)
+        ids = [(await worker.enqueue(_template(i, "bad" if i == 2 else "ok")))["id"] for i in range(1, 4)]
+        await worker.run_once()
+        return ids
+
+    ids = asyncio.run(run())
+    assert sorted(processed) == [1, 3]
+    assert [store.get(i)["status"] for i in ids] == ["done", "queued", "done"]
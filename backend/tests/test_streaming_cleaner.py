@@ -0,0 +1,31 @@
+# backend/tests/test_streaming_cleaner.py
+import pytest
+
+pytest.importorskip("markdownify")
+
+from src.llm import StreamingMarkdownCleaner, clean_text_output
+
+CASES = [
+    # multi-paragraph
+    "<p>First paragraph.</p>\n<p>Second paragraph.</p>\n<h2>Next</h2>\n<p>Third.</p>",
+    # list between heading and paragraph
+    "<h1>Plan</h1>\n<ul>\n<li>One</li>\n<li>Two</li>\n</ul>\n<p>After list.</p>",
+    # fenced, multi-line paragraph, ordered list, headings
+    "```html\n<h2>Intro</h2>\n<p>Multi\nline para.</p>\n<ol>\n<li>a</li>\n<li>b</li>\n</ol>\n<h3>End</h3>\n```",
+    # blocks on one line, extra blank lines
+    "<p>a</p><p>b</p>\n\n\n<h2>X</h2>",
+    # plain Markdown passes through
+    "## Heading\n\n\n\n- item\n- item\n\nText.\n",
+]
+
+
+def _stream(text: str, size: int) -> str:
+    cleaner = StreamingMarkdownCleaner()
+    out = "".join(cleaner.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return out + cleaner.flush()
+
+
+@pytest.mark.parametrize("text", CASES)
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_stream_matches_clean_text_output(text, size):
+    assert _stream(text, size) == clean_text_output(text)
@@ -0,0 +1,48 @@
+# backend/tests/test_template_index.py
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from src.template_index import InMemoryVectorIndex
+
+
+def _row(i, title):
+    return {"id": i, "document": title, "metadata": {"title": title}, "embedding": [1.0, float(i)]}
+
+
+def test_invalidation_during_load_is_not_lost():
+    table = [_row(1, "old")]
+    index = None
+
+    def loader():
+        rows = list(table)
+        if index.loads == 0:
+            # a write lands (and invalidates) while this load is in flight
+            table[0] = _row(1, "new")
+            index.invalidate()
+        return rows
+
+    index = InMemoryVectorIndex(loader)
+    index.search([1.0, 1.0], k=1)           # serves the first load, but keeps it stale
+    assert index.search([1.0, 1.0], k=1)[0]["document"] == "new"
+    assert index.loads == 2
+
+
+def test_concurrent_misses_share_one_load():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return [_row(1, "a"), _row(2, "b")]
+
+    index = InMemoryVectorIndex(loader)
+    threads = [threading.Thread(target=index.search, args=([1.0, 0.0],)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
@@ -18,8 +18,9 @@ export async function POST(req: NextRequest) {
       throw new Error(`Backend error: ${backendResponse.status} - ${errorText}`);
     }
 
+    // 202 + job id: the embedding runs in a backend job
     const result = await backendResponse.json();
-    return NextResponse.json(result);
+    return NextResponse.json(result, { status: backendResponse.status });
 
   } catch (error) {
     console.error("Embedding API error:", error);
@@ -30,27 +30,31 @@ export async function GET(
     }
 
     // 2. Fetch version content if version_id exists
+    // (most versions are stored as deltas, so the backend rebuilds the text)
     let versionNumber = null;
     let versionContent = null;
 
     if (submission.version_id) {
-      const { data: version, error: versionError } = await supabase
-        .from("draft_versions")
-        .select("id, version_number, content")
-        .eq("id", submission.version_id)
-        .single();
+      const backendUrl = process.env.BACKEND_URL || "http://127.0.0.1:8000";
+      const versionRes = await fetch(
+        `${backendUrl}/drafts/${submission.draft_id}/versions/${submission.version_id}/content`,
+        { cache: "no-store" }
+      );
 
-      if (!versionError && version) {
+      if (versionRes.ok) {
+        const version = await versionRes.json();
         versionContent = version.content;
         versionNumber = version.version_number;
       } else {
-        console.warn("Version not found:", submission.version_id, versionError);
+        console.warn("Version not found:", submission.version_id, versionRes.status);
       }
     }
 
     // 3. Fallback to draft content if version content not available
-    if (!versionContent && submission.drafts && Array.isArray(submission.drafts) && submission.drafts[0]?.content) {
-      versionContent = submission.drafts[0].content;
+    // (the to-one join returns an object; older clients typed it as an array)
+    const draft: any = Array.isArray(submission.drafts) ? submission.drafts[0] : submission.drafts;
+    if (!versionContent && draft?.content) {
+      versionContent = draft.content;
     }
 
     // 4. Return complete submission data
@@ -55,28 +55,28 @@ export default function SubmissionModal({
           .eq("id", draftId)
           .single();
 
-        // Get the next version number
-        const { data: existingVersions } = await supabase
-          .from("draft_versions")
-          .select("version_number")
-          .eq("draft_id", draftId)
-          .order("version_number", { ascending: false })
-          .limit(1);
-
-        const nextVersionNumber = existingVersions?.length 
-          ? (existingVersions[0].version_number || 0) + 1 
-          : 1;
+        // Saved through the backend (save_draft_version), which numbers the
+        // version, hashes it and stores it in the delta chain
+        const res = await fetch(
+          `${process.env.NEXT_PUBLIC_BACKEND_URL}/drafts/${draftId}/save_version`,
+          {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({
+              content: draftData?.content || "<p>No content available</p>",
+              checkpoint: true,
+              user_id: user.id,
+            }),
+          }
+        );
+        if (!res.ok) throw new Error(`Saving a version failed (${res.status})`);
+        const saved = await res.json();
 
         const { data: newVersion, error: newVersionError } = await supabase
           .from("draft_versions")
-          .insert([
-            {
-              draft_id: draftId,
-              content: draftData?.content || "<p>No content available</p>",
-              version_number: nextVersionNumber,
-            },
-          ])
           .select("id")
+          .eq("draft_id", draftId)
+          .eq("version_number", saved.version)
           .single();
 
         if (newVersionError) throw newVersionError;
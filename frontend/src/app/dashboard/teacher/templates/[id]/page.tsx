@@ -53,7 +53,7 @@ export default function EditTemplatePage() {
       });
 
       if (!resp.ok) throw new Error("Embedding failed");
-      console.log("✅ Template embedding updated in user_templates_vector");
+      console.log("✅ Template embedding queued for user_templates_vector");
     } catch (err) {
       console.error("Embedding error:", err);
       alert("⚠️ Template updated but embedding not refreshed");
@@ -16,6 +16,7 @@ import { LiveblocksYjsProvider } from "@liveblocks/yjs";
 import * as Y from "yjs";
 import TurndownService from "turndown";
 import { marked } from "marked";
+import { showNotification } from "@/utils/notifications";
 import {
   Bold,
   Italic,
@@ -42,6 +43,10 @@ type LocalUser = {
 };
 
 // ✅ Mobile-Optimized Toolbar Component
+// Local edits are autosaved this long after typing stops. The backend buffers
+// autosaves (no checkpoint) and writes one version once the draft goes quiet.
+const AUTOSAVE_DEBOUNCE_MS = 3000;
+
 const Toolbar = ({ editor }: { editor: any }) => {
   if (!editor) return null;
 
@@ -286,6 +291,48 @@ export default function CollaborativeEditor({
   const [isSaving, setIsSaving] = useState(false);
   const [connectionStatus, setConnectionStatus] = useState<string>("connecting");
   const initContentRef = useRef<string | undefined>(undefined);
+  const autosaveTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
+  const unsavedNoticeRef = useRef(false);
+
+  const cancelAutosave = () => {
+    if (autosaveTimerRef.current) {
+      clearTimeout(autosaveTimerRef.current);
+      autosaveTimerRef.current = null;
+    }
+  };
+
+  // Debounced autosave of local edits, buffered server-side (no version broadcast:
+  // the version is only written when the buffer flushes)
+  const scheduleAutosave = (currentEditor: any) => {
+    cancelAutosave();
+    autosaveTimerRef.current = setTimeout(async () => {
+      autosaveTimerRef.current = null;
+      try {
+        const markdownContent = new TurndownService().turndown(currentEditor.getHTML());
+        const draftId = roomId.replace("draft-", "");
+        const res = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_URL}/drafts/${draftId}/save_version`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({
+            content: markdownContent,
+            checkpoint: false, // autosave: coalesced into the next buffered version
+            user_id: localUser?.id,
+            user_name: localUser?.name,
+          }),
+        });
+        const data = await res.json();
+        // an earlier autosave exhausted its retries on the server: ask for an explicit save
+        if (data.unsaved && !unsavedNoticeRef.current) {
+          unsavedNoticeRef.current = true;
+          showNotification("Some autosaved changes could not be stored. Click Save to keep your latest edits.", "error");
+        }
+      } catch (error) {
+        console.error("Autosave error:", error);
+      }
+    }, AUTOSAVE_DEBOUNCE_MS);
+  };
+
+  useEffect(() => cancelAutosave, []);
 
   // Initialize provider with room readiness check
   useEffect(() => {
@@ -642,6 +689,7 @@ export default function CollaborativeEditor({
         // Test if document updates are working
         if (!isRemote) {
           console.log("📤 Local change detected, should sync to other users");
+          scheduleAutosave(editor);
         } else {
           console.log("� Remote change received from another user");
         }
@@ -897,6 +945,8 @@ export default function CollaborativeEditor({
 
   const handleSave = async () => {
     if (!editor) return;
+    cancelAutosave(); // the checkpoint below supersedes it
+    unsavedNoticeRef.current = false;
     setIsSaving(true);
     
     // Notify parent component that saving has started
@@ -912,7 +962,12 @@ export default function CollaborativeEditor({
         {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ content: markdownContent }),
+          body: JSON.stringify({
+            content: markdownContent,
+            checkpoint: true, // explicit save: write the version now
+            user_id: localUser?.id,
+            user_name: localUser?.name,
+          }),
         }
       );
       const data = await res.json();
@@ -11,22 +11,33 @@ export default function HistorySidebar({ draftId }: { draftId: string }) {
   const [error, setError] = useState<string | null>(null);
   const [selectedVersion, setSelectedVersion] = useState<any>(null);
   const [isRestoring, setIsRestoring] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  // Metadata-only pages (newest first); content is fetched when a version is opened
+  const fetchPage = async (cursor: string | null) => {
+    const params = new URLSearchParams({ limit: "20" });
+    if (cursor) params.set("cursor", cursor);
+    const url = `${process.env.NEXT_PUBLIC_BACKEND_URL}/drafts/${draftId}/versions?${params}`;
+    console.log("🔄 Fetching versions from:", url);
+
+    const res = await fetch(url);
+    console.log("📡 Response status:", res.status);
+
+    if (!res.ok) {
+      throw new Error(`HTTP ${res.status}: ${res.statusText}`);
+    }
+
+    const data = await res.json();
+    return { page: Array.isArray(data) ? data : [], cursor: res.headers.get("X-Next-Cursor") };
+  };
 
   const fetchVersions = async () => {
     try {
-      const url = `${process.env.NEXT_PUBLIC_BACKEND_URL}/drafts/${draftId}/versions`;
-      console.log("🔄 Fetching versions from:", url);
-      
-      const res = await fetch(url);
-      console.log("📡 Response status:", res.status);
-      
-      if (!res.ok) {
-        throw new Error(`HTTP ${res.status}: ${res.statusText}`);
-      }
-      
-      const data = await res.json();
-      console.log("📊 Fetched versions:", data);
-      setVersions(Array.isArray(data) ? data : []);
+      const { page, cursor } = await fetchPage(null);
+      console.log("📊 Fetched versions:", page);
+      setVersions(page);
+      setNextCursor(cursor);
       setError(null);
     } catch (err) {
       console.error("❌ Error fetching versions:", err);
@@ -49,15 +60,51 @@ export default function HistorySidebar({ draftId }: { draftId: string }) {
     };
   }, [draftId]);
 
-  const handleView = (version: any) => {
-    setSelectedVersion(version);
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const { page, cursor } = await fetchPage(nextCursor);
+      setVersions((prev) => [...prev, ...page]);
+      setNextCursor(cursor);
+    } catch (err) {
+      console.error("❌ Error fetching more versions:", err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const withContent = async (version: any) => {
+    if (typeof version.content === "string") return version;
+    const res = await fetch(
+      `${process.env.NEXT_PUBLIC_BACKEND_URL}/drafts/${draftId}/versions/${version.id}/content`
+    );
+    if (!res.ok) {
+      throw new Error(`HTTP ${res.status}: ${res.statusText}`);
+    }
+    const { content } = await res.json();
+    const loaded = { ...version, content };
+    setVersions((prev) => prev.map((v) => (v.id === version.id ? loaded : v)));
+    return loaded;
   };
 
-  const handleRestore = (version: any) => {
-    setSelectedVersion(version);
-    setIsRestoring(true);
+  const openVersion = async (version: any, restoring: boolean) => {
+    try {
+      setSelectedVersion(await withContent(version));
+      setIsRestoring(restoring);
+    } catch (err) {
+      console.error("❌ Error fetching version content:", err);
+      const event = new CustomEvent("show-notification", {
+        detail: { message: "Failed to load version", type: "error" }
+      });
+      window.dispatchEvent(event);
+    }
   };
 
+  const handleView = (version: any) => openVersion(version, false);
+
+  const handleRestore = (version: any) => openVersion(version, true);
+
   const confirmRestore = async (versionId: string) => {
     try {
       const res = await fetch(
@@ -131,7 +178,7 @@ export default function HistorySidebar({ draftId }: { draftId: string }) {
     <aside className="p-3 sm:p-6 bg-gradient-to-br from-gray-50 to-gray-100 dark:from-gray-800 dark:to-gray-900 h-full">
       <div className="mb-4 sm:mb-6">
         <h3 className="text-base sm:text-lg font-bold text-gray-900 dark:text-gray-100 mb-1">Version History</h3>
-        <p className="text-xs text-gray-500 dark:text-gray-400">{versions.length} versions saved</p>
+        <p className="text-xs text-gray-500 dark:text-gray-400">{versions[0]?.version_number ?? versions.length} versions saved</p>
       </div>
 
       {versions.length === 0 ? (
@@ -208,6 +255,16 @@ export default function HistorySidebar({ draftId }: { draftId: string }) {
               </li>
             ))}
           </ul>
+
+          {nextCursor && (
+            <button
+              className="mt-4 w-full px-3 py-2 text-xs font-medium text-blue-600 dark:text-blue-400 bg-blue-50 dark:bg-blue-900/30 rounded-lg hover:bg-blue-100 dark:hover:bg-blue-900/50 transition-all duration-200 disabled:opacity-50"
+              onClick={loadMore}
+              disabled={loadingMore}
+            >
+              {loadingMore ? "Loading..." : "Load older versions"}
+            </button>
+          )}
         </div>
       )}
 
@@ -220,7 +277,7 @@ export default function HistorySidebar({ draftId }: { draftId: string }) {
           }}
           isRestoring={isRestoring}
           onConfirmRestore={() => { confirmRestore(selectedVersion.id); }}
-          totalVersions={versions.length}
+          totalVersions={versions[0]?.version_number ?? versions.length}
         />
       )}
     </aside>